@@ -0,0 +1,50 @@
+from datetime import date
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.messages.storage import default_storage
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.management import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import reverse
+
+from apps.core.views import Dashboard
+from apps.people.models import ArtaUser
+from arta.common.versions import PROCESS_LOCAL_CACHES
+
+
+class Command(BaseCommand):
+    help = 'Render the dashboard for users, to fill the cache of rendered events (e.g. after a deploy or event change)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_id', type=int, nargs='*',
+            help='Users to render the dashboard for (default: all users with registrations for upcoming events)',
+        )
+
+    def handle(self, *args, **kwargs):
+        backend = settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            # The rendered dashboards would be thrown away when this command exits
+            raise CommandError(
+                "The default cache ({}) is local to this process, this needs a shared cache".format(backend),
+            )
+
+        users = ArtaUser.objects.filter(is_active=True)
+        if kwargs['user_id']:
+            users = users.filter(pk__in=kwargs['user_id'])
+        else:
+            users = users.filter(registrations__event__end_date__gte=date.today()).distinct()
+
+        view = Dashboard.as_view()
+        factory = RequestFactory()
+        count = 0
+        for user in users.iterator():
+            request = factory.get(reverse('core:dashboard'))
+            request.user = user
+            # Empty session and messages for the base template, not saved
+            request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+            request._messages = default_storage(request)
+            view(request)
+            count += 1
+        self.stdout.write("Rendered the dashboard for {} users\n".format(count))
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import tracemalloc
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import Client, SimpleTestCase, TransactionTestCase, skipUnlessDBFeature, tag
+from django.urls import reverse
+
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+from apps.registrations.opening import OpeningStreamApp
+from apps.registrations.tests.factories import RegistrationFactory
+from arta.common.asgi import ThreadedWSGIApp
+
+from .test_parallel_users import Stopwatch
+
+
+def run_async(coro):
+    """ Runs the coroutine in a new event loop and returns its result, like asyncio.run() (added in Python 3.7). """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def asgi_request(app, path, method='GET', query_string=b'', headers=(), body=b''):
+    """ Runs a single request through the given ASGI app, returning its status, headers (dict) and body. """
+    # Send the body in two parts, to check that these are combined
+    messages = [
+        {'type': 'http.request', 'body': body[:1], 'more_body': True},
+        {'type': 'http.request', 'body': body[1:], 'more_body': False},
+    ]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # Only disconnect when the request is cancelled
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'headers': list(headers),
+        'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 12345), 'http_version': '1.1',
+    }
+    await app(scope, receive, send)
+    start, *bodies = sent
+    return start['status'], dict(start['headers']), b''.join(m['body'] for m in bodies)
+
+
+def echo_app(environ, start_response):
+    """ WSGI application that returns parts of the environ (in multiple chunks). """
+    start_response('201 Created', [('Content-Type', 'text/plain'), ('X-Thread', threading.current_thread().name)])
+    return [
+        b'',
+        '{REQUEST_METHOD} {PATH_INFO}?{QUERY_STRING}\n'.format(**environ).encode('latin1'),
+        '{} {}\n'.format(environ.get('CONTENT_TYPE'), environ.get('HTTP_X_TEST')).encode('latin1'),
+        environ['wsgi.input'].read(),
+    ]
+
+
+class TestThreadedWSGIApp(SimpleTestCase):
+    def test_environ(self):
+        """ Check that the request is translated to WSGI and the response back. """
+        app = ThreadedWSGIApp(echo_app, max_workers=1)
+        status, headers, body = run_async(asgi_request(
+            app, '/ä/', method='POST', query_string=b'a=1', body=b'body',
+            headers=[(b'content-type', b'text/plain'), (b'x-test', b'a'), (b'x-test', b'b')],
+        ))
+        self.assertEqual(status, 201)
+        self.assertEqual(headers[b'content-type'], b'text/plain')
+        self.assertTrue(headers[b'x-thread'].startswith(b'wsgi'))
+        # PATH_INFO is bytes decoded as latin1, as usual for WSGI
+        self.assertEqual(body, 'POST /ä/?a=1\ntext/plain a,b\nbody'.encode())
+
+    def test_concurrency(self):
+        """ Check that concurrent requests are limited to the given number of threads. """
+        app = ThreadedWSGIApp(echo_app, max_workers=2)
+
+        async def run():
+            return await asyncio.gather(*(asgi_request(app, '/') for i in range(10)))
+
+        threads = {headers[b'x-thread'] for (status, headers, body) in run_async(run())}
+        self.assertLessEqual(len(threads), 2)
+
+    def test_django(self):
+        """ Check serving Django views behind the opening stream app (like arta.asgi does). """
+        app = OpeningStreamApp(fallback=ThreadedWSGIApp(WSGIHandler(), max_workers=1))
+        status, headers, body = run_async(asgi_request(app, reverse('core:about')))
+        self.assertEqual(status, 200)
+        self.assertIn(b'text/html', headers[b'content-type'])
+
+        status, headers, body = run_async(asgi_request(app, '/does-not-exist/'))
+        self.assertEqual(status, 404)
+
+
+# Skip for Sqlite, since the views run in other threads (see test_parallel_users)
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+@tag('benchmark')
+class TestAsgiConcurrency(TransactionTestCase):
+    """
+    Benchmark many concurrent clients served by a few threads using ASGI.
+
+    Compare the number of clients and memory used with TestParallelUsers, which uses a thread per client.
+    """
+
+    duration = 10
+    clients = 200
+    threads = 10
+
+    def setUp(self):
+        self.event = EventFactory(registration_opens_in_days=1, starts_in_days=1, public=True)
+        self.users = ArtaUserFactory.create_batch(self.clients)
+        self.registrations = [
+            RegistrationFactory(event=self.event, user=user, preparation_complete=True) for user in self.users
+        ]
+
+    def run_clients(self, func):
+        """ Helper to run the func coroutine for each user concurrently, against a single ASGI app. """
+        app = OpeningStreamApp(fallback=ThreadedWSGIApp(WSGIHandler(), max_workers=self.threads))
+        request_counts = defaultdict(int)
+        request_latencies = defaultdict(int)
+        cookies = []
+        for user in self.users:
+            client = Client()
+            client.force_login(user)
+            cookie = '{}={}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+            cookies.append([(b'cookie', cookie.encode())])
+
+        async def run():
+            done = asyncio.Event()
+            asyncio.get_event_loop().call_later(self.duration, done.set)
+
+            async def client_task(i):
+                async for (view, latency) in func(app=app, headers=cookies[i], index=i, done=done):
+                    request_counts[view] += 1
+                    request_latencies[view] += latency
+
+            await asyncio.gather(*(client_task(i) for i in range(len(self.users))))
+
+        tracemalloc.start()
+        try:
+            with Stopwatch() as stopwatch:
+                run_async(run())
+            (_current, peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        actual_duration = stopwatch.seconds()
+
+        print()  # noqa: T001
+        print("{} ({:.1f} seconds, {} clients, {} threads, {:.1f} MiB peak)".format(  # noqa: T001
+            self.id(), actual_duration, len(self.users), self.threads, peak / 2 ** 20),
+        )
+        for (view, count) in request_counts.items():
+            print("{:>40}: {:>4d} requests, {:>5.1f} r/s, {:>4.0f} ms".format(  # noqa: T001
+                view, count, count / actual_duration, request_latencies[view] / count),
+            )
+
+    def test_refreshing(self):
+        """ Test many clients refreshing the finalcheck page (using conditional requests). """
+        view = 'registrations:step_final_check'
+
+        async def client_func(app, headers, index, done):
+            url = reverse(view, args=(self.registrations[index].pk,))
+            etag = []
+            while not done.is_set():
+                with Stopwatch() as stopwatch:
+                    status, response_headers, body = await asgi_request(app, url, headers=headers + etag)
+                self.assertIn(status, (200, 304))
+                if b'etag' in response_headers:
+                    etag = [(b'if-none-match', response_headers[b'etag'])]
+                yield ('{}:{}'.format(view, status), stopwatch.ms())
+
+        self.run_clients(client_func)
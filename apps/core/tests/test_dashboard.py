@@ -0,0 +1,108 @@
+import io
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.events.models import Event
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+from apps.registrations.models import Registration
+from apps.registrations.tests.factories import (RegistrationFactory, RegistrationFieldFactory,
+                                                RegistrationFieldOptionFactory, RegistrationPriceCorrectionFactory)
+
+
+class TestDashboard(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ArtaUserFactory()
+
+    def setUp(self):
+        # Rendered events could be left in the cache by other tests
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def make_events(self, n):
+        """ Makes n open events, with a registration (with options and a price) for every other one. """
+        for i in range(n):
+            event = EventFactory(registration_opens_in_days=-1, starts_in_days=7, public=True)
+            field = RegistrationFieldFactory(event=event, name="type")
+            option = RegistrationFieldOptionFactory(field=field, title="Player", price=10)
+            if i % 2:
+                RegistrationFactory(event=event, user=self.user, registered=True, options=[option])
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('core:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_queries(self):
+        """ Check that the number of queries does not depend on the number of events (and registrations) shown. """
+        self.make_events(2)
+        # Schemas are loaded once, and cached afterwards
+        self.count_queries()
+        num_queries = self.count_queries()
+
+        self.make_events(4)
+        self.count_queries()
+        self.assertEqual(self.count_queries(), num_queries)
+
+    def test_registered(self):
+        """ Check that registrations are shown with their status, options and price. """
+        self.make_events(2)
+        response = self.client.get(reverse('core:dashboard'))
+        self.assertEqual(len(response.context['events']['active']), 1)
+        self.assertEqual(len(response.context['events']['open']), 1)
+        self.assertContains(response, 'Player')
+        self.assertContains(response, 'Registered')
+        self.assertContains(response, '10.00')
+
+    def test_fragment_cache(self):
+        """ Check that unchanged events are not rendered again. """
+        self.make_events(2)
+        with self.assertTemplateUsed('events/snippets/open_event.html'):
+            self.client.get(reverse('core:dashboard'))
+        with self.assertTemplateNotUsed('events/snippets/open_event.html'), \
+                self.assertTemplateNotUsed('events/snippets/registered_event.html'):
+            self.client.get(reverse('core:dashboard'))
+
+    def test_fragment_cache_changes(self):
+        """ Check that changes to events and registrations are shown. """
+        self.make_events(2)
+        self.client.get(reverse('core:dashboard'))
+
+        event = Event.objects.get(registrations=None)
+        event.title = "Changed title"
+        event.save()
+        self.assertContains(self.client.get(reverse('core:dashboard')), "Changed title")
+
+        registration = Registration.objects.get()
+        RegistrationPriceCorrectionFactory(registration=registration, description="Discount", price=-5)
+        self.assertContains(self.client.get(reverse('core:dashboard')), "Discount")
+
+        registration.status = Registration.statuses.WAITINGLIST
+        registration.save()
+        self.assertContains(self.client.get(reverse('core:dashboard')), "Waiting list")
+
+    def test_warm_command(self):
+        """ Check that the warm command renders the dashboard for users with registrations. """
+        self.make_events(2)
+        # The command needs a cache shared with other processes (i.e. not the default local memory cache)
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir,
+        }}):
+            out = io.StringIO()
+            call_command('warm_dashboard_cache', stdout=out)
+            self.assertEqual(out.getvalue(), "Rendered the dashboard for 1 users\n")
+            with self.assertTemplateNotUsed('events/snippets/registered_event.html'):
+                self.client.get(reverse('core:dashboard'))
+
+    def test_warm_command_local_cache(self):
+        """ Check that the warm command refuses to fill a cache that is thrown away when it exits. """
+        with self.assertRaises(CommandError):
+            call_command('warm_dashboard_cache', stdout=io.StringIO())
@@ -0,0 +1,166 @@
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.core.paginator import EmptyPage, InvalidPage
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.events.tests.factories import EventFactory
+from apps.payments.admin import PaymentAdmin
+from apps.payments.tests.factories import PaymentFactory
+from apps.people.tests.factories import ArtaUserFactory
+from apps.registrations.admin import RegistrationAdmin
+from apps.registrations.models import Registration
+from apps.registrations.tests.factories import RegistrationFactory
+from arta.common.pagination import KeysetPaginator, LargeTablePaginator
+
+
+class TestKeysetPaginator(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory()
+        cls.regs = RegistrationFactory.create_batch(7, event=cls.event, registered=True)
+        # Identical timestamps, so the pk decides the order of these
+        Registration.objects.filter(pk__in=[r.pk for r in cls.regs[2:5]]).update(
+            registered_at=datetime(2020, 1, 1, tzinfo=timezone.utc),
+        )
+
+    def pages(self, queryset, ordering):
+        paginator = KeysetPaginator(queryset, 3, ordering)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return pages
+
+    def test_pages(self):
+        """ Check that following the cursors returns every row once, in order, for both directions and values(). """
+        for ordering in (('registered_at', 'pk'), ('-registered_at', '-pk')):
+            queryset = Registration.objects.filter(event=self.event)
+            expected = list(queryset.order_by(*ordering))
+            for qs in (queryset, queryset.values('pk', 'registered_at')):
+                pages = self.pages(qs, ordering)
+                self.assertEqual([len(page) for page in pages], [3, 3, 1])
+                self.assertFalse(pages[0].has_previous())
+                self.assertTrue(pages[1].has_previous())
+                rows = [row for page in pages for row in page]
+                self.assertEqual([r['pk'] if isinstance(r, dict) else r.pk for r in rows], [r.pk for r in expected])
+
+    def test_exact_pages(self):
+        """ Check that there is no next page when the last page is full. """
+        pages = self.pages(Registration.objects.filter(pk__in=[r.pk for r in self.regs[:6]]), ('pk',))
+        self.assertEqual([len(page) for page in pages], [3, 3])
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Registration.objects.all(), 3, ('registered_at', 'pk'))
+        for cursor in ('!', 'foo', 'WzFd', 'eyJwayI6MX0', 'WyJmb28iLDFd'):
+            with self.assertRaises(InvalidPage):
+                paginator.page(cursor)
+
+
+class TestLargeTablePaginator(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory()
+        cls.regs = RegistrationFactory.create_batch(5, event=cls.event, registered=True)
+        PaymentFactory(registration=cls.regs[0], completed=True)
+        cls.admin = ArtaUserFactory(is_superuser=True, is_staff=True)
+
+    def test_count(self):
+        """ Check that counting does not compute the payment status, unless filtering on it. """
+        queryset = Registration.objects.with_payment_status()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(LargeTablePaginator(queryset, 2).count, 5)
+        self.assertNotIn('payment', queries[0]['sql'].lower())
+
+        paginator = LargeTablePaginator(queryset.filter(payment_status=Registration.payment_statuses.FREE), 2)
+        self.assertEqual(paginator.count, 4)
+
+    def test_page(self):
+        """ Check that pages contain the same (annotated) rows in the same order as slicing the queryset. """
+        queryset = Registration.objects.with_payment_status().order_by('-registered_at', 'pk')
+        paginator = LargeTablePaginator(queryset, 2)
+        for number in paginator.page_range:
+            page = paginator.page(number)
+            expected = list(queryset[(number - 1) * 2:number * 2])
+            self.assertEqual(list(page), expected)
+            self.assertEqual(
+                [r.payment_status for r in page], [r.payment_status for r in expected],
+            )
+
+    def test_estimate(self):
+        """ Check that no estimate is used for filtered querysets, or on databases other than MySQL. """
+        self.assertIsNone(LargeTablePaginator.estimate_count(Registration.objects.filter(event=self.event)))
+        with mock.patch.object(LargeTablePaginator, 'estimate_count', return_value=20000):
+            self.assertEqual(LargeTablePaginator(Registration.objects.all(), 2, approximate=True).count, 20000)
+        with mock.patch.object(LargeTablePaginator, 'estimate_count', return_value=20):
+            self.assertEqual(LargeTablePaginator(Registration.objects.all(), 2, approximate=True).count, 5)
+        if connection.vendor != 'mysql':
+            self.assertIsNone(LargeTablePaginator.estimate_count(Registration.objects.all()))
+
+    @mock.patch.object(LargeTablePaginator, 'approximate_count_threshold', 1)
+    def test_wrong_estimate(self):
+        """ Check that all rows can be reached when the estimate is too low, and that too high gives empty pages. """
+        queryset = Registration.objects.order_by('pk')
+        with mock.patch.object(LargeTablePaginator, 'estimate_count', return_value=3):
+            paginator = LargeTablePaginator(queryset, 2, approximate=True)
+            self.assertEqual(paginator.num_pages, 2)
+            self.assertEqual(list(paginator.page(2)), self.regs[2:4])
+            # The next page is included in the range, so it will be linked
+            self.assertEqual(paginator.num_pages, 3)
+            self.assertEqual(list(paginator.page(3)), self.regs[4:])
+            self.assertEqual(paginator.num_pages, 3)
+            with self.assertRaises(EmptyPage):
+                paginator.page(4)
+
+            # Pages past the estimate can be requested directly as well
+            self.assertEqual(list(LargeTablePaginator(queryset, 2, approximate=True).page(3)), self.regs[4:])
+
+        with mock.patch.object(LargeTablePaginator, 'estimate_count', return_value=10):
+            paginator = LargeTablePaginator(queryset, 2, approximate=True)
+            self.assertEqual(list(paginator.page(5)), [])
+            self.assertEqual(paginator.num_pages, 5)
+
+    @mock.patch.object(RegistrationAdmin, 'list_per_page', 2)
+    @mock.patch.object(LargeTablePaginator, 'approximate_count_threshold', 1)
+    @mock.patch.object(LargeTablePaginator, 'estimate_count', return_value=3)
+    def test_changelist_underestimate(self, estimate_count):
+        """ Check that the last page of the changelist is shown (and linked) when the estimate is too low. """
+        self.client.force_login(self.admin)
+        url = reverse('admin:registrations_registration_changelist')
+        response = self.client.get(url, {'p': 1})
+        self.assertContains(response, '?p=2')
+        # Page numbers in the admin start at 0
+        response = self.client.get(url, {'p': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+
+    @mock.patch.object(RegistrationAdmin, 'list_per_page', 2)
+    def test_registration_changelist(self):
+        """ Check that the registration changelist pages, filters and orders on (annotated) columns. """
+        self.client.force_login(self.admin)
+        url = reverse('admin:registrations_registration_changelist')
+        response = self.client.get(url, {'p': 1, 'o': '-2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+        response = self.client.get(url, {'payment_status__exact': Registration.payment_statuses.REFUNDABLE.v})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [self.regs[0]])
+
+    @mock.patch.object(PaymentAdmin, 'list_per_page', 2)
+    def test_payment_changelist(self):
+        """ Check that the payment changelist shows pages with a constant number of queries. """
+        self.client.force_login(self.admin)
+        url = reverse('admin:payments_payment_changelist')
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            return len(queries)
+
+        num_queries = count_queries()
+        PaymentFactory(registration=self.regs[1])
+        self.assertEqual(count_queries(), num_queries)
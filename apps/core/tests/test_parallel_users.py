@@ -13,7 +13,8 @@ from factory.random import randgen
 from apps.events.tests.factories import EventFactory
 from apps.people.tests.factories import ArtaUserFactory
 from apps.registrations.models import Registration
-from apps.registrations.tests.factories import RegistrationFactory
+from apps.registrations.tests.factories import (RegistrationFactory, RegistrationFieldFactory,
+                                                RegistrationFieldOptionFactory, RegistrationFieldValueFactory)
 
 
 class Stopwatch:
@@ -152,8 +153,15 @@ class TestParallelUsers(TransactionTestCase):
 
     def test_registration(self):
         """ Test users refreshing the finalcheck until registration is open, then register. """
+        self.registration_helper()
 
-        timeout = 20
+        num_registered = (Registration.objects.filter(status=Registration.statuses.REGISTERED)).count()
+        num_waiting = (Registration.objects.filter(status=Registration.statuses.WAITINGLIST)).count()
+        self.assertEqual(num_registered + num_waiting, len(self.users))
+        self.assertEqual(num_registered, self.event.slots)
+
+    def registration_helper(self, timeout=20):
+        """ Let all users refresh the finalcheck until registration is open, then register. """
         registration_start = 5
         self.event.public_registration_opens_at = datetime.now(timezone.utc) + timedelta(seconds=registration_start)
         self.event.save()
@@ -169,9 +177,6 @@ class TestParallelUsers(TransactionTestCase):
                 yield (view + ":get", stopwatch.ms())
 
                 if response.context['event'].registration_is_open:
-                    view = self.finalcheck_view
-                    url = reverse(view, args=(reg.pk,))
-
                     with Stopwatch() as stopwatch:
                         response = client.post(url, {'agree': 1})
 
@@ -182,10 +187,48 @@ class TestParallelUsers(TransactionTestCase):
                     break
 
         self.run_threads(thread_func, timeout=timeout, min_rps=10)
-        from apps.events.models import Event
-        Event.objects.for_user(self.users[0]).get()
 
-        num_registered = (Registration.objects.filter(status=Registration.statuses.REGISTERED)).count()
-        num_waiting = (Registration.objects.filter(status=Registration.statuses.WAITINGLIST)).count()
-        self.assertEqual(num_registered + num_waiting, len(self.users))
+    def test_registration_option_slots(self):
+        """
+        Test users registering for an event with only slots on options, selecting different options.
+
+        Since only the slotted options (and not the event) are locked, registrations for different options can be
+        finalized in parallel. Compare the post timings with test_registration_event_slots.
+        """
+        self.event.slots = None
+        num_options = 4
+        field = RegistrationFieldFactory(event=self.event, name="type")
+        slots = self.threads // 2 // num_options
+        options = [
+            RegistrationFieldOptionFactory(field=field, title="Option {}".format(i), slots=slots)
+            for i in range(num_options)
+        ]
+        for i, user in enumerate(self.users):
+            RegistrationFieldValueFactory(registration=user.registrations.get(), option=options[i % num_options])
+
+        self.registration_helper()
+
+        for option in options:
+            num_registered = Registration.objects.filter(
+                status=Registration.statuses.REGISTERED, options__option=option, options__active=True,
+            ).count()
+            self.assertEqual(num_registered, option.slots)
+            option.refresh_from_db()
+            self.assertEqual(option.used_slots, option.slots)
+            self.assertTrue(option.full)
+
+    def test_registration_event_slots(self):
+        """ Test users registering for an event with event slots, for comparison with the above. """
+        num_options = 4
+        field = RegistrationFieldFactory(event=self.event, name="type")
+        options = [
+            RegistrationFieldOptionFactory(field=field, title="Option {}".format(i))
+            for i in range(num_options)
+        ]
+        for i, user in enumerate(self.users):
+            RegistrationFieldValueFactory(registration=user.registrations.get(), option=options[i % num_options])
+
+        self.registration_helper()
+
+        num_registered = Registration.objects.filter(status=Registration.statuses.REGISTERED).count()
         self.assertEqual(num_registered, self.event.slots)
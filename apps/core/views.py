@@ -2,16 +2,21 @@ import collections
 from datetime import date
 
 import reversion
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import SuspiciousOperation
 from django.db.models import Q
 from django.shortcuts import render
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import RedirectView, TemplateView, UpdateView, View
 
 from apps.events.models import Event
+from apps.registrations import versions
 from apps.registrations.models import Registration
+from apps.registrations.schema import EventSchema
+from arta.common.versions import get_versions
 
 from .forms import EmailPreferencesForm
 
@@ -35,7 +40,13 @@ class Dashboard(LoginRequiredMixin, View):
             end_date__gte=date.today(),
         ).order_by(
             'start_date',
+        ).select_related(
+            'series',
+        ).prefetch_current_registration(
+            request.user,
+            Registration.objects.with_summary(),
         )
+        EventSchema.prefetch([e.registration for e in events if e.registration])
 
         def group(e):
             if e.registration and e.registration.status.FINALIZED:
@@ -50,6 +61,7 @@ class Dashboard(LoginRequiredMixin, View):
         grouped = collections.defaultdict(list)
         for e in events:
             grouped[group(e)].append(e)
+        self.add_fragment_keys(events)
 
         context = {
             'user': request.user,
@@ -57,6 +69,34 @@ class Dashboard(LoginRequiredMixin, View):
         }
         return render(request, 'core/dashboard.html', context)
 
+    @staticmethod
+    def add_fragment_keys(events):
+        """
+        Sets fragment_key and fragment_timeout on the given events, used to cache the rendered event on the dashboard.
+
+        This key covers everything the event snippets show: the event (and its series) through the event version, the
+        registration (and its options and price corrections) through the registration version, and everything that
+        depends on the current time or on payments directly. Since the key changes when registration opens or closes,
+        the cached fragment expires at that moment.
+        """
+        now = timezone.now()
+        keys = [versions.event_version(e.pk) for e in events]
+        keys += [versions.registration_version(e.registration.pk) for e in events if e.registration]
+        found = dict(zip(keys, get_versions(keys)))
+
+        for e in events:
+            reg = e.registration
+            e.fragment_timeout = e.phases.cache_timeout(settings.DASHBOARD_FRAGMENT_CACHE_TIMEOUT, now)
+            e.fragment_key = (
+                found[versions.event_version(e.pk)],
+                e.is_visible, e.can_preview, e.is_full, e.registration_opens_at, e.registration_is_open,
+                e.preregistration_is_open, e.registration_has_closed, e.allow_change, e.in_the_past,
+                reg and (
+                    reg.pk, found[versions.registration_version(reg.pk)],
+                    reg.payment_status, reg.amount_due, reg.waitinglist_position,
+                ),
+            )
+
 
 class PracticalInfo(LoginRequiredMixin, TemplateView):
     template_name = 'core/practical_info.html'
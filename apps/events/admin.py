@@ -5,17 +5,19 @@ import import_export.fields
 import import_export.formats.base_formats
 import import_export.resources
 from django.contrib import admin, messages
-from django.http import HttpResponse
 from django.urls import path, reverse
 from django.utils.html import format_html
 from reversion.admin import VersionAdmin
 
-from apps.registrations.admin import RegistrationFieldInline
-from apps.registrations.models import Registration, RegistrationField
+from apps.registrations.admin import CheckDependenciesMixin, RegistrationFieldInline, dependency_cycle_message
+from apps.registrations.models import Registration
+from apps.registrations.schema import EventSchema
+from apps.registrations.services import WaitinglistService
 from arta.common.admin import MonetaryResourceWidget
+from arta.common.export import export_response
 
-from .adminviews import EventCopyFieldsView
-from .models import Event, Series
+from .adminviews import EventCopyFieldsView, EventLotteryView
+from .models import Event, ExportJob, Series
 
 
 class RegistrationFieldValueField(import_export.fields.Field):
@@ -38,6 +40,7 @@ class EventRegistrationsResource(import_export.resources.ModelResource):
     phone_number = import_export.fields.Field(attribute='user__address__phone_number')
     status = import_export.fields.Field(attribute='get_status_display')
     registered_at = import_export.fields.Field(attribute='registered_at')
+    waitinglist_position = import_export.fields.Field(attribute='waitinglist_position')
     payment_status = import_export.fields.Field(attribute='payment_status')
     price = import_export.fields.Field(attribute='price', widget=MonetaryResourceWidget())
     paid = import_export.fields.Field(attribute='paid', widget=MonetaryResourceWidget())
@@ -53,7 +56,7 @@ class EventRegistrationsResource(import_export.resources.ModelResource):
                 # value
                 RegistrationFieldValueField(column_name=reg_field.name, attribute=reg_field.name),
             )
-            for reg_field in event.registration_fields.exclude(field_type=RegistrationField.types.SECTION)
+            for reg_field in EventSchema.for_event(event).value_fields
         )
 
     def get_queryset(self):
@@ -64,6 +67,8 @@ class EventRegistrationsResource(import_export.resources.ModelResource):
             .select_related('user__address')
             .prefetch_active_options()
             .with_payment_status()
+            # This filters only on event, so the window function sees the complete waiting list
+            .with_waitinglist_position(window=True)
             .order_by('created_at')
         )
 
@@ -73,14 +78,14 @@ class EventRegistrationsResource(import_export.resources.ModelResource):
 
 
 @admin.register(Event)
-class EventAdmin(VersionAdmin):
+class EventAdmin(CheckDependenciesMixin, VersionAdmin):
     list_display = ('display_name', 'start_date', 'end_date', 'location_name')
     inlines = (RegistrationFieldInline,)
-    actions = ['export_active_registrations']
+    actions = ['export_active_registrations', 'promote_waitinglist']
 
     ordering = ('start_date',)
     date_hierarchy = 'start_date'
-    readonly_fields = ('actions_field',)
+    readonly_fields = ('actions_field', 'used_slots', 'options_full', 'dependency_problems')
 
     def export_active_registrations(self, request, queryset):
         try:
@@ -98,13 +103,22 @@ class EventAdmin(VersionAdmin):
             .filter(status__in=Registration.statuses.ACTIVE)
             .order_by('registered_at')
         )
-        file_format = import_export.formats.base_formats.CSV()
-        export_data = file_format.export_data(resource.export(reg_qs))
-        response = HttpResponse(export_data, content_type=file_format.get_content_type())
-        response['Content-Disposition'] = 'attachment; filename="{}-{}.{}"'.format(
-            event.name, datetime.datetime.now().strftime('%Y-%m-%d'), file_format.get_extension(),
+        return export_response(
+            resource, reg_qs, import_export.formats.base_formats.CSV(),
+            filename='{}-{}'.format(event.name, datetime.datetime.now().strftime('%Y-%m-%d')),
         )
-        return response
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Slots might have been increased (for the event or its options)
+        WaitinglistService.slots_freed(form.instance, user=request.user)
+
+    def promote_waitinglist(self, request, queryset):
+        for event in queryset:
+            promoted = WaitinglistService.promote(event, user=request.user)
+            self.message_user(request, "Promoted {} registrations from the waiting list for {}".format(
+                len(promoted), event))
+    promote_waitinglist.short_description = "Promote from waiting list while slots are available"
 
     def get_urls(self):
         # Prepend new path so it is before the catchall that ModelAdmin adds
@@ -112,17 +126,35 @@ class EventAdmin(VersionAdmin):
             path('<path:pk>/copy-options/',
                  self.admin_site.admin_view(EventCopyFieldsView.as_view(admin_site=self.admin_site)),
                  name='copy_event_fields'),
+            path('<path:pk>/lottery/',
+                 self.admin_site.admin_view(EventLotteryView.as_view(admin_site=self.admin_site)),
+                 name='event_lottery'),
         ] + super().get_urls()
 
     def actions_field(self, obj):
         return format_html(
-            '<a class="button" href="{}">Copy fields from other event</a>&nbsp;',
+            '<a class="button" href="{}">Copy fields from other event</a>&nbsp;'
+            '<a class="button" href="{}">Lottery for pending registrations</a>&nbsp;',
             reverse('admin:copy_event_fields', args=[obj.pk]),
+            reverse('admin:event_lottery', args=[obj.pk]),
         )
     actions_field.short_description = "Event Actions"
     actions_field.allow_tags = True
 
+    def dependency_problems(self, obj):
+        if obj.pk is None:
+            return None
+        return dependency_cycle_message(obj) or "None"
+
 
 @admin.register(Series)
 class SeriesAdmin(VersionAdmin):
     pass
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('event', 'kind', 'requested_at', 'processed_at', 'error')
+    list_filter = ('event', 'kind')
+    list_select_related = ('event',)
+    readonly_fields = ('event', 'kind', 'fingerprint', 'requested_at', 'processed_at', 'error', 'file')
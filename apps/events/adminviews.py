@@ -9,6 +9,9 @@ from django.utils.translation import gettext_lazy as _
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.edit import FormView
 
+from apps.registrations.models import Registration
+from apps.registrations.services import LotteryService
+
 from .models import Event
 
 
@@ -130,3 +133,40 @@ class EventCopyFieldsView(SingleObjectMixin, FormView):
         )
 
         return TemplateResponse(request=self.request, template='events/admin/copy_fields_complete.html', context=ctx)
+
+
+@method_decorator(permission_required('registrations.change_registration'), name='dispatch')
+class EventLotteryView(SingleObjectMixin, FormView):
+    model = Event
+    admin_site = None  # Filled by __init__
+    template_name = 'events/admin/lottery.html'
+
+    class LotteryForm(forms.Form):
+        seed = forms.IntegerField(
+            required=False, min_value=0,
+            help_text=_('Leave empty to use a random seed. Pass the seed of an earlier lottery to reproduce it.'),
+        )
+
+    form_class = LotteryForm
+
+    def __init__(self, admin_site):
+        self.admin_site = admin_site
+
+    def dispatch(self, *args, **kwargs):
+        self.object = self.get_object()
+        return super().dispatch(*args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        kwargs.update(self.admin_site.each_context(self.request))
+        kwargs.update({
+            'opts': self.model._meta,
+            'original': self.object,  # For breadcrumbs
+            'num_pending': self.object.registrations.filter(status=Registration.statuses.PENDING).count(),
+        })
+        return super().get_context_data(**kwargs)
+
+    def form_valid(self, form):
+        result = LotteryService.draw(self.object, seed=form.cleaned_data['seed'], user=self.request.user)
+
+        ctx = self.get_context_data(result=result)
+        return TemplateResponse(request=self.request, template='events/admin/lottery_complete.html', context=ctx)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class EventsConfig(AppConfig):
     name = 'apps.events'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals  # noqa: F401
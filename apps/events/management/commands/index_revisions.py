@@ -0,0 +1,46 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import BaseCommand
+from django.db.models import Prefetch
+from reversion.models import Revision, Version
+
+from apps.events.services import EventHistoryService
+from apps.people.models import ArtaUser
+from apps.registrations.models import Registration
+
+
+class Command(BaseCommand):
+    help = (
+        'Add revisions saved before the EventRevision index existed to the index, for the registration history of '
+        'events. Revisions that were indexed already are skipped, so this can safely run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, help='Number of revisions to index at once',
+        )
+
+    def handle(self, *args, **kwargs):
+        content_types = ContentType.objects.get_for_models(Registration, ArtaUser).values()
+        versions = Version.objects.filter(content_type__in=content_types).only('revision', 'content_type', 'object_id')
+        revisions = (
+            Revision.objects
+            .filter(version__content_type__in=content_types, event_revisions=None)
+            .distinct()
+            .order_by('pk')
+            .only('pk', 'date_created')
+            .prefetch_related(Prefetch('version_set', queryset=versions, to_attr='indexed_versions'))
+        )
+
+        count = 0
+        last_pk = 0
+        while True:
+            # Continue after the last batch rather than using an offset, since indexed revisions are excluded
+            batch = list(revisions.filter(pk__gt=last_pk)[:kwargs['batch_size']])
+            if not batch:
+                break
+            EventHistoryService.index_revisions((revision, revision.indexed_versions) for revision in batch)
+            count += len(batch)
+            last_pk = batch[-1].pk
+            if kwargs['verbosity'] > 1:
+                self.stdout.write("Indexed {} revisions\n".format(count))
+        self.stdout.write("Indexed {} revisions in total\n".format(count))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management import BaseCommand
+
+from apps.events.services import EventExportService
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate queued spreadsheet exports (for all events), in order of arrival. Runs until interrupted, unless '
+        '--once is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument(
+            '--interval', type=float, default=1, help='Seconds to wait before checking an empty queue again',
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            # Exports can take a while, so fetch the queue again after each one
+            processed = EventExportService.process_export_queue(batch_size=1)
+            if processed and kwargs['verbosity'] > 1:
+                self.stdout.write("Processed {} exports\n".format(processed))
+            if not processed:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
@@ -0,0 +1,73 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand
+from django.db import connections
+from django.test import RequestFactory
+
+from apps.events.models import Event
+from apps.events.views import PrintableKitchenInfo, PrintableRegistrationForms, PrintableSafetyReference
+from apps.registrations.models import Registration
+
+PRINTABLE_VIEWS = {view.pdf_name: view for view in (
+    PrintableRegistrationForms, PrintableKitchenInfo, PrintableSafetyReference,
+)}
+
+
+def render_printable(base_url, pdf_name, event_id):
+    """ Renders and stores a printable PDF (unless already stored for the current data), returns whether rendered. """
+    # The request is only used to build the base url that stylesheets are loaded from
+    parts = urlsplit(base_url)
+    request = RequestFactory().get('/', secure=parts.scheme == 'https', HTTP_HOST=parts.netloc)
+    request.user = AnonymousUser()
+
+    view = PRINTABLE_VIEWS[pdf_name]()
+    view.setup(request, pk=event_id)
+    # Bypass the organizer check done by the view
+    view.event = Event.objects.get(pk=event_id)
+    return view.store_pdf()
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the printable PDFs for events using multiple processes, so these are served directly afterwards (e.g. '
+        'after registration closes). PDFs that are still up-to-date are not rendered again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'event_id', type=int, nargs='*',
+            help='Events to render PDFs for (default: all upcoming events with registrations)',
+        )
+        parser.add_argument(
+            '--base-url', required=True, help='Url of the site, used to load stylesheets (e.g. https://example.com/)',
+        )
+        parser.add_argument(
+            '--processes', type=int, default=None, help='Number of processes to use (default: number of CPUs)',
+        )
+
+    def handle(self, *args, **kwargs):
+        events = Event.objects.all()
+        if kwargs['event_id']:
+            events = events.filter(pk__in=kwargs['event_id'])
+        else:
+            events = events.filter(
+                end_date__gte=date.today(), registrations__status=Registration.statuses.REGISTERED,
+            ).distinct()
+        jobs = [
+            (kwargs['base_url'], pdf_name, event_id)
+            for event_id in events.values_list('pk', flat=True)
+            for pdf_name in PRINTABLE_VIEWS
+        ]
+
+        if kwargs['processes'] == 1 or len(jobs) <= 1:
+            rendered = [render_printable(*job) for job in jobs]
+        else:
+            # Forked processes must not share database connections, so let each open its own
+            connections.close_all()
+            with ProcessPoolExecutor(kwargs['processes'], mp_context=multiprocessing.get_context('fork')) as executor:
+                rendered = list(executor.map(render_printable, *zip(*jobs)))
+        self.stdout.write("Rendered {} PDFs\n".format(sum(rendered)))
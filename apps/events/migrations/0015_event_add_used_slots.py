@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+# Registration.statuses.REGISTERED
+REGISTERED = 2
+
+def count_used_slots(apps, schema_editor):
+    Event = apps.get_model("events", "event")
+    counted = Event.objects.annotate(
+        used_slots_count=models.Count('registrations', filter=models.Q(registrations__status=REGISTERED)),
+    ).exclude(used_slots_count=0)
+    for event in counted:
+        Event.objects.filter(pk=event.pk).update(used_slots=event.used_slots_count)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0014_event_add_invite_fields'),
+        ('registrations', '0024_registrationfieldoption_add_used_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='used_slots',
+            field=models.IntegerField(default=0, editable=False, help_text='Number of REGISTERED registrations for this event. Maintained automatically.'),
+        ),
+        migrations.RunPython(count_used_slots, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0015_event_add_used_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='promote_waitinglist',
+            field=models.BooleanField(default=False, help_text='When checked, registrations on the waiting list are admitted automatically (in order) when slots free up, e.g. because registrations are cancelled or slots are increased through the admin.', verbose_name='Promote from waiting list automatically'),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 2.2.28 on 2026-10-17 04:06
+
+import collections
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def any_option_full(fields, options, group_ids):
+    """
+    Returns whether there is a choice field without any options available to a user in the given groups.
+
+    This is a frozen copy of EventSchema.any_option_full (and the dependency ordering it uses) at the time of this
+    migration, so later changes to EventSchema do not affect (or break) this migration.
+    """
+    def invited(obj):
+        return obj.invite_only_id is None or obj.invite_only_id in group_ids
+
+    field_of_option = {o.pk: o.field_id for o in options}
+    options_by_field = collections.defaultdict(list)
+    for option in options:
+        options_by_field[option.field_id].append(option)
+    # The fields each field depends on (through its own depends or those of its options)
+    depends_on = {
+        f.pk: {field_of_option.get(obj.depends_id) for obj in (f, *options_by_field[f.pk])} - {None}
+        for f in fields
+    }
+
+    # Handle fields after the fields they depend on, fields in a dependency cycle are never handled (i.e. ignored)
+    done = set()
+    available = set()
+    progress = True
+    while progress:
+        progress = False
+        for field in fields:
+            if field.pk in done or not depends_on[field.pk] <= done:
+                continue
+            done.add(field.pk)
+            progress = True
+
+            if not invited(field):
+                continue
+            if field.depends_id is not None and field.depends_id not in available:
+                continue
+            field_options = [
+                o for o in options_by_field[field.pk]
+                if invited(o) and not o.full and (o.depends_id is None or o.depends_id in available)
+            ]
+            if field.field_type == 'choice' and not field_options:
+                return True
+            available.update(o.pk for o in field_options)
+    return False
+
+
+def update_options_full(apps, schema_editor):
+    Event = apps.get_model("events", "event")
+    EventGroupFullness = apps.get_model("events", "eventgroupfullness")
+    RegistrationField = apps.get_model("registrations", "registrationfield")
+    RegistrationFieldOption = apps.get_model("registrations", "registrationfieldoption")
+    for event_id in Event.objects.values_list('pk', flat=True):
+        fields = list(RegistrationField.objects.filter(event=event_id).order_by('order', 'pk'))
+        options = list(RegistrationFieldOption.objects.filter(field__event=event_id).order_by('order', 'pk'))
+        invite_only_groups = {obj.invite_only_id for obj in (*fields, *options) if obj.invite_only_id is not None}
+
+        Event.objects.filter(pk=event_id).update(options_full=any_option_full(fields, options, set()))
+        EventGroupFullness.objects.bulk_create([
+            EventGroupFullness(
+                event_id=event_id, group_id=group_id, options_full=any_option_full(fields, options, {group_id}),
+            )
+            for group_id in invite_only_groups
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('events', '0016_event_add_promote_waitinglist'),
+        ('registrations', '0025_finalizerequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='options_full',
+            field=models.BooleanField(default=False, editable=False, help_text='Whether there is a choice field without available options (for users not in any invite-only group, see EventGroupFullness for those). Maintained automatically.'),
+        ),
+        migrations.CreateModel(
+            name='EventGroupFullness',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('options_full', models.BooleanField(help_text='Whether there is a choice field without available options for members of this group.')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_fullness', to='events.Event')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='auth.Group')),
+            ],
+            options={
+                'unique_together': {('event', 'group')},
+            },
+        ),
+        migrations.RunPython(update_options_full, reverse_code=migrations.RunPython.noop),
+    ]
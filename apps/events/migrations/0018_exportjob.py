@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-17 05:06
+
+import apps.events.models.export_job
+from django.db import migrations, models
+import django.db.models.deletion
+import konst.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0017_event_add_options_full'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', konst.models.fields.ConstantChoiceCharField(choices=[('registrations', 'Registrations'), ('payments', 'Payments')], max_length=20)),
+                ('fingerprint', models.CharField(help_text='Hash of the last changes to the exported data', max_length=40)),
+                ('requested_at', models.DateTimeField(verbose_name='Request timestamp')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processing timestamp')),
+                ('error', models.TextField(blank=True, help_text='Reason the export could not be generated, if any')),
+                ('file', models.FileField(blank=True, upload_to=apps.events.models.export_job.export_file_path)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Creation timestamp')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Last update timestamp')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='events.Event')),
+            ],
+            options={
+                'verbose_name': 'export job',
+                'verbose_name_plural': 'export jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exportjob',
+            index=models.Index(fields=['processed_at', 'requested_at'], name='idx_export_processed_requested'),
+        ),
+        migrations.AddConstraint(
+            model_name='exportjob',
+            constraint=models.UniqueConstraint(fields=('event', 'kind', 'fingerprint'), name='one_export_job_per_fingerprint'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-17 05:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reversion', '0001_squashed_0004_auto_20160611_1202'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('events', '0018_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventRevision',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Full name of the user when the revision was saved', max_length=181)),
+                ('date_created', models.DateTimeField(verbose_name='Revision timestamp')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='events.Event')),
+                ('revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_revisions', to='reversion.Revision')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='event_revisions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'event revision',
+                'verbose_name_plural': 'event revisions',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='eventrevision',
+            index=models.Index(fields=['event', '-date_created', '-revision'], name='idx_event_date_revision'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventrevision',
+            constraint=models.UniqueConstraint(fields=('revision', 'event', 'user'), name='one_event_revision_per_user'),
+        ),
+    ]
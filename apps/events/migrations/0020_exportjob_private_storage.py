@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:04
+
+import apps.events.models.export_job
+import arta.common.storage
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def remove_public_exports(apps, schema_editor):
+    """ Removes exports stored in MEDIA_ROOT (which is served publicly), these are generated again when requested. """
+    ExportJob = apps.get_model('events', 'ExportJob')
+    stored = ExportJob.objects.exclude(file='')
+    for name in stored.values_list('file', flat=True):
+        default_storage.delete(name)
+    stored.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0019_eventrevision'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportjob',
+            name='file',
+            field=models.FileField(blank=True, storage=arta.common.storage.PrivateStorage(), upload_to=apps.events.models.export_job.export_file_path),
+        ),
+        migrations.RunPython(remove_public_exports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-17 06:12
+
+import posixpath
+
+from django.core.files.storage import default_storage
+from django.db import migrations
+
+
+def remove_public_printables(apps, schema_editor):
+    """ Removes printable PDFs stored in MEDIA_ROOT (which is served publicly), these are rendered again when needed. """
+    if not default_storage.exists('printables'):
+        return
+    for directory in default_storage.listdir('printables')[0]:
+        directory = posixpath.join('printables', directory)
+        for filename in default_storage.listdir(directory)[1]:
+            default_storage.delete(posixpath.join(directory, filename))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0020_exportjob_private_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_public_printables, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
 from .event import Event
+from .event_group_fullness import EventGroupFullness
+from .event_revision import EventRevision
+from .export_job import ExportJob
 from .series import Series
 
-__all__ = ['Series', 'Event']
+__all__ = ['Series', 'Event', 'EventGroupFullness', 'EventRevision', 'ExportJob']
@@ -1,23 +1,119 @@
+import collections
+import datetime
+import math
+
 import reversion
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.db import models
-from django.db.models import Case, Count, Exists, F, OuterRef, Q, Subquery, When
-from django.db.models.functions import Concat
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, When
+from django.db.models.functions import Coalesce, Concat
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
-from apps.registrations.models import Registration, RegistrationField
-from arta.common.db import QExpr, UpdatedAtQuerySetMixin
+from apps.registrations.models import Registration
+from arta.common.db import CounterFieldsModelMixin, QExpr, UpdatedAtQuerySetMixin
+from arta.common.versions import get_versions
 
+from .event_group_fullness import EventGroupFullness
 from .series import Series
 
 
+class UserContext(collections.namedtuple('UserContext', ['pk', 'group_ids', 'is_superuser'])):
+    """ The properties of a user that EventQuerySet.for_user depends on. """
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Returns the context for the given user (ArtaUser, AnonymousUser, pk or None).
+
+        This is cached until the user changes (including changes to their groups), using the user version counter from
+        apps.registrations.versions. When cached, this needs no queries. Since access to events depends on this, it
+        also expires after USER_CONTEXT_CACHE_TIMEOUT, to limit the impact of changes made without bumping the
+        version (e.g. using raw SQL).
+        """
+        from apps.people.models import ArtaUser
+        from apps.registrations import versions
+
+        user_pk = getattr(user, 'pk', user)
+        if user_pk is None:
+            return cls(None, frozenset(), False)
+
+        (version,) = get_versions([versions.user_version(user_pk)])
+        key = 'event-user-context:{}:{}'.format(user_pk, version)
+        context = cache.get(key)
+        if context is None:
+            rows = ArtaUser.objects.filter(pk=user_pk).values_list('is_superuser', 'groups')
+            group_ids = frozenset(group_id for (_is_superuser, group_id) in rows if group_id is not None)
+            context = cls(user_pk, group_ids, any(is_superuser for (is_superuser, _group_id) in rows))
+            cache.set(key, context, settings.USER_CONTEXT_CACHE_TIMEOUT)
+        return context
+
+
+class EventPhases(collections.namedtuple('EventPhases', ['public_opens_at', 'invitee_opens_at', 'closes_at'])):
+    """
+    The moments at which the registration phase of an event changes (opening publicly and for invitees, closing).
+
+    Each of these can be None. These are the only moments at which the annotations of EventQuerySet.for_user change
+    without the event itself changing, so anything cached based on these annotations (or an ETag) only needs to expire
+    at the next change.
+    """
+
+    @classmethod
+    def from_values(cls, public_opens_at, invitee_opens_at, registration_closes_at, start_date):
+        """ Returns the phases for the given Event field values. """
+        # Registration closes at the start of the start date (like the registration_has_closed annotation, where
+        # comparing against the DateField converts now to a date in the default timezone) or earlier.
+        start = timezone.make_aware(
+            datetime.datetime.combine(start_date, datetime.time.min), timezone.get_default_timezone(),
+        )
+        closes_at = min(start, registration_closes_at) if registration_closes_at else start
+        return cls(public_opens_at, invitee_opens_at, closes_at)
+
+    @classmethod
+    def for_event(cls, event):
+        return cls.from_values(
+            event.public_registration_opens_at, event.invitee_registration_opens_at, event.registration_closes_at,
+            event.start_date,
+        )
+
+    def passed(self, now=None):
+        """ Returns whether each of the moments has passed, which together identify the current phase. """
+        if now is None:
+            now = timezone.now()
+        return tuple(t is not None and t <= now for t in self)
+
+    def next_change(self, now=None):
+        """ Returns the first moment after now (or None when there are no more changes). """
+        if now is None:
+            now = timezone.now()
+        return min((t for t in self if t is not None and t > now), default=None)
+
+    def seconds_until_change(self, now=None):
+        """ Returns the number of seconds until the next change (or None). """
+        if now is None:
+            now = timezone.now()
+        next_change = self.next_change(now)
+        return None if next_change is None else (next_change - now).total_seconds()
+
+    def cache_timeout(self, timeout, now=None):
+        """ Returns the given cache timeout (in seconds), shortened to expire at the next change. """
+        seconds = self.seconds_until_change(now)
+        if seconds is None:
+            return timeout
+        # Round up, never expire before the change (cache keys should include passed() to not be stale after it)
+        return min(timeout, math.ceil(seconds))
+
+
 class EventQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
     def for_user(self, user, with_registration=False):
         """
-        Returns events annotated with properties applicable for the given user.
+        Returns events annotated with properties applicable for the given user (ArtaUser, pk or None).
+
+        The user's groups and superuser flag are resolved up front (see UserContext), so these end up as constants in
+        the query rather than subqueries that are evaluated for every event.
 
          - is_visible: True when the user can view this event
          - preregistration_is_open: True when the user can prepare a registration (becomes False again when
@@ -29,16 +125,42 @@ class EventQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
            registration is current. Current is the one non-cancelled registration, or most recent cancelled
            registration.
         """
-        from apps.people.models import ArtaUser
-        user_pk = user.pk if isinstance(user, ArtaUser) else user
+        context = UserContext.for_user(user)
+        user_pk = context.pk
+        group_ids = sorted(context.group_ids)
+
+        def in_groups(field):
+            # Filtering on an empty list makes Django consider the entire query empty, so use a constant instead
+            if not group_ids:
+                return models.Value(False, output_field=models.BooleanField())
+            return QExpr(**{field + '__in': group_ids})
+
+        # Fullness for users in invite-only groups of an event is maintained per group. Being in more groups only
+        # makes more options available, so when any of the user's groups has options available, so does the user.
+        any_option_full = F('options_full')
+        if group_ids:
+            any_option_full = Coalesce(
+                Subquery(
+                    EventGroupFullness.objects.filter(event=OuterRef('pk'), group__in=group_ids)
+                    .order_by('options_full').values('options_full')[:1],
+                ),
+                F('options_full'),
+                output_field=models.BooleanField(),
+            )
+            # Only users in multiple groups can have options available that none of their groups have on their own
+            available_combined = self._available_for_combined_groups(group_ids) if len(group_ids) > 1 else []
+            if available_combined:
+                any_option_full = Case(
+                    When(pk__in=available_combined, then=models.Value(False)),
+                    default=any_option_full,
+                    output_field=models.BooleanField(),
+                )
 
         now = timezone.now()
         # Split into multiple annotates to allow using annotations in subsequent annotations (the order of these can
         # not be guaranteed in the kwargs across systems)
         qs = self.annotate(
-            # This does a subquery instead of just a normal filter in the registration_opens_at annotation below, since
-            # that would create a join that duplicates results (https://code.djangoproject.com/ticket/10060)
-            user_is_invitee=Exists(Event.objects.filter(pk=OuterRef('pk'), invitee_group__user=user_pk)),
+            user_is_invitee=in_groups('invitee_group'),
         ).annotate(
             registration_opens_at=Case(
                 When(
@@ -69,12 +191,8 @@ class EventQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
                 & Q(registration_has_closed=False),
             ),
         ).annotate(
-            # This does a subquery instead of using user.is_superuser in the filter directly, to allow passing user pk
-            # instead of object
-            user_is_superuser=Subquery(ArtaUser.objects.filter(pk=user_pk).values('is_superuser')),
-            # This does a subquery instead of just a normal filter in the can_preview annotation below, since that
-            # would create a join that duplicates results (https://code.djangoproject.com/ticket/10060)
-            user_is_organizer=Exists(Event.objects.filter(pk=OuterRef('pk'), organizer_group__user=user_pk)),
+            user_is_superuser=models.Value(context.is_superuser, output_field=models.BooleanField()),
+            user_is_organizer=in_groups('organizer_group'),
         ).annotate(
             can_preview=QExpr(
                 Q(preregistration_is_open=False)
@@ -86,29 +204,7 @@ class EventQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
                 ),
             ),
         ).annotate(
-            # TODO: Ideally we would skip this annotation and do F('full') | Exists(...) directly, but django does not
-            # support logical or on expression (only on Q objects). Adding this extra annotation here works, but ends
-            # up duplicating the generated subquery (but hopefully the database driver realizes this...).
-            any_option_full=Exists(
-                RegistrationField.objects.filter(
-                    event=OuterRef('pk'),
-                    field_type=RegistrationField.types.CHOICE,
-                ).annotate(
-                    num_nonfull=Count(
-                        'options',
-                        # TODO: This should ideally also consider as full options that depend on invite_only options,
-                        # or depend on full options, to really properly predict event fullness. This is recursive,
-                        # which means it cannot be generally solved in SQL, but maybe we can limit to one or two levels
-                        # deep?
-                        filter=(
-                            (Q(options__invite_only=None) | Q(options__invite_only__user=user_pk))
-                            & Q(options__full=False)
-                        ),
-                    ),
-                ).filter(
-                    num_nonfull=0,
-                ),
-            ),
+            any_option_full=any_option_full,
         ).annotate(
             is_full=QExpr(Q(full=True) | Q(any_option_full=True)),
         )
@@ -134,14 +230,56 @@ class EventQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
             ))
         return qs
 
-    def with_used_slots(self):
+    @staticmethod
+    def _available_for_combined_groups(group_ids):
+        """
+        Returns the pks of events with options available to a user in the given groups (by pk), but not in any one.
+
+        This can only happen when options need multiple groups (e.g. an invite-only option that depends on an option
+        that is invite-only for another group), so this is computed from the schema of the events for which the user
+        is in multiple groups that are all full. This takes a single query, unless there are such events.
+        """
+        from apps.registrations.schema import EventSchema
+
+        candidates = (
+            EventGroupFullness.objects.filter(group__in=group_ids)
+            .values('event')
+            .annotate(num_groups=Count('pk'), num_full=Count('pk', filter=Q(options_full=True)))
+            .filter(num_groups__gt=1, num_full=F('num_groups'))
+            .values_list('event', flat=True)
+        )
+        candidates = list(candidates)
+        if not candidates:
+            return []
+        schemas = EventSchema.for_events(candidates)
+        return sorted(pk for (pk, schema) in schemas.items() if not schema.any_option_full(set(group_ids)))
+
+    def prefetch_current_registration(self, user, queryset=None):
         """
-        Adds used_slots annotation.
+        Prefetches the current registration of the given user (ArtaUser, pk or None) for each event.
 
-        This is the number of slots used (i.e. the number of REGISTERED registrations) for the given event.
+        This makes Event.registration available without a query per event (a single query for all events instead). The
+        registrations are loaded from the given queryset (e.g. with additional annotations or prefetches, see
+        RegistrationQuerySet.with_summary()), which defaults to all registrations.
+        """
+        if queryset is None:
+            queryset = Registration.objects.all()
+        return self.prefetch_related(models.Prefetch(
+            'registrations',
+            # Same order as Registration.objects.current_for()
+            queryset=queryset.filter(user=getattr(user, 'pk', user)).order_by('-is_current', '-created_at'),
+            to_attr='_user_registrations',
+        ))
+
+    def with_used_slots_count(self):
+        """
+        Adds used_slots_count annotation.
+
+        This is the number of slots used (i.e. the number of REGISTERED registrations) for the given event, counted
+        from scratch. Normally the (maintained) used_slots field should be used instead.
         """
         return self.annotate(
-            used_slots=Count(
+            used_slots_count=Count(
                 'registrations',
                 filter=Q(registrations__status=Registration.statuses.REGISTERED),
             ),
@@ -162,7 +300,7 @@ class EventManager(models.Manager.from_queryset(EventQuerySet)):
 
 
 @reversion.register(follow=('registration_fields',))
-class Event(models.Model):
+class Event(CounterFieldsModelMixin, models.Model):
     """Information about an Event."""
 
     series = models.ForeignKey(
@@ -246,6 +384,18 @@ class Event(models.Model):
         null=True, blank=True,
         help_text=_('Maximum number of attendees for this event. If omitted, no there is no limit.'))
     full = models.BooleanField(default=False)
+    used_slots = models.IntegerField(
+        default=0, editable=False,
+        help_text=_('Number of REGISTERED registrations for this event. Maintained automatically.'))
+    options_full = models.BooleanField(
+        default=False, editable=False,
+        help_text=_('Whether there is a choice field without available options (for users not in any invite-only '
+                    'group, see EventGroupFullness for those). Maintained automatically.'))
+    promote_waitinglist = models.BooleanField(
+        verbose_name=_('Promote from waiting list automatically'), default=False,
+        help_text=_('When checked, registrations on the waiting list are admitted automatically (in order) when '
+                    'slots free up, e.g. because registrations are cancelled or slots are increased through the '
+                    'admin.'))
 
     user = models.ManyToManyField(settings.AUTH_USER_MODEL, through=Registration)
 
@@ -254,8 +404,17 @@ class Event(models.Model):
 
     objects = EventManager()
 
+    counter_fields = ('used_slots', 'options_full')
+
+    @cached_property
+    def phases(self):
+        return EventPhases.for_event(self)
+
     @cached_property
     def registration(self):
+        if hasattr(self, '_user_registrations'):
+            # Prefetched by prefetch_current_registration()
+            return next(iter(self._user_registrations), None)
         # The registration_id should be set by an annotation in the manager above
         # TODO: It would be better if the registration instance was annotated directly (and would also support
         # select_related or prefetch_related), but it seems Django does not
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import Group
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class EventGroupFullness(models.Model):
+    """
+    Whether an event is full (due to its options) for members of one of its invite-only groups.
+
+    This is the per-group variant of Event.options_full, for groups that give access to invite-only fields or options
+    of the event. There is a row for each such group. Maintained automatically (see OptionsFullService).
+    """
+
+    event = models.ForeignKey('events.Event', on_delete=models.CASCADE, related_name='group_fullness')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='+')
+    options_full = models.BooleanField(
+        help_text=_('Whether there is a choice field without available options for members of this group.'))
+
+    class Meta:
+        unique_together = ('event', 'group')
+
+    def __str__(self):
+        return '{} / {}'.format(self.event, self.group)
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class EventRevision(models.Model):
+    """
+    Index of revisions that changed the registration (or personal details) of a user for an event.
+
+    These are added when revisions are saved (see EventHistoryService.index_revisions), so the registration history of
+    an event can be queried without looking inside the versions of every revision. Revisions that include a user
+    rather than a registration are indexed for all events the user had a registration for at that time. The name and
+    date are copied from the user and revision, so the history can be shown without joining these.
+    """
+
+    revision = models.ForeignKey('reversion.Revision', related_name='event_revisions', on_delete=models.CASCADE)
+    event = models.ForeignKey('events.Event', related_name='revisions', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='event_revisions', on_delete=models.CASCADE)
+    name = models.CharField(max_length=181, help_text=_('Full name of the user when the revision was saved'))
+    date_created = models.DateTimeField(verbose_name=_('Revision timestamp'))
+
+    def __str__(self):
+        return "{} for {} ({})".format(self.name, self.event, self.date_created)
+
+    class Meta:
+        verbose_name = _('event revision')
+        verbose_name_plural = _('event revisions')
+
+        constraints = [
+            models.UniqueConstraint(fields=['revision', 'event', 'user'], name='one_event_revision_per_user'),
+        ]
+        indexes = [
+            # Index for listing the history of an event, newest first
+            models.Index(fields=['event', '-date_created', '-revision'], name='idx_event_date_revision'),
+        ]
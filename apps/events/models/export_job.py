@@ -0,0 +1,69 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+from konst import Constant, Constants
+from konst.models.fields import ConstantChoiceCharField
+
+from arta.common.db import UpdatedAtQuerySetMixin
+from arta.common.storage import private_storage
+
+
+class ExportJobQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
+    def queued(self):
+        """ Returns the unprocessed jobs (for all events), in order of arrival. """
+        return self.filter(processed_at=None).order_by('requested_at', 'pk')
+
+
+class ExportJobManager(models.Manager.from_queryset(ExportJobQuerySet)):
+    pass
+
+
+def export_file_path(obj, filename):
+    """ Generate the filename of an export, these are only served through the download views. """
+    return 'exports/event_{0}/{1}-{2}.xlsx'.format(obj.event_id, obj.kind, obj.fingerprint)
+
+
+class ExportJob(models.Model):
+    """
+    A (queued or processed) spreadsheet export of data for an event.
+
+    Jobs are identified by a fingerprint of the exported data (see EventExportService.fingerprint), so an export is
+    generated only once for the same data, and subsequent downloads are served from the stored file. When exports are
+    queued (see settings.EVENT_EXPORT_QUEUE), files are generated by the process_export_queue command.
+    """
+
+    kinds = Constants(
+        Constant(REGISTRATIONS='registrations', label=_('Registrations')),
+        Constant(PAYMENTS='payments', label=_('Payments')),
+    )
+
+    event = models.ForeignKey('events.Event', related_name='export_jobs', on_delete=models.CASCADE)
+    kind = ConstantChoiceCharField(max_length=20, constants=kinds)
+    fingerprint = models.CharField(max_length=40, help_text=_('Hash of the last changes to the exported data'))
+    requested_at = models.DateTimeField(verbose_name=_('Request timestamp'))
+    processed_at = models.DateTimeField(verbose_name=_('Processing timestamp'), null=True, blank=True)
+    error = models.TextField(blank=True, help_text=_('Reason the export could not be generated, if any'))
+    file = models.FileField(blank=True, upload_to=export_file_path, storage=private_storage)
+
+    created_at = models.DateTimeField(verbose_name=_('Creation timestamp'), auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name=_('Last update timestamp'), auto_now=True)
+
+    objects = ExportJobManager()
+
+    def __str__(self):
+        return "{} export for {} ({})".format(self.kind.label, self.event, self.requested_at)
+
+    @property
+    def ready(self):
+        return self.processed_at is not None and not self.error
+
+    class Meta:
+        verbose_name = _('export job')
+        verbose_name_plural = _('export jobs')
+
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'kind', 'fingerprint'], name='one_export_job_per_fingerprint'),
+        ]
+        indexes = [
+            # Index to speed up queued lookups
+            models.Index(fields=['processed_at', 'requested_at'], name='idx_export_processed_requested'),
+        ]
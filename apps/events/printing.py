@@ -0,0 +1,87 @@
+"""
+Printable organizer views rendered to PDF files, stored keyed on the data version of their event.
+
+Rendering a PDF for a large event takes a long time, so these are stored (in PRIVATE_MEDIA_ROOT, since they must only
+be served through the printable views) and served again as long as the data of the event is unchanged (see
+EventExportService.fingerprint), with an ETag based on the same fingerprint so browsers only need to revalidate. The
+render_printables command renders the PDFs for multiple events in a pool of processes, so these can be prepared in
+advance.
+"""
+import posixpath
+
+from django.core.files.base import ContentFile
+from django.http import FileResponse
+from django.utils.cache import patch_cache_control
+from django.utils.functional import cached_property
+from django_weasyprint import WeasyTemplateResponseMixin
+
+from arta.common.storage import private_storage
+from arta.common.views import ConditionalMixin
+
+from .services import EventExportService
+
+
+def printable_path(event, name, fingerprint):
+    """ Generate the filename of a printable PDF, these are only served through the printable views. """
+    return 'printables/event_{0}/{1}-{2}.pdf'.format(event.pk, name, fingerprint)
+
+
+def store_printable(event, name, fingerprint, content):
+    """ Stores the given PDF contents (unless already stored), removing PDFs for older versions of the data. """
+    path = printable_path(event, name, fingerprint)
+    if not private_storage.exists(path):
+        private_storage.save(path, ContentFile(content))
+
+    directory, filename = posixpath.split(path)
+    for other in private_storage.listdir(directory)[1]:
+        # This also removes duplicates stored by concurrent requests (which get a suffix added)
+        if other.startswith(name + '-') and other != filename:
+            private_storage.delete(posixpath.join(directory, other))
+
+
+class PrintablePdfMixin(ConditionalMixin, WeasyTemplateResponseMixin):
+    """
+    Serves the view as a PDF, rendered only once for each version of the data of the event (self.event).
+
+    Subclasses should set pdf_name to something unique for the view.
+    """
+
+    pdf_name = None
+
+    @cached_property
+    def fingerprint(self):
+        return EventExportService.fingerprint(self.event)
+
+    @cached_property
+    def etag(self):
+        # This runs before LoginRequiredMixin, so leave redirecting anonymous users to that
+        if not self.request.user.is_authenticated:
+            return None
+        return '{}-{}'.format(self.pdf_name, self.fingerprint)
+
+    def render_pdf(self):
+        """ Renders the PDF (regardless of any stored file), returns its contents. """
+        self.object_list = self.get_queryset()
+        response = self.render_to_response(self.get_context_data())
+        return response.render().content
+
+    @property
+    def pdf_path(self):
+        return printable_path(self.event, self.pdf_name, self.fingerprint)
+
+    def store_pdf(self):
+        """ Renders and stores the PDF, unless already stored for the current data. Returns whether rendered. """
+        if private_storage.exists(self.pdf_path):
+            return False
+        store_printable(self.event, self.pdf_name, self.fingerprint, self.render_pdf())
+        return True
+
+    def get(self, request, *args, **kwargs):
+        self.store_pdf()
+        response = FileResponse(
+            private_storage.open(self.pdf_path), filename='{}-{}.pdf'.format(self.event.name, self.pdf_name),
+            content_type=self.content_type,
+        )
+        # Let browsers keep the PDF, but check the ETag before using it
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,191 @@
+import collections
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+
+import import_export.widgets
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.db.models import Count, Max
+
+from apps.payments.admin import EventPaymentsResource
+from apps.payments.models import Payment
+from apps.people.models import Address, ArtaUser, EmergencyContact, MedicalDetails
+from apps.registrations.models import (Registration, RegistrationField, RegistrationFieldOption,
+                                       RegistrationFieldValue, RegistrationPriceCorrection)
+from arta.common.export import export_rows, write_xlsx
+
+from .admin import EventRegistrationsResource
+from .models import Event, EventRevision, ExportJob
+
+
+class EventExportService:
+    @staticmethod
+    def fingerprint(event):
+        """
+        Returns a hash of the last changes to all data that can be exported or printed for the given event.
+
+        This uses the number of rows and the last updated_at of everything that ends up in an export or printable
+        view, so any change (including deletions) results in a different fingerprint, while computing it needs only a
+        few aggregate queries.
+        """
+        def changes(queryset, *fields):
+            return queryset.order_by().aggregate(
+                Count('pk', distinct=True), *(Max(field) for field in ('updated_at',) + fields),
+            )
+
+        totals = [
+            changes(Event.objects.filter(pk=event.pk)),
+            changes(Registration.objects.filter(event=event), 'user__updated_at'),
+            # These can be deleted separately from users, so need their own count
+            changes(Address.objects.filter(user__registrations__event=event)),
+            changes(MedicalDetails.objects.filter(user__registrations__event=event)),
+            changes(EmergencyContact.objects.filter(user__registrations__event=event)),
+            changes(RegistrationFieldValue.objects.filter(registration__event=event)),
+            changes(RegistrationPriceCorrection.objects.filter(registration__event=event)),
+            changes(Payment.objects.filter(registration__event=event)),
+            changes(RegistrationField.objects.filter(event=event)),
+            changes(RegistrationFieldOption.objects.filter(field__event=event)),
+        ]
+        return hashlib.sha1(repr(totals).encode()).hexdigest()
+
+    @staticmethod
+    def get_export(event, kind):
+        """ Returns the resource and queryset to export for the given ExportJob kind. """
+        # import_export does not offer enough context to widgets to distinguish between viewing and exporting data,
+        # so the monetary widgets (that format amounts for display) are replaced here.
+        if kind == ExportJob.kinds.REGISTRATIONS:
+            resource = EventRegistrationsResource(event)
+            resource.fields['price'].widget = import_export.widgets.DecimalWidget()
+            resource.fields['paid'].widget = import_export.widgets.DecimalWidget()
+            queryset = (
+                resource.get_queryset()
+                .filter(status__in=Registration.statuses.FINALIZED)
+                .order_by('status', 'registered_at')
+            )
+        elif kind == ExportJob.kinds.PAYMENTS:
+            resource = EventPaymentsResource(event)
+            resource.fields['amount'].widget = import_export.widgets.DecimalWidget()
+            queryset = resource.get_queryset().order_by('timestamp')
+        else:
+            raise ValueError("Unknown export kind: {}".format(kind))
+        return resource, queryset
+
+    @staticmethod
+    def request_export(event, kind, retry=False):
+        """
+        Returns the export job for the current data of the given event, queueing a new job when needed.
+
+        When an export of the same data was already requested, that job is returned (processed or not), so identical
+        exports are generated only once. A job that failed is only queued again when retry is passed.
+        """
+        fingerprint = EventExportService.fingerprint(event)
+        export_job, created = ExportJob.objects.get_or_create(
+            event=event, kind=kind, fingerprint=fingerprint,
+            defaults={'requested_at': datetime.now(timezone.utc)},
+        )
+        if not created and export_job.error and retry:
+            export_job.requested_at = datetime.now(timezone.utc)
+            export_job.processed_at = None
+            export_job.error = ''
+            export_job.save()
+        return export_job
+
+    @staticmethod
+    def process_export(export_job):
+        """
+        Generates the file for the given export job, or stores the error in the job when that fails.
+
+        When successful, older exports of the same kind for the same event are deleted (including their files), since
+        these will not be requested anymore.
+        """
+        resource, queryset = EventExportService.get_export(export_job.event, export_job.kind)
+        with tempfile.TemporaryFile() as file:
+            try:
+                write_xlsx(export_rows(resource, queryset), file)
+            except Exception as e:
+                # Keep processing other jobs, but store the error to show to the organizer
+                export_job.error = "{}: {}".format(type(e).__name__, e)
+            else:
+                export_job.file.save('export.xlsx', File(file), save=False)
+
+        export_job.processed_at = datetime.now(timezone.utc)
+        export_job.save()
+
+        if export_job.ready:
+            outdated = ExportJob.objects.filter(
+                event=export_job.event_id, kind=export_job.kind, requested_at__lt=export_job.requested_at,
+            ).exclude(processed_at=None)
+            for old_job in outdated:
+                old_job.file.delete(save=False)
+            outdated.delete()
+
+    @staticmethod
+    def process_export_queue(batch_size=None):
+        """ Processes queued export jobs (for all events) in order of arrival, returns the number processed. """
+        queue = ExportJob.objects.queued().select_related('event')
+        if batch_size is not None:
+            queue = queue[:batch_size]
+        queue = list(queue)
+
+        for export_job in queue:
+            EventExportService.process_export(export_job)
+        return len(queue)
+
+
+class EventHistoryService:
+    @staticmethod
+    def index_revisions(revisions):
+        """
+        Adds EventRevisions for the given (revision, versions) tuples.
+
+        Revisions are indexed for the event and user of each registration they include, and for all events of each
+        user they include. Versions of other objects are ignored (these follow their registration or user, so those are
+        included as well when relevant). Revisions that were indexed before are skipped, so this can safely run again.
+        """
+        registration_type = ContentType.objects.get_for_model(Registration)
+        user_type = ContentType.objects.get_for_model(ArtaUser)
+        registration_ids = collections.defaultdict(set)
+        user_ids = collections.defaultdict(set)
+        for revision, versions in revisions:
+            for version in versions:
+                if version.content_type_id == registration_type.pk:
+                    registration_ids[revision].add(int(version.object_id))
+                elif version.content_type_id == user_type.pk:
+                    user_ids[revision].add(int(version.object_id))
+
+        # Objects that no longer exist (e.g. deleted in the revision) are not indexed
+        registrations = {
+            pk: (event_id, user_id)
+            for (pk, event_id, user_id) in Registration.objects.filter(
+                pk__in=set().union(*registration_ids.values()),
+            ).values_list('pk', 'event_id', 'user_id')
+        }
+        user_events = collections.defaultdict(set)
+        for (user_id, event_id) in Registration.objects.filter(
+            user__in=set().union(*user_ids.values()),
+        ).values_list('user_id', 'event_id'):
+            user_events[user_id].add(event_id)
+
+        rows = {
+            (revision, event_id, user_id)
+            for (revision, pks) in registration_ids.items()
+            for (event_id, user_id) in (registrations[pk] for pk in pks if pk in registrations)
+        } | {
+            (revision, event_id, user_id)
+            for (revision, pks) in user_ids.items()
+            for user_id in pks
+            for event_id in user_events[user_id]
+        }
+        names = dict(
+            ArtaUser.objects.filter(pk__in={user_id for (_rev, _event, user_id) in rows})
+            .with_full_name()
+            .values_list('pk', 'full_name'),
+        )
+        EventRevision.objects.bulk_create([
+            EventRevision(
+                revision=revision, event_id=event_id, user_id=user_id, name=names[user_id],
+                date_created=revision.date_created,
+            )
+            for (revision, event_id, user_id) in rows
+        ], ignore_conflicts=True)
@@ -0,0 +1,16 @@
+"""
+Signal handlers that keep the EventRevision index up-to-date.
+
+Revisions saved using reversion.create_revision() (including the admin) and bulk_create_revision() send
+post_revision_commit, so these are all indexed. Use the index_revisions command for revisions saved before.
+"""
+from django.dispatch import receiver
+from reversion.signals import post_revision_commit
+
+from .services import EventHistoryService
+
+
+@receiver(post_revision_commit)
+def revision_committed(sender, revision, versions, **kwargs):
+    """ Indexes a saved revision for the events it changed registrations for. """
+    EventHistoryService.index_revisions([(revision, versions)])
@@ -3,7 +3,9 @@ from django.test import TestCase
 from django.urls import reverse
 
 from apps.people.tests.factories import ArtaUserFactory
-from apps.registrations.tests.factories import RegistrationFieldFactory, RegistrationFieldOptionFactory
+from apps.registrations.models import Registration
+from apps.registrations.tests.factories import (RegistrationFactory, RegistrationFieldFactory,
+                                                RegistrationFieldOptionFactory)
 
 from .factories import EventFactory
 
@@ -159,3 +161,33 @@ class TestCopyFieldsView(TestCase):
             self.assertEqual(actual_depends, expected_depends or {})
 
         return response
+
+
+class TestLotteryView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(admit_immediately=False, slots=1)
+        cls.pending = [RegistrationFactory(event=cls.event, pending=True) for _i in range(3)]
+
+        cls.staff_with_permission = ArtaUserFactory(is_staff=True, permissions=['registrations.change_registration'])
+        cls.staff_without_permission = ArtaUserFactory(is_staff=True)
+
+    def test_lottery(self):
+        """ Check that the lottery view shows the pending count and runs the lottery with the given seed. """
+        self.client.force_login(self.staff_with_permission)
+        url = reverse('admin:event_lottery', args=(self.event.pk,))
+
+        response = self.client.get(url)
+        self.assertEqual(response.context['num_pending'], 3)
+
+        response = self.client.post(url, {'seed': 5})
+        self.assertTemplateUsed(response, 'events/admin/lottery_complete.html')
+        self.assertEqual(tuple(response.context['result']), (5, 1, 2))
+        self.assertEqual(self.event.registrations.filter(status=Registration.statuses.REGISTERED).count(), 1)
+
+    def test_lottery_no_permission(self):
+        """ Lottery without permissions redirects to login page """
+        self.client.force_login(self.staff_without_permission)
+        response = self.client.post(reverse('admin:event_lottery', args=(self.event.pk,)), {'seed': 5})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.event.registrations.exclude(status=Registration.statuses.PENDING).exists())
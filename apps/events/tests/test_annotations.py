@@ -1,14 +1,20 @@
+import time
 from datetime import datetime, timedelta, timezone
+from unittest import mock
 
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
 from django.db.models import Q
-from django.test import TestCase
+from django.test import TestCase, override_settings, tag
 
+from apps.core.tests.test_parallel_users import Stopwatch
 from apps.people.tests.factories import ArtaUserFactory, GroupFactory
 from apps.registrations.models import Registration
 from apps.registrations.tests.factories import (RegistrationFactory, RegistrationFieldFactory,
                                                 RegistrationFieldOptionFactory)
 
 from ..models import Event
+from ..models.event import UserContext
 from .factories import EventFactory
 
 
@@ -396,3 +402,90 @@ class TestForUserAnnotationRegression(TestCase):
         EventFactory(invitee_group=group, organizer_group=group)
         events = Event.objects.all().for_user(None)
         self.assertEqual(len(events), 1)
+
+
+class TestUserContext(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ArtaUserFactory()
+        cls.group = GroupFactory(users=[cls.user])
+        cls.event = EventFactory(public=True, registration_opens_in_days=1, invitee_registration_opens_in_days=-1,
+                                 invitee_group=cls.group, organizer_group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached(self):
+        """ Check that the user context is resolved once, after which for_user needs only the query itself. """
+        self.assertEqual(UserContext.for_user(self.user), (self.user.pk, {self.group.pk}, False))
+        with self.assertNumQueries(1):
+            event = Event.objects.for_user(self.user.pk).get()
+        self.assertTrue(event.user_is_invitee)
+        self.assertTrue(event.user_is_organizer)
+        self.assertTrue(event.registration_is_open)
+
+    def test_groups_changed(self):
+        """ Check that changing group memberships (from either side) or superuser status is noticed. """
+        other = GroupFactory()
+        UserContext.for_user(self.user)
+        self.user.groups.add(other)
+        self.assertEqual(UserContext.for_user(self.user).group_ids, {self.group.pk, other.pk})
+        self.group.user_set.remove(self.user)
+        self.assertEqual(UserContext.for_user(self.user).group_ids, {other.pk})
+        other.user_set.clear()
+        self.assertEqual(UserContext.for_user(self.user).group_ids, set())
+        self.assertFalse(Event.objects.for_user(self.user).get().registration_is_open)
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertTrue(UserContext.for_user(self.user).is_superuser)
+        self.assertTrue(Event.objects.for_user(self.user).get().user_is_superuser)
+
+    @override_settings(USER_CONTEXT_CACHE_TIMEOUT=60)
+    def test_timeout(self):
+        """ Check that changes that do not bump the user version are noticed after the timeout. """
+        UserContext.for_user(self.user)
+        # Bulk operations do not send signals
+        Group.user_set.through.objects.filter(artauser=self.user).delete()
+        self.assertEqual(UserContext.for_user(self.user).group_ids, {self.group.pk})
+
+        now = time.time()
+        with mock.patch('time.time', return_value=now + 61):
+            self.assertEqual(UserContext.for_user(self.user).group_ids, set())
+
+    def test_anonymous(self):
+        """ Check that anonymous users are not in any groups. """
+        self.assertEqual(UserContext.for_user(AnonymousUser()), (None, set(), False))
+        with self.assertNumQueries(1):
+            event = Event.objects.for_user(None).get()
+        self.assertFalse(event.user_is_invitee)
+        self.assertFalse(event.registration_is_open)
+
+
+@tag('benchmark')
+class TestForUserQueryPlan(TestCase):
+    """ Shows the query plan and timing for for_user with many events, to compare across changes and databases. """
+
+    num_events = 150
+    repeat = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = ArtaUserFactory()
+        groups = GroupFactory.create_batch(5, users=[cls.user])
+        for i in range(cls.num_events):
+            event = EventFactory(public=True, registration_opens_in_days=-1, invitee_group=groups[i % 5],
+                                 organizer_group=GroupFactory())
+            field = RegistrationFieldFactory(event=event)
+            RegistrationFieldOptionFactory(field=field, full=True)
+            RegistrationFieldOptionFactory(field=field, invite_only=groups[i % 5])
+
+    def test_plan(self):
+        events = Event.objects.for_user(self.user, with_registration=True).filter(is_visible=True)
+        print()  # noqa: T001
+        print(events.explain())  # noqa: T001
+        with Stopwatch() as stopwatch:
+            for _i in range(self.repeat):
+                self.assertEqual(len(Event.objects.for_user(self.user, with_registration=True)), self.num_events)
+        print("{}: {:.1f} ms per query ({} events)".format(  # noqa: T001
+            self.id(), stopwatch.ms() / self.repeat, self.num_events))
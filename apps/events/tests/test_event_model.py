@@ -1,11 +1,16 @@
+from datetime import timedelta
+from unittest import mock
+
 from django.db.utils import IntegrityError
 from django.test import TestCase, skipUnlessDBFeature
+from django.utils import timezone
 
 from apps.people.tests.factories import ArtaUserFactory, GroupFactory
 from apps.registrations.models import Registration
 from apps.registrations.tests.factories import RegistrationFactory
 
 from ..models import Event
+from ..models.event import EventPhases
 from .factories import EventFactory, SeriesFactory
 
 
@@ -67,3 +72,44 @@ class TestConstraints(TestCase):
         EventFactory(registration_opens_in_days=2, invitee_registration_opens_in_days=1)
         EventFactory(registration_opens_in_days=2)
         EventFactory(invitee_registration_opens_in_days=1)
+
+
+class TestEventPhases(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=1, starts_in_days=3, public=True)
+
+    def test_changes(self):
+        """ Check the moments the phase changes, and that these match exactly with the for_user annotations. """
+        phases = self.event.phases
+        opens_at = self.event.public_registration_opens_at
+        self.assertEqual(phases, (opens_at, None, phases.closes_at))
+        self.assertEqual(timezone.localtime(phases.closes_at).date(), self.event.start_date)
+
+        for (now, passed, next_change) in (
+            (opens_at - timedelta(seconds=1), (False, False, False), opens_at),
+            (opens_at, (True, False, False), phases.closes_at),
+            (phases.closes_at - timedelta(microseconds=1), (True, False, False), phases.closes_at),
+            (phases.closes_at, (True, False, True), None),
+        ):
+            with self.subTest(now=now), mock.patch('django.utils.timezone.now', return_value=now):
+                self.assertEqual(phases.passed(), passed)
+                self.assertEqual(phases.next_change(), next_change)
+                event = Event.objects.for_user(None).get(pk=self.event.pk)
+                self.assertEqual(event.registration_is_open, passed == (True, False, False))
+                self.assertEqual(event.registration_has_closed, passed[2])
+
+    def test_registration_closes_at(self):
+        """ Check that registration_closes_at is used when before the start date. """
+        self.event.registration_closes_at = self.event.public_registration_opens_at + timedelta(hours=1)
+        self.assertEqual(EventPhases.for_event(self.event).closes_at, self.event.registration_closes_at)
+        self.event.registration_closes_at += timedelta(days=7)
+        self.assertLess(EventPhases.for_event(self.event).closes_at, self.event.registration_closes_at)
+
+    def test_cache_timeout(self):
+        """ Check that cache timeouts are shortened to expire at (not before) the next change. """
+        opens_at = self.event.public_registration_opens_at
+        phases = self.event.phases
+        self.assertEqual(phases.cache_timeout(60, now=opens_at - timedelta(seconds=10.5)), 11)
+        self.assertEqual(phases.cache_timeout(60, now=opens_at - timedelta(minutes=10)), 60)
+        self.assertEqual(phases.cache_timeout(60, now=phases.closes_at), 60)
@@ -0,0 +1,287 @@
+import csv
+import io
+import os
+import tempfile
+from resource import RUSAGE_SELF, getrusage
+from unittest import mock
+
+import import_export.formats.base_formats
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings, tag
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from apps.core.tests.test_parallel_users import Stopwatch
+from apps.payments.tests.factories import PaymentFactory
+from apps.people.models import ArtaUser
+from apps.people.tests.factories import ArtaUserFactory, GroupFactory
+from apps.registrations.models import Registration, RegistrationFieldValue
+from apps.registrations.tests.factories import (RegistrationFactory, RegistrationFieldFactory,
+                                                RegistrationFieldOptionFactory)
+from arta.common.export import export_response, export_rows
+
+from ..admin import EventRegistrationsResource
+from ..models import ExportJob
+from ..services import EventExportService
+from .factories import EventFactory
+
+
+def read_xlsx(content):
+    """ Returns the cell values of the first sheet of the given XLSX file contents. """
+    sheet = load_workbook(io.BytesIO(content), read_only=True).worksheets[0]
+    return [[cell.value for cell in row] for row in sheet.rows]
+
+
+class TemporaryMediaRootMixin:
+    """ Stores exports in a temporary PRIVATE_MEDIA_ROOT, removed after each test. """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = self.settings(PRIVATE_MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class TestExport(TemporaryMediaRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = ArtaUserFactory(is_staff=True, is_superuser=True)
+        cls.event = EventFactory(
+            registration_opens_in_days=-1, public=True, organizer_group=GroupFactory(users=[cls.organizer]),
+        )
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", price=10)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew, with comma")
+        for i in range(5):
+            reg = RegistrationFactory(event=cls.event, registered=True, options=[(cls.player, cls.crew)[i % 2]])
+            PaymentFactory(registration=reg, amount=i, completed=True)
+        RegistrationFactory(event=cls.event, waiting_list=True, options=[cls.player])
+        RegistrationFactory(event=cls.event, preparation_in_progress=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.organizer)
+
+    def test_rows(self):
+        """ Check that rows are the same as for Resource.export, when using multiple chunks. """
+        resource = EventRegistrationsResource(self.event)
+        queryset = resource.get_queryset()
+        dataset = resource.export(queryset)
+        # One query for the registrations, plus one for prefetching the options of each chunk
+        with self.assertNumQueries(4):
+            rows = list(export_rows(resource, queryset, chunk_size=3))
+        self.assertEqual(rows, [dataset.headers, *map(list, dataset)])
+
+    def test_csv(self):
+        """ Check that the CSV export matches the one produced from a complete Dataset. """
+        resource = EventRegistrationsResource(self.event)
+        file_format = import_export.formats.base_formats.CSV()
+        expected = file_format.export_data(resource.export(resource.get_queryset()))
+
+        response = export_response(resource, resource.get_queryset(), file_format, filename='export')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="export.csv"')
+        self.assertEqual(b''.join(response.streaming_content).decode(), expected)
+
+    def test_admin_action(self):
+        """ Check exporting active registrations from the admin. """
+        response = self.client.post(reverse('admin:events_event_changelist'), {
+            'action': 'export_active_registrations', '_selected_action': [self.event.pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        # Header, registered and waiting list
+        self.assertEqual(len(rows), 7)
+        self.assertIn("Crew, with comma", rows[2])
+
+    def test_registrations_table_download(self):
+        """ Check that the XLSX download matches the one produced from a complete Dataset. """
+        response = self.client.get(reverse('events:registrations_table', args=(self.event.pk,)))
+        expected = read_xlsx(import_export.formats.base_formats.XLSX().export_data(response.context['data']))
+
+        response = self.client.get(reverse('events:registrations_table_download', args=(self.event.pk,)))
+        self.assertEqual(response['Content-Type'], import_export.formats.base_formats.XLSX().get_content_type())
+        content = b''.join(response.streaming_content)
+        # The table view links prices, so compare all other columns
+        price_columns = {expected[0].index('price'), expected[0].index('paid')}
+        for (row, expected_row) in zip(read_xlsx(content), expected, strict=True):
+            for (i, value) in enumerate(row):
+                if i not in price_columns:
+                    self.assertEqual(value, expected_row[i])
+
+    def test_payments_table_download(self):
+        """ Check the payments XLSX download. """
+        response = self.client.get(reverse('events:payments_table_download', args=(self.event.pk,)))
+        rows = read_xlsx(b''.join(response.streaming_content))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([row[rows[0].index('amount')] for row in rows[1:]], [0, 1, 2, 3, 4])
+
+
+class TestExportJobs(TemporaryMediaRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = ArtaUserFactory()
+        cls.event = EventFactory(
+            registration_opens_in_days=-1, public=True, organizer_group=GroupFactory(users=[cls.organizer]),
+        )
+        cls.player = RegistrationFieldOptionFactory(field=RegistrationFieldFactory(event=cls.event), price=10)
+        cls.registration = RegistrationFactory(event=cls.event, registered=True, options=[cls.player])
+        PaymentFactory(registration=cls.registration, amount=10, completed=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.organizer)
+        self.url = reverse('events:payments_table_download', args=(self.event.pk,))
+
+    def download(self):
+        """ Downloads the payments export, returns its rows. """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return read_xlsx(b''.join(response.streaming_content))
+
+    def test_stored(self):
+        """ Check that the export is generated once, and served from the stored file afterwards. """
+        self.assertEqual(len(self.download()), 2)
+        export_job = ExportJob.objects.get()
+        self.assertTrue(export_job.ready)
+        # Not stored in MEDIA_ROOT, which is served publicly
+        self.assertTrue(os.path.exists(os.path.join(settings.PRIVATE_MEDIA_ROOT, export_job.file.name)))
+        with self.assertRaises(ValueError):
+            export_job.file.url
+
+        with mock.patch('apps.events.services.write_xlsx') as write_xlsx:
+            self.assertEqual(len(self.download()), 2)
+        write_xlsx.assert_not_called()
+        self.assertEqual(ExportJob.objects.get(), export_job)
+
+    def test_fingerprint(self):
+        """ Check that changes to exported data result in a new export, deleting the old one. """
+        original = EventExportService.fingerprint(self.event)
+        fingerprints = {original}
+        self.download()
+        old_job = ExportJob.objects.get()
+
+        def changed():
+            fingerprint = EventExportService.fingerprint(self.event)
+            self.assertNotIn(fingerprint, fingerprints)
+            fingerprints.add(fingerprint)
+
+        payment = PaymentFactory(registration=self.registration, amount=5, completed=True)
+        changed()
+        self.assertEqual(len(self.download()), 3)
+        self.assertEqual(ExportJob.objects.get().fingerprint, EventExportService.fingerprint(self.event))
+        self.assertFalse(old_job.file.storage.exists(old_job.file.name))
+
+        # Deleting the new payment again restores the original data
+        payment.delete()
+        self.assertEqual(EventExportService.fingerprint(self.event), original)
+        self.registration.user.first_name = "Changed"
+        self.registration.user.save()
+        changed()
+        self.registration.options.update(string_value="Changed")
+        changed()
+        # Other events do not matter
+        RegistrationFactory(event=EventFactory(), registered=True)
+        self.assertIn(EventExportService.fingerprint(self.event), fingerprints)
+
+    @override_settings(EVENT_EXPORT_QUEUE=True)
+    def test_queue(self):
+        """ Check that queued exports show their status until processed by process_export_queue. """
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'events/export_processing.html')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+        self.assertContains(response, 'http-equiv="refresh"')
+
+        # Requests for the same data do not queue another job
+        self.client.get(self.url)
+        self.assertEqual(ExportJob.objects.queued().count(), 1)
+
+        out = io.StringIO()
+        call_command('process_export_queue', '--once', verbosity=2, stdout=out)
+        self.assertEqual(out.getvalue(), "Processed 1 exports\n")
+        self.assertEqual(ExportJob.objects.queued().count(), 0)
+        self.assertEqual(len(self.download()), 2)
+
+    @override_settings(EVENT_EXPORT_QUEUE=True)
+    def test_error(self):
+        """ Check that errors are shown, and that the export can be retried. """
+        self.client.get(self.url)
+        with mock.patch('apps.events.services.write_xlsx', side_effect=ValueError("Broken")):
+            self.assertEqual(EventExportService.process_export_queue(), 1)
+
+        response = self.client.get(self.url)
+        self.assertContains(response, "ValueError: Broken")
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        self.assertEqual(ExportJob.objects.queued().count(), 0)
+
+        self.assertRedirects(self.client.get(self.url, {'retry': 1}), self.url, fetch_redirect_response=False)
+        self.assertEqual(EventExportService.process_export_queue(), 1)
+        self.assertEqual(len(self.download()), 2)
+
+    def test_other_organizer(self):
+        """ Check that exports are only available to organizers of the event. """
+        self.client.force_login(ArtaUserFactory())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertFalse(ExportJob.objects.exists())
+
+
+@tag('benchmark')
+class TestExportBenchmark(TestCase):
+    """ Benchmark exporting many registrations, comparing streaming with building a complete Dataset. """
+
+    registrations = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True)
+        fields = [RegistrationFieldFactory(event=cls.event, name="field{}".format(i)) for i in range(5)]
+        options = [RegistrationFieldOptionFactory(field=field, title="Option", price=10) for field in fields]
+
+        # Create in batches, to keep the peak RSS of the setup itself low
+        now = timezone.now()
+        for batch in range(0, cls.registrations, 1000):
+            users = ArtaUser.objects.bulk_create(
+                ArtaUser(email='user{}@example.com'.format(i), first_name="First", last_name="Last")
+                for i in range(batch, min(batch + 1000, cls.registrations))
+            )
+            registrations = Registration.objects.bulk_create(
+                Registration(event=cls.event, user=user, status=Registration.statuses.REGISTERED, registered_at=now)
+                for user in ArtaUser.objects.filter(email__in=[u.email for u in users])
+            )
+            RegistrationFieldValue.objects.bulk_create(
+                RegistrationFieldValue(registration=reg, field=option.field, option=option, active=True)
+                for reg in Registration.objects.filter(user__in=[r.user_id for r in registrations])
+                for option in options
+            )
+
+    def measure(self, name, func):
+        """ Runs func, printing the time taken and the peak RSS of the process (which can only grow) afterwards. """
+        with Stopwatch() as stopwatch:
+            size = func()
+        maxrss = getrusage(RUSAGE_SELF).ru_maxrss
+        print("{:>16}: {:>5.1f} seconds, {:>6.1f} MiB peak RSS, {:.1f} MiB file".format(  # noqa: T001
+            name, stopwatch.seconds(), maxrss / 2 ** 10, size / 2 ** 20,
+        ))
+
+    def test_export(self):
+        """ Compare export_response with Resource.export (streaming first, since the peak RSS can only grow). """
+        resource = EventRegistrationsResource(self.event)
+        print()  # noqa: T001
+        print("{} ({} registrations)".format(self.id(), self.registrations))  # noqa: T001
+        self.measure('before', lambda: 0)
+
+        for file_format in (import_export.formats.base_formats.CSV(), import_export.formats.base_formats.XLSX()):
+            def streaming(file_format=file_format):
+                response = export_response(resource, resource.get_queryset(), file_format, filename='export')
+                return sum(len(chunk) for chunk in response.streaming_content)
+
+            self.measure('streaming ' + file_format.get_extension(), streaming)
+
+        for file_format in (import_export.formats.base_formats.CSV(), import_export.formats.base_formats.XLSX()):
+            def dataset(file_format=file_format):
+                return len(file_format.export_data(resource.export(resource.get_queryset())))
+
+            self.measure('dataset ' + file_format.get_extension(), dataset)
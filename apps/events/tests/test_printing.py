@@ -0,0 +1,90 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.people.tests.factories import ArtaUserFactory, GroupFactory
+from apps.registrations.tests.factories import RegistrationFactory
+from arta.common.storage import private_storage
+
+from ..printing import PrintablePdfMixin, printable_path
+from .factories import EventFactory
+from .test_export import TemporaryMediaRootMixin
+
+
+@mock.patch.object(PrintablePdfMixin, 'render_pdf', autospec=True, return_value=b'%PDF-rendered')
+class TestPrintablePdf(TemporaryMediaRootMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = ArtaUserFactory()
+        cls.event = EventFactory(
+            registration_opens_in_days=-1, public=True, organizer_group=GroupFactory(users=[cls.organizer]),
+        )
+        cls.registration = RegistrationFactory(event=cls.event, registered=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.organizer)
+        self.url = reverse('events:printable_kitchen_info', args=(self.event.pk,))
+
+    def test_stored(self, render_pdf):
+        """ Check that the PDF is rendered once, and served from the stored file afterwards. """
+        for _i in range(2):
+            response = self.client.get(self.url)
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF-rendered')
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+        render_pdf.assert_called_once()
+
+    def test_conditional(self, render_pdf):
+        """ Check that browsers can revalidate the PDF using its ETag. """
+        response = self.client.get(self.url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.registration.user.first_name = "Changed"
+        self.registration.user.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes(self, render_pdf):
+        """ Check that changes to the data render the PDF again, removing the old one. """
+        response = self.client.get(self.url)
+        old_path = printable_path(self.event, 'kitchen_info', response['ETag'].strip('"').split('-')[-1])
+        self.assertTrue(private_storage.exists(old_path))
+
+        RegistrationFactory(event=self.event, registered=True)
+        self.client.get(self.url)
+        self.assertEqual(render_pdf.call_count, 2)
+        self.assertFalse(private_storage.exists(old_path))
+
+        # Other printables of the same event are kept
+        self.client.get(reverse('events:printable_safety_reference', args=(self.event.pk,)))
+        self.client.get(self.url)
+        self.assertEqual(render_pdf.call_count, 3)
+
+    def test_access(self, render_pdf):
+        """ Check that PDFs are not served to others than organizers. """
+        self.client.logout()
+        self.assertRedirects(self.client.get(self.url), '{}?next={}'.format(reverse('account_login'), self.url))
+
+        self.client.force_login(ArtaUserFactory())
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        render_pdf.assert_not_called()
+
+    def test_command(self, render_pdf):
+        """ Check that render_printables renders all PDFs, once. """
+        out = io.StringIO()
+        args = ('render_printables', '--base-url', 'https://example.com/', '--processes', '1')
+        call_command(*args, stdout=out)
+        self.assertEqual(out.getvalue(), "Rendered 3 PDFs\n")
+
+        self.client.get(self.url)
+        out = io.StringIO()
+        call_command(*args, str(self.event.pk), stdout=out)
+        self.assertEqual(out.getvalue(), "Rendered 0 PDFs\n")
+        self.assertEqual(render_pdf.call_count, 3)
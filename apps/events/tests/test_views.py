@@ -1,17 +1,22 @@
+import io
 import itertools
 from datetime import datetime, timedelta, timezone
 
 import reversion
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from parameterized import parameterized
 
 from apps.people.tests.factories import ArtaUserFactory, GroupFactory, MedicalDetailsFactory
 from apps.registrations.models import Registration
+from apps.registrations.services import RegistrationStatusService
 from apps.registrations.tests.factories import (RegistrationFactory, RegistrationFieldFactory,
                                                 RegistrationFieldOptionFactory)
 
-from ..models import Event
+from ..models import Event, EventRevision
 from .factories import EventFactory
 
 
@@ -89,6 +94,26 @@ class TestRegisteredEventsView(TestCase):
             registrations,
         )
 
+    def test_queries(self):
+        """ Check that the number of queries does not depend on the number of events shown. """
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.get()
+            return len(queries)
+
+        field = RegistrationFieldFactory(event=Event.objects.get(title='past_public_open_now'))
+        option = RegistrationFieldOptionFactory(field=field, price=10)
+        self.makeRegistrationsForEvents(titles=['past_public_open_now'], user=self.user, registered=True,
+                                        options=[option])
+        count_queries()
+        num_queries = count_queries()
+
+        self.makeRegistrationsForEvents(titles=['future_public_open_now', 'past_public_closed_again'],
+                                        user=self.user, waiting_list=True)
+        # Schemas are loaded once, and cached afterwards
+        count_queries()
+        self.assertEqual(count_queries(), num_queries)
+
     def test_no_registrations(self):
         """ Check events without registrations do not show up. """
         response = self.get()
@@ -375,9 +400,9 @@ class TestEventRegistrationsHistory(TestCase):
     def setUp(self):
         self.client.force_login(self.organizer)
 
-    def get(self, expected_revisions):
+    def get(self, expected_revisions, **params):
         view = 'events:event_registrations_history'
-        response = self.client.get(reverse(view, args=(self.event.pk,)))
+        response = self.client.get(reverse(view, args=(self.event.pk,)), params)
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'events/event_registrations_history.html')
 
@@ -448,3 +473,79 @@ class TestEventRegistrationsHistory(TestCase):
         self.get(expected_revisions=[
             (double_rev, [regs[0]]),
         ])
+
+    def test_user_in_revision(self):
+        """ Test that revisions changing users (rather than registrations) are shown for their registered events. """
+        reg = RegistrationFactory(event=self.event, registered=True)
+        with reversion.create_revision():
+            reg.user.first_name = "Changed"
+            reg.user.save()
+        revision = reversion.models.Revision.objects.get()
+
+        self.get(expected_revisions=[(revision, [reg])])
+
+    def test_bulk_revision(self):
+        """ Test that revisions saved by bulk_create_revision are shown. """
+        regs = RegistrationFactory.create_batch(2, event=self.event, pending=True)
+        RegistrationStatusService.change_statuses(
+            regs, Registration.statuses.PENDING, Registration.statuses.REGISTERED,
+        )
+        revision = reversion.models.Revision.objects.get()
+
+        self.get(expected_revisions=[(revision, regs)])
+
+    def test_pages(self):
+        """ Test that revisions are shown newest first in pages, with a constant number of queries per page. """
+        regs = RegistrationFactory.create_batch(3, event=self.event, registered=True)
+        for i in range(30):
+            with reversion.create_revision():
+                regs[i % 3].save()
+        revisions = list(reversion.models.Revision.objects.order_by('-date_created', '-pk'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(
+                expected_revisions=[(rev, [regs[(29 - i) % 3]]) for (i, rev) in enumerate(revisions[:25])],
+            )
+        num_queries = len(queries)
+        page = response.context['page_obj']
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(
+                expected_revisions=[(rev, [regs[(4 - i) % 3]]) for (i, rev) in enumerate(revisions[25:])],
+                after=page.next_cursor,
+            )
+        self.assertEqual(len(queries), num_queries)
+        self.assertFalse(response.context['page_obj'].has_next())
+        self.assertTrue(response.context['page_obj'].has_previous())
+
+    def test_invalid_cursor(self):
+        """ Test that an invalid page cursor results in a 404. """
+        for cursor in ('foo', 'WzFd', 'WyJmb28iLDFd'):
+            response = self.client.get(
+                reverse('events:event_registrations_history', args=(self.event.pk,)), {'after': cursor},
+            )
+            self.assertEqual(response.status_code, 404)
+
+    def test_index_command(self):
+        """ Test that the index_revisions command indexes revisions saved before the index existed. """
+        regs = [
+            RegistrationFactory(event=self.event, registered=True),
+            RegistrationFactory(event=self.event, registered=True),
+        ]
+        with reversion.create_revision():
+            regs[0].save()
+        with reversion.create_revision():
+            regs[1].user.save()
+        revisions = list(reversion.models.Revision.objects.order_by('-date_created', '-pk'))
+        EventRevision.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('index_revisions', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue(), "Indexed 2 revisions in total\n")
+        self.get(expected_revisions=[(revisions[0], [regs[1]]), (revisions[1], [regs[0]])])
+
+        out = io.StringIO()
+        call_command('index_revisions', stdout=out)
+        self.assertEqual(out.getvalue(), "Indexed 0 revisions in total\n")
@@ -1,26 +1,30 @@
-from datetime import date, datetime
+from datetime import date
 
 import import_export.formats.base_formats
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery, Value
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.db.models import Count, F, Prefetch, Q, Value
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.html import escape
 from django.views.generic.list import ListView
-from django_weasyprint import WeasyTemplateResponseMixin
-from reversion.models import Revision, Version
+from reversion.models import Revision
 
 from apps.payments.admin import EventPaymentsResource
-from apps.people.models import ArtaUser
-from apps.registrations.models import Registration, RegistrationFieldValue, RegistrationPriceCorrection
+from apps.registrations.models import Registration, RegistrationFieldValue
+from apps.registrations.report import EventReport
+from apps.registrations.schema import EventSchema
 from arta.common.admin import MonetaryResourceWidget
 from arta.common.db import GroupConcat, QExpr
+from arta.common.views import KeysetPaginationMixin
 
 from .admin import EventRegistrationsResource
-from .models import Event
+from .models import Event, EventRevision, ExportJob
+from .printing import PrintablePdfMixin
+from .services import EventExportService
 
 
 class RegisteredEventList(LoginRequiredMixin, ListView):
@@ -35,9 +39,11 @@ class RegisteredEventList(LoginRequiredMixin, ListView):
             super().get_queryset()
             .for_user(self.request.user, with_registration=True)
             .filter(registration_status__in=Registration.statuses.FINALIZED)
+            .prefetch_current_registration(self.request.user, Registration.objects.with_summary())
         )
 
     def get_context_data(self, **kwargs):
+        EventSchema.prefetch([e.registration for e in self.object_list if e.registration])
         future = []
         past = []
         for e in self.object_list:
@@ -111,8 +117,8 @@ class RegistrationForms(EventRegistrationInfoBase):
         )
 
 
-class PrintableRegistrationForms(WeasyTemplateResponseMixin, RegistrationForms):
-    pass
+class PrintableRegistrationForms(PrintablePdfMixin, RegistrationForms):
+    pdf_name = 'registration_forms'
 
 
 class KitchenInfo(EventRegistrationInfoBase):
@@ -137,8 +143,8 @@ class KitchenInfo(EventRegistrationInfoBase):
         )
 
 
-class PrintableKitchenInfo(WeasyTemplateResponseMixin, KitchenInfo):
-    pass
+class PrintableKitchenInfo(PrintablePdfMixin, KitchenInfo):
+    pdf_name = 'kitchen_info'
 
 
 class SafetyReference(EventRegistrationInfoBase):
@@ -155,8 +161,8 @@ class SafetyReference(EventRegistrationInfoBase):
         )
 
 
-class PrintableSafetyReference(WeasyTemplateResponseMixin, SafetyReference):
-    pass
+class PrintableSafetyReference(PrintablePdfMixin, SafetyReference):
+    pdf_name = 'safety_reference'
 
 
 class SafetyInfo(EventRegistrationInfoBase):
@@ -201,18 +207,17 @@ class RegistrationsTable(EventRegistrationInfoBase):
     def resource(self):
         return self.get_resource()
 
+    def get_registrations_queryset(self):
+        return (
+            self.resource.get_queryset()
+            .filter(status__in=Registration.statuses.FINALIZED)
+            .order_by('status', 'registered_at')
+        )
+
     @cached_property
     def registrations(self):
         """ Returns a list of registrations instead of a queryset, to allow iterating twice. """
-        return list(self.resource.get_queryset()
-                    .filter(status__in=Registration.statuses.FINALIZED)
-                    .order_by('status', 'registered_at')
-                    .with_payment_status()
-                    .prefetch_related('options')
-                    .prefetch_related(Prefetch(
-                        'price_corrections',
-                        queryset=RegistrationPriceCorrection.objects.with_active(),
-                    )))
+        return list(self.get_registrations_queryset())
 
     @cached_property
     def data(self):
@@ -222,85 +227,65 @@ class RegistrationsTable(EventRegistrationInfoBase):
         kwargs['data'] = self.data
         kwargs['download_url'] = reverse('events:registrations_table_download', args=(self.event.pk,))
 
-        payable = 0
-        refundable = 0
-        price_sum = 0
-        paid_sum = 0
-        price_check = 0
-        options_sum = 0
-        corrections_sum = 0
-        corrections = []
-        options = {
-            option.pk: option
-            for field in self.event.registration_fields.all().prefetch_related('options')
-            for option in field.options.all()
-        }
-        option_counts = {option: 0 for option in options.values()}
-
-        for reg in self.registrations:
-            if reg.status.REGISTERED:
-                for value in reg.options.all():
-                    # This uses option_id to prevent having to (pre)fetch the option for each registration field value
-                    if value.active and value.option_id is not None:
-                        option = options[value.option_id]
-                        option_counts[option] += 1
-                        if option.price:
-                            price_check += option.price
-                            options_sum += option.price
-
-            if reg.status.REGISTERED or reg.status.CANCELLED:
-                price = reg.price if reg.price is not None else 0
-                paid = reg.paid if reg.paid is not None else 0
-
-                price_sum += price
-                paid_sum += paid
-
-                if price > paid:
-                    payable += (price - paid)
-                else:
-                    refundable += (paid - price)
-
-                for correction in reg.price_corrections.all():
-                    if correction.active:
-                        corrections.append((reg, correction))
-                        price_check += correction.price
-                        corrections_sum += correction.price
-
-        kwargs['option_counts'] = option_counts
-        kwargs['payable'] = payable
-        kwargs['refundable'] = refundable
-        kwargs['price_sum'] = price_sum
-        kwargs['paid_sum'] = paid_sum
-        kwargs['options_sum'] = options_sum
-        kwargs['corrections_sum'] = corrections_sum
-        kwargs['price_check'] = price_check
-        kwargs['corrections'] = corrections
+        report = EventReport.for_event(self.event)
+        kwargs['option_counts'] = report.option_counts
+        kwargs['payable'] = report.payable
+        kwargs['refundable'] = report.refundable
+        kwargs['price_sum'] = report.price_sum
+        kwargs['paid_sum'] = report.paid_sum
+        kwargs['options_sum'] = report.options_sum
+        kwargs['corrections_sum'] = report.corrections_sum
+        kwargs['price_check'] = report.price_check
+        kwargs['corrections'] = report.corrections
 
         return super().get_context_data(**kwargs)
 
 
-class RegistrationsTableDownload(RegistrationsTable):
-    """ Download a spreadsheet of registered registrations  """
+class ExportDownload(EventRegistrationInfoBase):
+    """
+    Download a spreadsheet export of the event, or show its status while it is being generated.
 
-    def get_resource(self):
-        resource = super().get_resource()
-        # XXX: This is a bit of a hack, but import_export does not offer enough context to widgets to distinguish
-        # between viewing and exporting data...
-        resource.fields['price'].widget = import_export.widgets.DecimalWidget()
-        resource.fields['paid'].widget = import_export.widgets.DecimalWidget()
-        return resource
+    Exports are generated by an ExportJob, keyed on the current data, so unchanged data is served from the stored file.
+    When exports are queued (see settings.EVENT_EXPORT_QUEUE), this page refreshes itself until the file is ready.
+    """
 
-    def get(self, *args, **kwargs):
-        # TODO: Switch back to ODS once this is fixed: https://github.com/jazzband/tablib/issues/527
-        file_format = import_export.formats.base_formats.XLSX()
-        export_data = file_format.export_data(self.data)
-        response = HttpResponse(export_data, content_type=file_format.get_content_type())
-        response['Content-Disposition'] = 'attachment; filename="{}-{}.{}"'.format(
-            self.event.name, datetime.now().strftime('%Y-%m-%d'), file_format.get_extension(),
-        )
+    template_name = 'events/export_processing.html'
+    kind = None
+
+    def get(self, request, *args, **kwargs):
+        if 'retry' in request.GET:
+            EventExportService.request_export(self.event, self.kind, retry=True)
+            return redirect(request.path)
+
+        export_job = EventExportService.request_export(self.event, self.kind)
+        if export_job.processed_at is None and not settings.EVENT_EXPORT_QUEUE:
+            EventExportService.process_export(export_job)
+
+        if export_job.ready:
+            # TODO: Switch back to ODS once this is fixed: https://github.com/jazzband/tablib/issues/527
+            filename = '{}-{}.xlsx'.format(self.event.name, timezone.localtime(export_job.processed_at).date())
+            return FileResponse(
+                export_job.file.open('rb'), as_attachment=True, filename=filename,
+                content_type=import_export.formats.base_formats.XLSX().get_content_type(),
+            )
+
+        response = render(request, self.template_name, {
+            'event': self.event,
+            'export_job': export_job,
+            'refresh_interval': settings.EVENT_EXPORT_POLL_INTERVAL,
+            'queue_position': ExportJob.objects.queued().filter(requested_at__lt=export_job.requested_at).count(),
+        })
+        # Never cache this page, it should be reloaded until processing is done
+        response['Cache-Control'] = 'no-store'
         return response
 
 
+class RegistrationsTableDownload(ExportDownload):
+    """ Download a spreadsheet of registered registrations  """
+
+    kind = ExportJob.kinds.REGISTRATIONS
+
+
 class PaymentsTable(EventRegistrationInfoBase):
     """ Show a table of payments """
 
@@ -309,12 +294,16 @@ class PaymentsTable(EventRegistrationInfoBase):
     def get_resource(self):
         return EventPaymentsResource(self.event)
 
+    @cached_property
+    def resource(self):
+        return self.get_resource()
+
+    def get_payments_queryset(self):
+        return self.resource.get_queryset().order_by('timestamp')
+
     @cached_property
     def data(self):
-        resource = self.get_resource()
-        return resource.export(
-            resource.get_queryset()
-            .order_by('timestamp'))
+        return self.resource.export(self.get_payments_queryset())
 
     def get_context_data(self, **kwargs):
         kwargs['data'] = self.data
@@ -323,88 +312,43 @@ class PaymentsTable(EventRegistrationInfoBase):
         return super().get_context_data(**kwargs)
 
 
-class PaymentsTableDownload(PaymentsTable):
+class PaymentsTableDownload(ExportDownload):
     """ Download a spreadsheet of payments """
 
-    def get_resource(self):
-        resource = super().get_resource()
-        # XXX: This is a bit of a hack, but import_export does not offer enough context to widgets to distinguish
-        # between viewing and exporting data...
-        resource.fields['amount'].widget = import_export.widgets.DecimalWidget()
-        return resource
+    kind = ExportJob.kinds.PAYMENTS
 
-    def get(self, *args, **kwargs):
-        # TODO: Switch back to ODS once this is fixed: https://github.com/jazzband/tablib/issues/527
-        file_format = import_export.formats.base_formats.XLSX()
-        export_data = file_format.export_data(self.data)
-        response = HttpResponse(export_data, content_type=file_format.get_content_type())
-        response['Content-Disposition'] = 'attachment; filename="{}-{}.{}"'.format(
-            self.event.name, datetime.now().strftime('%Y-%m-%d'), file_format.get_extension(),
-        )
-        return response
 
+class EventRegistrationsHistory(KeysetPaginationMixin, EventRegistrationInfoBase):
+    """
+    History about changes to registrations for a given event.
 
-class EventRegistrationsHistory(EventRegistrationInfoBase):
-    """ History about changes to registrations for a given event. """
+    This uses the EventRevision index rather than looking at the versions of all revisions, and pages through it using
+    keyset pagination, so later pages are as fast as the first.
+    """
 
     template_name = 'events/event_registrations_history.html'
     paginate_by = 25
+    keyset_ordering = ('-date_created', '-revision')
 
     def get_queryset(self):
-        # This replaces the event queryset from our super with a revision queryset, but ListView does not seem to care
-        registrations = super().get_queryset()
-        users = ArtaUser.objects.filter(registrations__in=registrations)
-
-        # This gets all revisions that are associated with the current event (via registration or user), and then
-        # annotates them with the name of the user for which the edit was done (by looking up the user included in ther
-        # revision directly, or through the registration included in the revision).
-        revisions = Revision.objects.filter(
-            Q(
-                version__content_type=ContentType.objects.get_for_model(Registration),
-                version__object_id__in=registrations,
-            ) | Q(
-                version__content_type=ContentType.objects.get_for_model(ArtaUser),
-                version__object_id__in=users,
-            ),
-        ).distinct().annotate(
-            # This quite a horrible stack of subqueries that is hopefully more performant than a ton of separate
-            # queries that seems to have been the alternative...
-            # TODO: Maybe GenericRelation could help, but that seems to insist deleting the referencing object
-            # (Version) when the referenced object (user, registration) is deleted, which is not what we want.
-            registrations=Subquery(
-                ArtaUser.objects.filter(
-                    # This uses a nested subquery to ensure each user is returned only once (since distinct() does not
-                    # seem to work together with the GroupConcat aggregation)
-                    pk__in=Subquery(
-                        ArtaUser.objects.filter(
-                            # This needs nested subqueries because there is no direct relation between Version and
-                            # ArtaUser/Registration.
-                            Q(pk__in=Subquery(
-                                Version.objects.filter(
-                                    revision=OuterRef(OuterRef(OuterRef('id'))),
-                                    content_type=ContentType.objects.get_for_model(ArtaUser),
-                                ).values('object_id'),
-                            )) | Q(
-                                registrations__in=Subquery(
-                                    # TODO: filter event?
-                                    Version.objects.filter(
-                                        revision=OuterRef(OuterRef(OuterRef('id'))),
-                                        content_type=ContentType.objects.get_for_model(Registration),
-                                    ).values('object_id'),
-                                ), registrations__event=self.event,
-                            ),
-                        ).values('id'),
-                    ))
-                .with_full_name()
-                # This applies the trick documented to group *all* of the results of this subquery and return the names
-                # concatenated, so this always returns a single result that can be annotated. See:
-                # https://docs.djangoproject.com/en/4.1/ref/models/expressions/#using-aggregates-within-a-subquery-expression
-                .order_by()
-                .annotate(dummy=Value(0))
-                .values('dummy')
-                .annotate(concat_names=GroupConcat(Value('\n'), F('full_name')))
-                .values("concat_names"),
-            ),
-        ).order_by('-date_created').select_related('user')
-
-        return revisions
+        # This replaces the event queryset from our super with revisions from the index, grouped by revision to get the
+        # names of all users for each revision. ListView does not seem to care.
+        return (
+            EventRevision.objects
+            .filter(
+                event=self.event,
+                user__registrations__event=self.event, user__registrations__status=Registration.statuses.REGISTERED,
+            )
+            .order_by()
+            .values('revision', 'date_created')
+            .annotate(names=GroupConcat(Value('\n'), F('name')))
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, rows, is_paginated = super().paginate_queryset(queryset, page_size)
+        # Replace the index rows with the actual revisions
+        revisions = Revision.objects.select_related('user').in_bulk([row['revision'] for row in rows])
+        for row in rows:
+            revisions[row['revision']].registrations = row['names']
+        page.object_list = [revisions[row['revision']] for row in rows]
+        return (paginator, page, page.object_list, is_paginated)
@@ -7,7 +7,7 @@ from django.forms.fields import DateTimeField
 from reversion.admin import VersionAdmin
 
 from apps.registrations.models import Registration
-from arta.common.admin import MonetaryResourceWidget
+from arta.common.admin import LargeTableAdminMixin, MonetaryResourceWidget
 
 from .models import Payment
 
@@ -77,7 +77,7 @@ class PaymentAdminMixin:
 
 
 @admin.register(Payment)
-class PaymentAdmin(PaymentAdminMixin, VersionAdmin):
+class PaymentAdmin(LargeTableAdminMixin, PaymentAdminMixin, VersionAdmin):
     list_display = ('registration', 'created_at', 'timestamp', 'type', 'amount', 'status', 'mollie_status')
 
     def get_readonly_fields(self, request, obj=None):
@@ -94,8 +94,7 @@ class PaymentAdmin(PaymentAdminMixin, VersionAdmin):
 
     def get_queryset(self, *args, **kwargs):
         qs = super().get_queryset(*args, **kwargs)
-        qs.select_related('registration', 'registration__user', 'registration__event')
-        return qs
+        return qs.select_related('registration', 'registration__user', 'registration__event')
 
     def get_changeform_initial_data(self, request):
         initial = super().get_changeform_initial_data(request)
@@ -1,6 +1,5 @@
-import reversion
 from django.contrib import admin, messages
-from django.db import transaction
+from django.core.exceptions import ValidationError
 from django.db.models.functions import Concat
 from django.http import HttpResponse
 from django.shortcuts import redirect
@@ -15,10 +14,12 @@ from reversion.admin import VersionAdmin
 from apps.events.models import Event
 from apps.payments.admin import AddPaymentInline, PaymentInline
 from apps.people.models import ArtaUser
-from arta.common.admin import LimitForeignKeyOptionsMixin
+from arta.common.admin import LargeTableAdminMixin, LimitForeignKeyOptionsMixin
 
-from .models import (Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue,
+from .models import (FinalizeRequest, Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue,
                      RegistrationPriceCorrection)
+from .schema import EventSchema
+from .services import RegistrationStatusService, UsedSlotsService, WaitinglistService
 
 
 class LimitDependsMixin(LimitForeignKeyOptionsMixin):
@@ -30,6 +31,61 @@ class LimitDependsMixin(LimitForeignKeyOptionsMixin):
         return super().get_foreignkey_limits(fieldname)
 
 
+class RecountUsedSlotsMixin:
+    """
+    Mixin that recounts the used slots of the affected event after changes through the admin.
+
+    Changes made in the admin bypass the services that normally maintain the used_slots counters, but are rare enough
+    that just recounting everything for the event is acceptable. Since these changes can also free up slots (e.g.
+    cancelling a registration or increasing slots), this also promotes registrations from the waiting list when
+    enabled for the event.
+    """
+
+    def get_used_slots_event(self, obj):
+        return obj.event
+
+    def slots_changed(self, request, event):
+        UsedSlotsService.recount(event)
+        WaitinglistService.slots_freed(event, user=request.user)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        self.slots_changed(request, self.get_used_slots_event(form.instance))
+
+    def delete_model(self, request, obj):
+        event = self.get_used_slots_event(obj)
+        super().delete_model(request, obj)
+        self.slots_changed(request, event)
+
+    def delete_queryset(self, request, queryset):
+        events = {self.get_used_slots_event(obj) for obj in queryset}
+        super().delete_queryset(request, queryset)
+        for event in events:
+            self.slots_changed(request, event)
+
+
+def dependency_cycle_message(event):
+    """ Returns a warning about fields in the given event with cyclic dependencies, or None if there are none. """
+    fields = EventSchema.for_event(event).dependency_cycle_fields
+    if not fields:
+        return None
+    return "The following fields (or their options) have circular dependencies and will never be shown: {}".format(
+        ", ".join(f.name for f in fields))
+
+
+class CheckDependenciesMixin:
+    """ Mixin that warns about circular dependencies in the affected event after changes through the admin. """
+
+    def get_dependencies_event(self, obj):
+        return obj.event
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        message = dependency_cycle_message(self.get_dependencies_event(form.instance))
+        if message:
+            self.message_user(request, message, messages.WARNING)
+
+
 class RegistrationFieldInline(LimitDependsMixin, admin.TabularInline):
     model = RegistrationField
     extra = 0
@@ -168,33 +224,23 @@ def registration_field_list_filter(field):
     return RegistrationFieldListFilter
 
 
-# TODO: This should probably use a intermediate view to ask the target status, do additional limitation on acceptable
-# status changes and do additional actions, such as updating the "full" statuses (and probably delegate the status
-# changes to a service).
 def change_status_action(old, new):
     """ Helper to generate status change actions """
     def action(modeladmin, request, queryset):
-        with transaction.atomic():
-            if queryset.exclude(status=old).exists():
-                modeladmin.message_user(
-                    request,
-                    'Not all selected registrations in {} state'.format(old.id),
-                    messages.ERROR,
-                )
-            else:
-                with reversion.create_revision():
-                    reversion.set_user(request.user)
-                    reversion.set_comment(_("Updated registration status to {} via admin.".format(new.id)))
-                    for reg in queryset:
-                        reg.status = new
-                        reg.save()
+        try:
+            RegistrationStatusService.change_statuses(
+                queryset, old, new, user=request.user,
+                comment=_("Updated registration status to {} via admin.").format(new.id),
+            )
+        except ValidationError as e:
+            modeladmin.message_user(request, "\n".join(e.messages), messages.ERROR)
     action.short_description = 'Change {} registration to {}'.format(old.id, new.id)
     action.__name__ = '{}_to_{}'.format(old.id, new.id)
     return action
 
 
 @admin.register(Registration)
-class RegistrationAdmin(HijackRelatedAdminMixin, VersionAdmin):
+class RegistrationAdmin(LargeTableAdminMixin, RecountUsedSlotsMixin, HijackRelatedAdminMixin, VersionAdmin):
     list_display = (
         'event_display_name', 'user_name', 'status', 'registered_at_milliseconds', 'selected_options', 'price',
         'payment_status', 'hijack_field',
@@ -221,10 +267,7 @@ class RegistrationAdmin(HijackRelatedAdminMixin, VersionAdmin):
     actions = [
         'make_mailing_list',
         'add_users_to_group',
-        change_status_action(Registration.statuses.PENDING, Registration.statuses.REGISTERED),
-        change_status_action(Registration.statuses.PENDING, Registration.statuses.CANCELLED),
-        change_status_action(Registration.statuses.PENDING, Registration.statuses.WAITINGLIST),
-        change_status_action(Registration.statuses.WAITINGLIST, Registration.statuses.CANCELLED),
+        *(change_status_action(old, new) for (old, new) in RegistrationStatusService.BULK_STATUS_CHANGES),
     ]
 
     def get_queryset(self, *args, **kwargs):
@@ -301,24 +344,34 @@ class RegistrationAdmin(HijackRelatedAdminMixin, VersionAdmin):
 class RegistrationFieldOptionInline(LimitDependsMixin, admin.TabularInline):
     model = RegistrationFieldOption
     extra = 0
+    readonly_fields = ('used_slots',)
 
 
 @admin.register(RegistrationField)
-class RegistratFieldAdmin(LimitDependsMixin, VersionAdmin):
+class RegistratFieldAdmin(CheckDependenciesMixin, RecountUsedSlotsMixin, LimitDependsMixin, VersionAdmin):
     inlines = [RegistrationFieldOptionInline]
     prepopulated_fields = {"name": ("title",)}
 
 
 @admin.register(RegistrationFieldOption)
-class RegistratFieldOptionAdmin(LimitDependsMixin, VersionAdmin):
-    pass
+class RegistratFieldOptionAdmin(CheckDependenciesMixin, RecountUsedSlotsMixin, LimitDependsMixin, VersionAdmin):
+    readonly_fields = ('used_slots',)
+
+    def get_used_slots_event(self, obj):
+        return obj.field.event
+
+    def get_dependencies_event(self, obj):
+        return obj.field.event
 
 
 @admin.register(RegistrationFieldValue)
-class RegistratFieldValueAdmin(LimitForeignKeyOptionsMixin, VersionAdmin):
+class RegistratFieldValueAdmin(RecountUsedSlotsMixin, LimitForeignKeyOptionsMixin, VersionAdmin):
     fields = ('registration', 'field', 'option', 'string_value', 'file_value', 'active')
     # TODO: Instead of changing values directly, maybe old values should be made inactive and replaced by new values?
 
+    def get_used_slots_event(self, obj):
+        return obj.registration.event
+
     def get_foreignkey_limits(self, fieldname):
         if fieldname == 'field':
             return ('event', {RegistrationFieldValue: 'registration__event'})
@@ -331,3 +384,11 @@ class RegistratFieldValueAdmin(LimitForeignKeyOptionsMixin, VersionAdmin):
             return ['field', 'registration', 'active']
         else:
             return ['active']
+
+
+@admin.register(FinalizeRequest)
+class FinalizeRequestAdmin(admin.ModelAdmin):
+    list_display = ('registration', 'requested_at', 'processed_at', 'error')
+    list_filter = ('registration__event',)
+    list_select_related = ('registration__user', 'registration__event')
+    readonly_fields = ('registration', 'requested_at', 'processed_at', 'error', 'base_url')
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.core import checks
+
+from arta.common.versions import check_shared_cache
 
 
 class RegistrationsConfig(AppConfig):
     name = 'apps.registrations'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals  # noqa: F401
+
+        # The signal handlers (and the views) use version counters, which need a shared cache in production
+        checks.register(check_shared_cache, checks.Tags.caches, deploy=True)
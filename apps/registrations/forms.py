@@ -1,6 +1,6 @@
 from django import forms
 from django.db import transaction
-from django.db.models import Prefetch, Q
+from django.db.models import Prefetch
 from django.forms.formsets import DELETION_FIELD_NAME
 from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
@@ -9,7 +9,11 @@ from django.utils.translation import gettext as _
 from apps.core.models import ConsentLog
 from apps.core.templatetags.coretags import moneyformat
 from apps.people.models import Address, ArtaUser, EmergencyContact, MedicalDetails
-from apps.registrations.models import RegistrationField, RegistrationFieldOption, RegistrationFieldValue
+from apps.registrations import versions
+from apps.registrations.models import Registration, RegistrationFieldOption, RegistrationFieldValue
+from apps.registrations.schema import EventSchema
+from apps.registrations.services import UsedSlotsService
+from arta.common.revisions import bulk_create_revision
 
 # from apps.events.models import EventOptions
 
@@ -237,6 +241,8 @@ class RegistrationOptionsForm(forms.Form):
         self.event = event
         self.user = user
         self.registration = registration
+        self.schema = EventSchema.for_event(event)
+        self.group_ids = set(user.groups.values_list('pk', flat=True))
         self.add_fields()
 
     def values_for_registration(self, registration):
@@ -269,18 +275,9 @@ class RegistrationOptionsForm(forms.Form):
 
     def add_fields(self):
         """ Add form fields based on the RegistrationFields in the database. """
-        fields = self.event.registration_fields.filter(Q(invite_only=None) | Q(invite_only__user=self.user))
-        # For each field, also prefetch
-        fields = fields.prefetch_related(Prefetch(
-            'options',
-            queryset=RegistrationFieldOption.objects.filter(Q(invite_only=None) | Q(invite_only__user=self.user)),
-            to_attr='available_options',
-        ))
-
-        fields = fields.select_related('depends__field')
         self._sections = []
 
-        for field in fields:
+        for field in self.schema.fields_for(self.group_ids):
             kwargs = {
                 'help_text': field.help_text,
                 'label': conditional_escape(field.title),
@@ -309,10 +306,8 @@ class RegistrationOptionsForm(forms.Form):
                         continue
 
             if field.field_type.CHOICE:
-                # TODO: This wraps the prefetched list into something that looks enough like a queryset to satisfy
-                # ModelChoiceField. It would be better if a prefetch with to_attr would produce a queryset (with
-                # prefetched results) rather than a list, but should be reported as a feature request for Django (as
-                # suggested here: https://code.djangoproject.com/ticket/26676#comment:1)
+                # This wraps the list of options from the schema into something that looks enough like a queryset to
+                # satisfy ModelChoiceField.
                 class FakeQueryset(list):
                     def __init__(self, values, model):
                         super().__init__(values)
@@ -328,7 +323,7 @@ class RegistrationOptionsForm(forms.Form):
                                 return v
                         raise self.model.DoesNotExist()
 
-                options = FakeQueryset(field.available_options, RegistrationFieldOption)
+                options = FakeQueryset(self.schema.options_for(field, self.group_ids), RegistrationFieldOption)
 
                 empty_label = None if has_initial else _('Select one...')
                 form_field = RegistrationOptionField(queryset=options, empty_label=empty_label, **kwargs)
@@ -369,22 +364,30 @@ class RegistrationOptionsForm(forms.Form):
         msg = field.error_messages[code]
         self.add_error(field_name, forms.ValidationError(msg, code=code, params=kwargs))
 
-    def depends_satisfied(self, d, depends):
-        if depends is None:
-            return True
-        return self.depends_satisfied(d, depends.field.depends) and d.get(depends.field.name, None) == depends
+    def value_fields(self):
+        """ Returns the fields (excluding sections) available to the user. """
+        return [f for f in self.schema.fields_for(self.group_ids) if not f.field_type.SECTION]
+
+    def dependencies(self):
+        """ Evaluates the dependencies of all fields and options for the cleaned data (see EventSchema). """
+        d = self.cleaned_data
+        selected = {
+            field.pk: d[field.name].pk
+            for field in self.value_fields()
+            if field.field_type.CHOICE and d.get(field.name, None) is not None
+        }
+        return self.schema.dependencies(selected)
 
     def clean(self):
         # Most validation is implicit based on the generated form (e.g. based on required, choices, etc.)
         super().clean()
         d = self.cleaned_data
+        dependencies = self.dependencies()
 
-        fields = self.event.registration_fields.filter(Q(invite_only=None) | Q(invite_only__user=self.user))
-        fields = fields.exclude(field_type=RegistrationField.types.SECTION)
-        for field in fields:
+        for field in self.value_fields():
             # If the dependencies for this option are not satisfied, ignore it and remove any previous (e.g.
             # 'required') errors generated for it.
-            if not self.depends_satisfied(d, field.depends):
+            if not dependencies.satisfied(field):
                 self.errors.pop(field.name, None)
                 continue
 
@@ -392,18 +395,25 @@ class RegistrationOptionsForm(forms.Form):
                 # For CHOICE fields, also check depends on the selected option. A missing value here means validation
                 # already failed in our super, so we can ignore those fields
                 option = d.get(field.name, None)
-                if option and not self.depends_satisfied(d, option.depends):
+                if option and not dependencies.satisfied(option):
                     self.add_error_by_code(field.name, 'invalid_choice', value=option.title)
 
-    def save(self, registration):
-        d = self.cleaned_data
+    def save(self, registration, user=None, comment=''):
+        """
+        Saves the changed values for the given registration, along with a revision for the given user and comment.
+
+        This first compares the form against the current values of the registration, and then applies all changes with
+        a few bulk queries. Since these bypass the signals used by reversion, the revision is created here as well.
+        """
+        dependencies = self.dependencies()
 
-        fields = self.event.registration_fields.filter(Q(invite_only=None) | Q(invite_only__user=self.user))
-        fields = fields.exclude(field_type=RegistrationField.types.SECTION)
+        # Existing values that are replaced or no longer apply, and new values to create
+        replaced_values = []
+        new_values = []
 
-        for field in fields:
+        for field in self.value_fields():
             value = registration.active_options_by_name.get(field.name, None)
-            depends_satisfied = self.depends_satisfied(d, field.depends)
+            depends_satisfied = dependencies.satisfied(field)
 
             # Skip fields whose value was not changed (relative to the db, not relative to the form defaults)
             if value and depends_satisfied and field.name not in self.changed_data:
@@ -413,35 +423,58 @@ class RegistrationOptionsForm(forms.Form):
             if self.is_change and not field.allow_change:
                 continue
 
-            # For active registrations, keep history by marking the current value inactive (a new value will be created
-            # below, then). For draft, the existing value will just be reused.
-            if value and not registration.status.DRAFT:
-                value.active = None
-                value.save()
-                value = None
-
-            # If the dependencies for this option are not satisfied, delete any values for it that might be present
-            # (only for draft, no need to keep history there)
-            if not depends_satisfied:
-                if value and registration.status.DRAFT:
-                    value.delete()
-                continue
+            if value:
+                replaced_values.append(value)
 
-            if value is None:
-                value = RegistrationFieldValue(registration=registration, field=field, active=True)
+            # If the dependencies for this option are not satisfied, just remove any existing value
+            if depends_satisfied:
+                new_values.append(self.make_value(registration, field))
 
-            if field.field_type.CHOICE:
-                value.option = d[field.name]
-            elif field.field_type.IMAGE:
-                if d[field.name]:
-                    value.file_value = d[field.name]
+        if not replaced_values and not new_values:
+            return
+
+        with transaction.atomic():
+            if replaced_values:
+                replaced = RegistrationFieldValue.objects.filter(pk__in=[v.pk for v in replaced_values])
+                if registration.status.DRAFT:
+                    # No need to keep history for drafts
+                    replaced.delete()
                 else:
-                    value.file_value = ""
-            elif field.field_type.CHECKBOX or field.field_type.UNCHECKBOX:
-                value.string_value = RegistrationFieldValue.CHECKBOX_VALUES[d[field.name]]
+                    # For active registrations, keep history by marking the current values inactive
+                    replaced.update(active=None)
+            RegistrationFieldValue.objects.bulk_create(new_values)
+            versions.registrations_changed([registration])
+
+            # Update the used slots for changed options
+            if not registration.status.DRAFT:
+                UsedSlotsService.registration_options_changed(
+                    registration,
+                    [v.option_id for v in replaced_values if v.option_id is not None],
+                    [v.option_id for v in new_values if v.option_id is not None],
+                )
+
+            # Like reversion would do when following relations, store the registration and all its values
+            saved = Registration.objects.select_related('user', 'event').prefetch_related(Prefetch(
+                'options', queryset=RegistrationFieldValue.objects.select_related('field', 'option'),
+            )).get(pk=registration.pk)
+            bulk_create_revision([saved, *saved.options.all()], user=user, comment=comment)
+
+    def make_value(self, registration, field):
+        """ Returns a new (unsaved) value for the given field based on the cleaned data. """
+        d = self.cleaned_data
+        value = RegistrationFieldValue(registration=registration, field=field, active=True)
+        if field.field_type.CHOICE:
+            value.option = d[field.name]
+        elif field.field_type.IMAGE:
+            if d[field.name]:
+                value.file_value = d[field.name]
             else:
-                value.string_value = d[field.name]
-            value.save()
+                value.file_value = ""
+        elif field.field_type.CHECKBOX or field.field_type.UNCHECKBOX:
+            value.string_value = RegistrationFieldValue.CHECKBOX_VALUES[d[field.name]]
+        else:
+            value.string_value = d[field.name]
+        return value
 
 
 class PaymentForm(forms.Form):
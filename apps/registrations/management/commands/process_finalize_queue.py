@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from apps.events.models import Event
+from apps.registrations.services import RegistrationStatusService
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Finalize queued registrations for an event, in order of arrival. Only run one of these per event at the same '
+        'time. Runs until interrupted, unless --once is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int)
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument(
+            '--batch-size', type=int, default=50, help='Maximum number of registrations to finalize at once',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0.2, help='Seconds to wait before checking an empty queue again',
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            event = Event.objects.get(pk=kwargs['event_id'])
+        except Event.DoesNotExist:
+            raise CommandError("Event {} does not exist".format(kwargs['event_id']))
+
+        while True:
+            try:
+                processed = RegistrationStatusService.process_finalize_queue(event, kwargs['batch_size'])
+            except Exception:
+                # Do not stop processing the queue on unexpected (e.g. database) errors, the failed batch is left
+                # unprocessed (finalizing is atomic), so it is retried after the interval.
+                logger.exception("Failed to process finalize queue for event %s", event.pk)
+                if kwargs['once']:
+                    raise
+                time.sleep(kwargs['interval'])
+                continue
+            if processed and kwargs['verbosity'] > 1:
+                self.stdout.write("Processed {} registrations\n".format(processed))
+            if not processed:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
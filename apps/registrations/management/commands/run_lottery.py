@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand, CommandError
+
+from apps.events.models import Event
+from apps.registrations.services import LotteryService
+
+
+class Command(BaseCommand):
+    help = 'Admit the pending registrations for an event in random order (while slots are available)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int)
+        parser.add_argument('--seed', type=int, help='Seed for the random order, to reproduce an earlier lottery')
+
+    def handle(self, *args, **kwargs):
+        try:
+            event = Event.objects.get(pk=kwargs['event_id'])
+        except Event.DoesNotExist:
+            raise CommandError("Event {} does not exist".format(kwargs['event_id']))
+
+        result = LotteryService.draw(event, seed=kwargs['seed'])
+        self.stdout.write("Lottery for {} with seed {}: {} registered, {} on waiting list\n".format(
+            event, result.seed, result.registered, result.waitinglist,
+        ))
@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand, CommandError
+
+from apps.events.models import Event
+from apps.registrations.services import UsedSlotsService
+
+
+class Command(BaseCommand):
+    help = 'Recount the used slots of events and their options, fixing any counters that are wrong'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int, nargs='*', help='Events to recount (default: all events)')
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report wrong counters, do not fix them (exits with an error when any are found)',
+        )
+
+    def handle(self, *args, **kwargs):
+        events = Event.objects.all()
+        if kwargs['event_id']:
+            events = events.filter(pk__in=kwargs['event_id'])
+
+        fix = not kwargs['check']
+        num_wrong = 0
+        for event in events:
+            for (obj, used_slots, counted) in UsedSlotsService.recount(event, fix=fix):
+                num_wrong += 1
+                self.stdout.write("{}: {} ({}): used_slots is {}, counted {}{}\n".format(
+                    event, obj, obj._meta.verbose_name, used_slots, counted, ", fixed" if fix else "",
+                ))
+
+        if num_wrong and not fix:
+            raise CommandError("Found {} wrong used_slots counters".format(num_wrong))
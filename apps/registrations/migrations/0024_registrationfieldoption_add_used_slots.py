@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+# Registration.statuses.REGISTERED
+REGISTERED = 2
+
+def count_used_slots(apps, schema_editor):
+    RegistrationFieldOption = apps.get_model("registrations", "registrationfieldoption")
+    counted = RegistrationFieldOption.objects.annotate(
+        used_slots_count=models.Count(
+            'registrationfieldvalue',
+            filter=models.Q(
+                registrationfieldvalue__registration__status=REGISTERED,
+                registrationfieldvalue__active=True,
+            ),
+        ),
+    ).exclude(used_slots_count=0)
+    for option in counted:
+        RegistrationFieldOption.objects.filter(pk=option.pk).update(used_slots=option.used_slots_count)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0023_registrationfield_is_kitchen_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrationfieldoption',
+            name='used_slots',
+            field=models.IntegerField(default=0, editable=False, help_text='Number of REGISTERED registrations that selected this option. Maintained automatically.'),
+        ),
+        migrations.RunPython(count_used_slots, reverse_code=migrations.RunPython.noop),
+    ]
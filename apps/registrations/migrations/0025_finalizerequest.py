@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-17 03:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0024_registrationfieldoption_add_used_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinalizeRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(verbose_name='Request timestamp')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Processing timestamp')),
+                ('error', models.TextField(blank=True, help_text='Reason the registration could not be finalized, if any')),
+                ('base_url', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Creation timestamp')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Last update timestamp')),
+                ('registration', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='finalize_request', to='registrations.Registration')),
+            ],
+            options={
+                'verbose_name': 'finalize request',
+                'verbose_name_plural': 'finalize requests',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='finalizerequest',
+            index=models.Index(fields=['processed_at', 'requested_at'], name='idx_processed_requested'),
+        ),
+    ]
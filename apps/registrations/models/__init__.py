@@ -1,8 +1,9 @@
+from .finalize_request import FinalizeRequest
 from .registration import Registration
 from .registration_field import RegistrationField
 from .registration_field_option import RegistrationFieldOption
 from .registration_field_value import RegistrationFieldValue
 from .registration_price_correction import RegistrationPriceCorrection
 
-__all__ = ['Registration', 'RegistrationField', 'RegistrationFieldOption', 'RegistrationFieldValue',
+__all__ = ['FinalizeRequest', 'Registration', 'RegistrationField', 'RegistrationFieldOption', 'RegistrationFieldValue',
            'RegistrationPriceCorrection']
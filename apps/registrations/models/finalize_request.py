@@ -0,0 +1,51 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from arta.common.db import UpdatedAtQuerySetMixin
+
+
+class FinalizeRequestQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
+    def queued_for(self, event):
+        """ Returns the unprocessed requests for the given event, in order of arrival. """
+        return self.filter(
+            registration__event=event,
+            processed_at=None,
+        ).order_by('requested_at', 'pk')
+
+
+class FinalizeRequestManager(models.Manager.from_queryset(FinalizeRequestQuerySet)):
+    pass
+
+
+class FinalizeRequest(models.Model):
+    """
+    A queued request to finalize a registration.
+
+    When finalization is queued (see settings.REGISTRATION_FINALIZE_QUEUE), the final check only records one of these
+    and the actual finalization happens later by the process_finalize_queue command, processing requests in order.
+    """
+
+    registration = models.OneToOneField('registrations.Registration', related_name='finalize_request',
+                                        on_delete=models.CASCADE)
+    requested_at = models.DateTimeField(verbose_name=_('Request timestamp'))
+    processed_at = models.DateTimeField(verbose_name=_('Processing timestamp'), null=True, blank=True)
+    error = models.TextField(blank=True, help_text=_('Reason the registration could not be finalized, if any'))
+    # The confirmation e-mail is sent outside of a request, so this is used to build absolute urls
+    base_url = models.CharField(max_length=255)
+
+    created_at = models.DateTimeField(verbose_name=_('Creation timestamp'), auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name=_('Last update timestamp'), auto_now=True)
+
+    objects = FinalizeRequestManager()
+
+    def __str__(self):
+        return "{} ({})".format(self.registration, self.requested_at)
+
+    class Meta:
+        verbose_name = _('finalize request')
+        verbose_name_plural = _('finalize requests')
+
+        indexes = [
+            # Index to speed up queued_for lookups
+            models.Index(fields=['processed_at', 'requested_at'], name='idx_processed_requested'),
+        ]
@@ -1,8 +1,8 @@
 import reversion
 from django.conf import settings
-from django.db import models
-from django.db.models import ExpressionWrapper, F, OuterRef, Prefetch, Q, Value, When
-from django.db.models.functions import Coalesce
+from django.db import connections, models
+from django.db.models import Count, ExpressionWrapper, F, OuterRef, Prefetch, Q, Subquery, Value, When, Window
+from django.db.models.functions import Coalesce, Rank
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from konst import Constant, ConstantGroup, Constants
@@ -107,11 +107,58 @@ class RegistrationQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
             has_conflicting_registrations=ExpressionWrapper(Value(False), output_field=models.BooleanField()),
         )
 
+    def with_waitinglist_position(self, window=False):
+        """
+        Adds waitinglist_position annotation.
+
+        For WAITINGLIST registrations, this is the number of WAITINGLIST registrations for the same event that were
+        registered earlier (i.e. the same as waitinglist_above). For other registrations, it is None.
+
+        By default, this uses a subquery for each row. When window is True, this uses a window function instead,
+        which is a lot more efficient for large lists, but only looks at the rows in this queryset. So this is only
+        correct when the queryset includes the complete waiting list of the events involved (i.e. filtering on event
+        and status is fine, but anything else is not). When the database does not support window functions, this
+        falls back to the subquery.
+        """
+        if window and connections[self.db].features.supports_over_clause:
+            position = Window(
+                expression=Rank(),
+                partition_by=[F('event_id'), F('status')],
+                order_by=F('registered_at').asc(),
+            ) - 1
+        else:
+            position = Subquery(
+                Registration.objects.filter(
+                    event=OuterRef('event'),
+                    status=Registration.statuses.WAITINGLIST,
+                    registered_at__lt=OuterRef('registered_at'),
+                ).order_by().values('event').annotate(count=Count('pk')).values('count'),
+                output_field=models.IntegerField(),
+            )
+            # Without any earlier registrations, the subquery returns no rows (and thus NULL)
+            position = Coalesce(position, 0)
+
+        return self.annotate(waitinglist_position=Case(
+            When(status=Registration.statuses.WAITINGLIST, then=position),
+            default=Value(None),
+            output_field=models.IntegerField(),
+        ))
+
     def conflicting_registrations_for(self, registration):
         """ Returns queryset of other registrations that would prevent finalizing the passed registration. """
         # Disabled until this can be made more configurable
         return self.none()
 
+    def conflicting_registrations_for_many(self, registrations):
+        """
+        Returns queryset of other registrations that would prevent finalizing any of the passed registrations.
+
+        This is conflicting_registrations_for in a single query, the conflicts for a particular registration are the
+        results with the same user.
+        """
+        # Disabled until this can be made more configurable
+        return self.none()
+
     def prefetch_active_options(self):
         from . import RegistrationFieldValue
 
@@ -121,6 +168,25 @@ class RegistrationQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
             to_attr='_active_options',
         ))
 
+    def prefetch_price_corrections(self):
+        """ Prefetches price corrections (with active annotation), see Registration.price_corrections_with_active. """
+        from . import RegistrationPriceCorrection
+
+        return self.prefetch_related(Prefetch(
+            'price_corrections',
+            queryset=RegistrationPriceCorrection.objects.with_active(),
+            to_attr='_price_corrections',
+        ))
+
+    def with_summary(self):
+        """ Adds the annotations and prefetches needed to show registrations in a list of (registered) events. """
+        return (
+            self.with_payment_status()
+            .with_waitinglist_position()
+            .prefetch_active_options()
+            .prefetch_price_corrections()
+        )
+
     def current_for(self, event, user):
         """
         Returns the current registration for the given event and user.
@@ -194,6 +260,9 @@ class Registration(models.Model):
 
     @cached_property
     def waitinglist_above(self):
+        if getattr(self, 'waitinglist_position', None) is not None:
+            # Annotated by with_waitinglist_position()
+            return self.waitinglist_position
         return Registration.objects.filter(
             event=self.event_id,
             status=Registration.statuses.WAITINGLIST,
@@ -221,7 +290,20 @@ class Registration(models.Model):
         """ Returns active_options, but processed by RegistrationFieldValue.group_by_section. """
         from . import RegistrationFieldValue
 
-        return RegistrationFieldValue.group_by_section(self.active_options)
+        # The schema can be prefetched using EventSchema.prefetch()
+        return RegistrationFieldValue.group_by_section(self.active_options, schema=getattr(self, '_schema', None))
+
+    @cached_property
+    def price_corrections_with_active(self):
+        """
+        Return a list of price corrections with the active annotation for this registration.
+
+        More efficient when prefetch_price_corrections() was called on the queryset.
+        """
+        if hasattr(self, '_price_corrections'):
+            # Prefetched
+            return self._price_corrections
+        return list(self.price_corrections.with_active())
 
     @cached_property
     def active_options_by_name(self):
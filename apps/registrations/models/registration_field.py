@@ -1,7 +1,6 @@
 import reversion
 from django.db import models
 from django.utils import timezone
-from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from konst import Constant, Constants
 from konst.models.fields import ConstantChoiceCharField
@@ -61,8 +60,9 @@ class RegistrationField(models.Model):
     def natural_key(self):
         return (self.event.name, self.name)
 
-    @cached_property
+    @property
     def allow_change(self):
+        # Not cached, since this depends on the current date and instances can be long-lived (see EventSchema)
         return self.allow_change_until and timezone.now().date() <= self.allow_change_until
 
     class Meta:
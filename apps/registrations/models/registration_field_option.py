@@ -4,15 +4,20 @@ from django.db.models import Count, Q
 from django.utils.translation import ugettext_lazy as _
 
 from apps.core.fields import MonetaryField
-from arta.common.db import UpdatedAtQuerySetMixin
+from arta.common.db import CounterFieldsModelMixin, UpdatedAtQuerySetMixin
 
 from . import Registration, RegistrationField
 
 
 class RegistrationFieldOptionQuerySet(UpdatedAtQuerySetMixin, models.QuerySet):
-    def with_used_slots(self):
+    def with_used_slots_count(self):
+        """
+        Adds used_slots_count annotation.
+
+        This counts the used slots from scratch, normally the (maintained) used_slots field should be used instead.
+        """
         return self.annotate(
-            used_slots=Count(
+            used_slots_count=Count(
                 'registrationfieldvalue',
                 filter=Q(
                     registrationfieldvalue__registration__status=Registration.statuses.REGISTERED,
@@ -29,7 +34,7 @@ class RegistrationFieldOptionManager(models.Manager.from_queryset(RegistrationFi
 
 
 @reversion.register(follow=('field',))
-class RegistrationFieldOption(models.Model):
+class RegistrationFieldOption(CounterFieldsModelMixin, models.Model):
     """ One of multiple options that can be assigned to a given field. """
 
     field = models.ForeignKey('registrations.RegistrationField', related_name='options', on_delete=models.CASCADE)
@@ -40,6 +45,9 @@ class RegistrationFieldOption(models.Model):
     invite_only = models.ForeignKey('auth.Group', null=True, blank=True, on_delete=models.SET_NULL)
     slots = models.IntegerField(null=True, blank=True)
     full = models.BooleanField(default=False)
+    used_slots = models.IntegerField(
+        default=0, editable=False,
+        help_text=_('Number of REGISTERED registrations that selected this option. Maintained automatically.'))
     price = MonetaryField(null=True, blank=True)
     admit_immediately = models.BooleanField(
         verbose_name=_('Admit registrations immediately'), default=False,
@@ -52,6 +60,8 @@ class RegistrationFieldOption(models.Model):
 
     objects = RegistrationFieldOptionManager()
 
+    counter_fields = ('used_slots',)
+
     def __str__(self):
         return self.title
 
@@ -118,11 +118,35 @@ class RegistrationFieldValue(models.Model):
     price.admin_order_field = 'option__price'
     price = property(price)
 
+    def check_satisfies_required(self):
+        """
+        Returns whether this value satisfies the requirements of its field.
+
+        This is the in-memory equivalent of the satisfies_required annotation (see with_satisfies_required) and
+        should be kept in sync with it.
+        """
+        field = self.field
+        if field.field_type.CHECKBOX or field.field_type.UNCHECKBOX:
+            # Checkbox is slightly different, it must be checked when required, or any (non-empty) value otherwise
+            return (
+                (not field.required and self.string_value == self.CHECKBOX_VALUES[False])
+                or self.string_value == self.CHECKBOX_VALUES[True]
+            )
+        elif field.field_type.CHOICE:
+            return not field.required or self.option_id is not None
+        elif field.field_type.IMAGE:
+            return not field.required or self.file_value.name != ""
+        elif field.field_type.STRING or field.field_type.TEXT or field.field_type.RATING5:
+            return not field.required or self.string_value != ""
+        return False
+
     @classmethod
-    def group_by_section(self, values):
+    def group_by_section(self, values, schema=None):
         """
         Group an iterable (or queryset) of active RegistrationFieldValue by the section of related field.
 
+        The EventSchema of the event can be passed if already known, otherwise it is looked up.
+
         This returns a list of (section, values) tuples, where section is a RegistrationField option, and values is a
         list of RegistrationFieldValue objects. The resulting values are ordered based on the field ordering, but only
         values in the iterable passed are returned (and empty sections are omitted).
@@ -135,11 +159,15 @@ class RegistrationFieldValue(models.Model):
         any_option = next(iter(our_options.values()))
         event_id = any_option.field.event_id
 
-        all_fields = RegistrationField.objects.all().filter(event=event_id)
+        from ..schema import EventSchema
+
         section = None
         fields = []
 
-        for field in all_fields:
+        if schema is None:
+            schema = EventSchema.for_event(event_id)
+
+        for field in schema.fields:
             if field.field_type.SECTION:
                 if fields:
                     yield (section, fields)
@@ -0,0 +1,217 @@
+"""
+Announcing registration opening (and other event changes) to clients waiting on the final check page.
+
+Rather than having all those clients refresh the final check page over and over, they subscribe to a stream of status
+updates for the event (using server-sent events), and only reload the page when the status changes. The status is
+based on cached data only (see versions.py), so it can be checked without any database queries.
+
+The stream can be served in two ways:
+ - By the OpeningStreamView (normal WSGI). This returns just the current status and tells the client when to
+   reconnect (i.e. at the moment registration opens or closes, or after REGISTRATION_OPENING_POLL_INTERVAL). Browsers
+   do this automatically for server-sent events.
+ - By OpeningStreamApp (ASGI, see arta/asgi.py). This keeps connections open, and uses a single task per event to
+   broadcast changes to all connected clients at once. Other requests are passed on to the normal Django views
+   (running in a pool of threads, see arta.common.asgi.ThreadedWSGIApp).
+"""
+import asyncio
+import collections
+import json
+import logging
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from arta.common.versions import get_versions
+
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+
+class OpeningStatus(collections.namedtuple('OpeningStatus', ['phase', 'changes_in', 'version'])):
+    """
+    Registration opening status of an event.
+
+    phase contains whether registration has opened (publicly, for invitees) and closed (see EventPhases.passed),
+    changes_in the number of seconds until the next of these moments (or None), and version the event version (which
+    changes when e.g. options become full).
+    """
+
+    @property
+    def opened(self):
+        """ Returns the part of the phase about opening (publicly, for invitees). """
+        return self.phase[:2]
+
+    @property
+    def key(self):
+        """ String that changes whenever the final check page for this event might change. """
+        return '{}-{}'.format(''.join(str(int(passed)) for passed in self.phase), self.version)
+
+    def as_dict(self):
+        return {'key': self.key, 'changes_in': self.changes_in}
+
+    def as_event(self):
+        """ Returns this status as a server-sent event message. """
+        return 'data: {}\n\n'.format(json.dumps(self.as_dict()))
+
+
+def opening_status(event_id, now=None):
+    """ Returns the OpeningStatus for the given event pk, without database queries (unless the cache is empty). """
+    if now is None:
+        now = timezone.now()
+    phases = versions.event_phases(event_id)
+    (version,) = get_versions([versions.event_version(event_id)])
+    return OpeningStatus(phases.passed(now), phases.seconds_until_change(now), version)
+
+
+class OpeningBroadcaster:
+    """
+    Broadcasts the opening status of events to subscribers (within a single process, using asyncio).
+
+    For each event with subscribers, a single task checks the status, sleeping until registration opens or closes or at
+    most poll_interval seconds (to also notice other changes, like options becoming full). Changes are then pushed to
+    all subscribers of the event at once.
+    """
+
+    def __init__(self, poll_interval=None, status_func=opening_status):
+        if poll_interval is None:
+            poll_interval = settings.REGISTRATION_OPENING_POLL_INTERVAL
+        self.poll_interval = poll_interval
+        self.status_func = status_func
+        # Queues per event pk, and the task watching and last status of each event
+        self.subscribers = collections.defaultdict(set)
+        self.tasks = {}
+        self.last_status = {}
+
+    def subscribe(self, event_id):
+        """ Returns a queue that receives the current status of the given event, and then every change. """
+        queue = asyncio.Queue()
+        self.subscribers[event_id].add(queue)
+        if event_id not in self.tasks:
+            self.tasks[event_id] = asyncio.ensure_future(self.watch(event_id))
+        elif event_id in self.last_status:
+            queue.put_nowait(self.last_status[event_id])
+        return queue
+
+    def unsubscribe(self, event_id, queue):
+        """ Stops sending changes to the given queue, stopping the task for the event when this was the last one. """
+        self.subscribers[event_id].discard(queue)
+        if not self.subscribers[event_id]:
+            del self.subscribers[event_id]
+            self.last_status.pop(event_id, None)
+            self.tasks.pop(event_id).cancel()
+
+    async def watch(self, event_id):
+        """
+        Task that checks the status of the given event, and pushes changes to its subscribers.
+
+        This keeps running until cancelled (by unsubscribe). When checking the status fails, the error is logged and
+        the status is checked again after poll_interval, since subscribers would otherwise never receive changes.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                # The status is (normally) only read from the cache, but that is still blocking
+                status = await loop.run_in_executor(None, self.status_func, event_id)
+            except asyncio.CancelledError:
+                # Before Python 3.8, this is an Exception as well
+                raise
+            except Exception:
+                logger.exception("Failed to check opening status for event %s", event_id)
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            last_status = self.last_status.get(event_id)
+            if last_status is None or status.key != last_status.key:
+                self.last_status[event_id] = status
+                for queue in self.subscribers[event_id]:
+                    queue.put_nowait(status)
+
+            delay = self.poll_interval
+            if status.changes_in is not None:
+                delay = min(delay, status.changes_in)
+            # Do not wake up too early (and then spin), due to timer inaccuracy
+            await asyncio.sleep(max(delay, 0.01))
+
+
+class OpeningStreamApp:
+    """
+    ASGI application that serves opening status streams, keeping connections open to push changes.
+
+    This only handles requests for the opening_stream URL itself, anything else is passed on to the fallback ASGI
+    application (e.g. a ThreadedWSGIApp serving the normal Django views), or responded to with 404 without one.
+    """
+
+    def __init__(self, broadcaster=None, keepalive_interval=30, fallback=None):
+        self.broadcaster = broadcaster or OpeningBroadcaster()
+        self.keepalive_interval = keepalive_interval
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            event_id = self.get_event_id(scope)
+            if event_id is not None:
+                await self.stream(event_id, receive, send)
+            elif self.fallback is not None:
+                await self.fallback(scope, receive, send)
+            else:
+                await self.not_found(send)
+
+    def get_event_id(self, scope):
+        if scope['method'] not in ('GET', 'HEAD'):
+            return None
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            return None
+        if match.view_name != 'registrations:opening_stream':
+            return None
+        return match.kwargs['eventid']
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def not_found(self, send):
+        await send({'type': 'http.response.start', 'status': 404, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Not found'})
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream(self, event_id, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Prevent nginx from buffering the stream
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        queue = self.broadcaster.subscribe(event_id)
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            while True:
+                get = asyncio.ensure_future(queue.get())
+                done, _pending = await asyncio.wait(
+                    {get, disconnect}, timeout=self.keepalive_interval, return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    message = get.result().as_event()
+                else:
+                    get.cancel()
+                    # Comment lines keep the connection from being closed by proxies
+                    message = ': keepalive\n\n'
+                if disconnect in done:
+                    break
+                await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        finally:
+            self.broadcaster.unsubscribe(event_id, queue)
+            disconnect.cancel()
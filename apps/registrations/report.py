@@ -0,0 +1,99 @@
+from django.db.models import Case, Count, F, Sum, When
+from django.db.models.functions import Coalesce
+
+from apps.core.fields import MonetaryField
+
+from .models import Registration, RegistrationFieldValue, RegistrationPriceCorrection
+from .schema import EventSchema
+
+
+class EventReport:
+    """
+    Totals of the (finalized) registrations of a single event, as shown on the registrations table.
+
+    These are computed using a few grouped SQL aggregates, so the number of rows loaded does not depend on the number
+    of registrations (only the active price corrections are loaded, since these are listed individually).
+
+    Option counts and the options total include registered registrations only, while prices, payments and corrections
+    include cancelled registrations too (these might still owe some amount, or need a refund).
+    """
+
+    def __init__(self, option_counts, corrections, price_sum, paid_sum, payable, refundable):
+        # Number of active values for each option of the event (in schema order, including unused options)
+        self.option_counts = option_counts
+        # List of (registration, correction) tuples for active corrections
+        self.corrections = corrections
+        self.price_sum = price_sum
+        self.paid_sum = paid_sum
+        self.payable = payable
+        self.refundable = refundable
+
+        self.options_sum = sum(count * option.price for (option, count) in option_counts.items() if option.price)
+        self.corrections_sum = sum(c.price for (_reg, c) in corrections if c.price is not None)
+
+    @property
+    def price_check(self):
+        """ The total price, computed from options and corrections rather than from registration prices. """
+        return self.options_sum + self.corrections_sum
+
+    @classmethod
+    def for_event(cls, event):
+        return cls(
+            option_counts=cls._option_counts(event),
+            corrections=cls._corrections(event),
+            **cls._payment_totals(event),
+        )
+
+    @staticmethod
+    def _option_counts(event):
+        counts = dict(
+            RegistrationFieldValue.objects
+            .filter(
+                registration__event=event, registration__status=Registration.statuses.REGISTERED,
+                active=True, option__isnull=False,
+            )
+            .order_by()
+            .values_list('option_id')
+            .annotate(count=Count('pk')),
+        )
+        options = EventSchema.for_event(event).options
+        return {option: counts.get(pk, 0) for (pk, option) in options.items()}
+
+    @staticmethod
+    def _corrections(event):
+        corrections = (
+            RegistrationPriceCorrection.objects
+            .with_active()
+            .filter(
+                active=True, registration__event=event,
+                registration__status__in=[Registration.statuses.REGISTERED, Registration.statuses.CANCELLED],
+            )
+            .select_related('registration__user')
+            .order_by('registration__status', 'registration__registered_at', 'pk')
+        )
+        return [(c.registration, c) for c in corrections]
+
+    @staticmethod
+    def _payment_totals(event):
+        def total(expression):
+            return Coalesce(Sum(expression, output_field=MonetaryField()), 0)
+
+        # This groups by event rather than using aggregate(), since Django cannot aggregate over the subqueries added
+        # by with_payment_status() (it tries to move these into a subquery and fails).
+        totals = (
+            Registration.objects
+            .filter(event=event, status__in=[Registration.statuses.REGISTERED, Registration.statuses.CANCELLED])
+            .with_payment_status()
+            .order_by()
+            .values('event')
+            .annotate(
+                price_sum=total('price'),
+                paid_sum=total('paid'),
+                # amount_due is never NULL for these statuses
+                payable=total(Case(When(amount_due__gt=0, then=F('amount_due')), default=0)),
+                refundable=total(Case(When(amount_due__lt=0, then=-F('amount_due')), default=0)),
+            )
+            .values('price_sum', 'paid_sum', 'payable', 'refundable')
+        )
+        # Not using first(), since that would order (and so group) by pk
+        return next(iter(totals), None) or dict.fromkeys(('price_sum', 'paid_sum', 'payable', 'refundable'), 0)
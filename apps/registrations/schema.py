@@ -0,0 +1,246 @@
+import heapq
+import threading
+
+from django.db.models import Count, Max
+
+from .models import RegistrationField, RegistrationFieldOption
+
+
+class EventSchema:
+    """
+    Compiled definition of the registration fields and options of a single event.
+
+    This contains all fields (in order, including sections) and options of an event, with their depends, field and
+    invite-only relations resolved to the instances in this schema, so these can be followed without any queries.
+
+    Schemas are cached per process (see for_event) and shared between requests and threads, so they (and the field
+    and option instances in them) must be treated as read-only.
+    """
+
+    def __init__(self, event_id, version, fields, options):
+        self.event_id = event_id
+        self.version = version
+
+        # All fields, in order
+        self.fields = tuple(fields)
+        self.fields_by_pk = {f.pk: f for f in self.fields}
+        self.fields_by_name = {f.name: f for f in self.fields}
+        # Options per field pk in order, and all options by pk (ordered by field, then option)
+        options_by_field = {f.pk: [] for f in self.fields}
+        for option in options:
+            options_by_field[option.field_id].append(option)
+        self.options_by_field = {pk: tuple(options) for (pk, options) in options_by_field.items()}
+        self.options = {o.pk: o for f in self.fields for o in self.options_by_field[f.pk]}
+
+        # Resolve relations to the instances in this schema (assigning a related object fills the relation cache).
+        # Depends on options from other events are not supported (and prevented by the admin), so leave those.
+        for field in self.fields:
+            if field.depends_id in self.options:
+                field.depends = self.options[field.depends_id]
+        for option in self.options.values():
+            option.field = self.fields_by_pk[option.field_id]
+            if option.depends_id in self.options:
+                option.depends = self.options[option.depends_id]
+
+        # Groups that give access to invite-only fields or options
+        self.invite_only_groups = frozenset(
+            obj.invite_only_id for obj in (*self.fields, *self.options.values()) if obj.invite_only_id is not None
+        )
+
+        self._compile_dependencies()
+
+    def _compile_dependencies(self):
+        """
+        Orders the fields topologically based on their dependencies.
+
+        A field depends on another field when the field itself, or one of its options, depends on an option of that
+        other field. In dependency_order, each field comes after all fields it depends on (and otherwise in normal
+        field order). Fields that are part of a dependency cycle (or depend on one) cannot be ordered, these are
+        omitted from dependency_order and listed in dependency_cycle_fields instead.
+        """
+        def depends_on(obj):
+            option = self.options.get(obj.depends_id)
+            return option.field_id if option is not None else None
+
+        index = {f.pk: i for (i, f) in enumerate(self.fields)}
+        dependents = {f.pk: set() for f in self.fields}
+        num_depends = {f.pk: 0 for f in self.fields}
+        for field in self.fields:
+            depends = {depends_on(obj) for obj in (field, *self.options_by_field[field.pk])} - {None}
+            num_depends[field.pk] = len(depends)
+            for other in depends:
+                dependents[other].add(field.pk)
+
+        # Kahn's algorithm, using a heap to keep the original field order where possible
+        ready = [index[pk] for (pk, n) in num_depends.items() if n == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            field = self.fields[heapq.heappop(ready)]
+            order.append(field)
+            for other in dependents[field.pk]:
+                num_depends[other] -= 1
+                if num_depends[other] == 0:
+                    heapq.heappush(ready, index[other])
+
+        self.dependency_order = tuple(order)
+        self.dependency_cycle_fields = tuple(f for f in self.fields if num_depends[f.pk] > 0)
+
+    def dependencies(self, selected):
+        """
+        Evaluates the dependencies for the given selected options, returns a Dependencies object.
+
+        selected should map field pks to the pk of the selected option (fields without a selected option can be
+        omitted). This evaluates all fields in a single pass, without any queries.
+        """
+        return Dependencies(self, selected)
+
+    def any_option_full(self, group_ids):
+        """
+        Returns whether there is a choice field without any options available to a user in the given groups (by pk).
+
+        This predicts whether a registration would end up on the waiting list (or cannot be made at all). Options are
+        considered unavailable when they are full, invite-only for another group, or depend on an unavailable option.
+        Fields that are invite-only for another group, or depend on an unavailable option, are ignored (since the
+        user will not see them).
+        """
+        available = set()
+        for field in self.dependency_order:
+            if not self.invited(field, group_ids):
+                continue
+            if field.depends_id is not None and field.depends_id not in available:
+                continue
+            options = [
+                o for o in self.options_by_field[field.pk]
+                if self.invited(o, group_ids) and not o.full
+                and (o.depends_id is None or o.depends_id in available)
+            ]
+            if field.field_type.CHOICE and not options:
+                return True
+            available.update(o.pk for o in options)
+        return False
+
+    @property
+    def value_fields(self):
+        """ All fields that can have values (i.e. excluding sections), in order. """
+        return tuple(f for f in self.fields if not f.field_type.SECTION)
+
+    def invited(self, obj, group_ids):
+        """ Returns whether the given field or option is available to a user in the given groups (by pk). """
+        return obj.invite_only_id is None or obj.invite_only_id in group_ids
+
+    def fields_for(self, group_ids):
+        """ Returns all fields (including sections) available to a user in the given groups (by pk), in order. """
+        return tuple(f for f in self.fields if self.invited(f, group_ids))
+
+    def options_for(self, field, group_ids):
+        """ Returns the options of the given field available to a user in the given groups (by pk), in order. """
+        return [o for o in self.options_by_field[field.pk] if self.invited(o, group_ids)]
+
+    @staticmethod
+    def version_for(event_id):
+        """
+        Returns the current version of the fields and options of the given event.
+
+        This is based on the number and last update timestamp of the fields and options, so any change (including
+        deletions) results in a different version.
+        """
+        version = RegistrationField.objects.filter(event=event_id).aggregate(**EventSchema._version_aggregates())
+        return tuple(sorted(version.items()))
+
+    @staticmethod
+    def _version_aggregates():
+        return {
+            'fields_count': Count('pk', distinct=True),
+            'fields_updated': Max('updated_at'),
+            'options_count': Count('options'),
+            'options_updated': Max('options__updated_at'),
+        }
+
+    @staticmethod
+    def versions_for(event_ids):
+        """ Returns the current versions (see version_for) of the given events, as a dict, in a single query. """
+        # What version_for returns for events without fields
+        empty = {
+            name: 0 if isinstance(aggregate, Count) else None
+            for (name, aggregate) in EventSchema._version_aggregates().items()
+        }
+        versions = {event_id: tuple(sorted(empty.items())) for event_id in event_ids}
+        rows = (
+            RegistrationField.objects.filter(event__in=versions)
+            # Clear the default ordering, which would otherwise end up in the GROUP BY
+            .order_by().values('event').annotate(**EventSchema._version_aggregates())
+        )
+        for row in rows:
+            versions[row.pop('event')] = tuple(sorted(row.items()))
+        return versions
+
+    @classmethod
+    def load(cls, event_id, version):
+        fields = RegistrationField.objects.filter(event=event_id)
+        options = RegistrationFieldOption.objects.filter(field__event=event_id)
+        return cls(event_id, version, fields, options)
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def for_event(cls, event):
+        """
+        Returns the schema for the given event (or event pk).
+
+        Schemas are cached per process, and reused as long as the fields and options of the event are unchanged (see
+        version_for). Checking this takes a single query, loading the schema two more.
+        """
+        event_id = getattr(event, 'pk', event)
+        return cls._get(event_id, cls.version_for(event_id))
+
+    @classmethod
+    def for_events(cls, event_ids):
+        """ Returns the schemas for the given event pks as a dict, like for_event but checking versions at once. """
+        return {event_id: cls._get(event_id, version) for (event_id, version) in cls.versions_for(event_ids).items()}
+
+    @classmethod
+    def prefetch(cls, registrations):
+        """ Looks up the schemas for the events of the given registrations at once, for active_options_by_section. """
+        schemas = cls.for_events({r.event_id for r in registrations})
+        for registration in registrations:
+            registration._schema = schemas[registration.event_id]
+
+    @classmethod
+    def _get(cls, event_id, version):
+        schema = cls._cache.get(event_id)
+        if schema is None or schema.version != version:
+            schema = cls.load(event_id, version)
+            with cls._cache_lock:
+                cls._cache[event_id] = schema
+        return schema
+
+
+class Dependencies:
+    """
+    Dependencies of fields and options in an EventSchema, evaluated for a given set of selected options.
+
+    A field or option has its dependencies satisfied when it has no depends, or when its depends option is selected and
+    the field of that option has its dependencies satisfied as well (recursively).
+    """
+
+    def __init__(self, schema, selected):
+        self.schema = schema
+        self.selected = selected
+        self.satisfied_fields = set()
+        # Evaluate in dependency order, so we only need to look one level deep for every field
+        for field in schema.dependency_order:
+            if self.satisfied(field):
+                self.satisfied_fields.add(field.pk)
+
+    def satisfied(self, obj):
+        """ Returns whether the dependencies of the given field or option (from the schema) are satisfied. """
+        if obj.depends_id is None:
+            return True
+        depends = self.schema.options.get(obj.depends_id)
+        return (
+            depends is not None
+            and depends.field_id in self.satisfied_fields
+            and self.selected.get(depends.field_id) == depends.pk
+        )
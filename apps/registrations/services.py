@@ -1,22 +1,39 @@
+import collections
+import logging
+import random
 import re
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urljoin
 
 from django.conf import settings
 from django.core.mail import EmailMessage
 from django.db import transaction
-from django.db.models import Exists, OuterRef, Q
+from django.db.models import Case, F, IntegerField, Q, QuerySet, Value, When
 from django.forms import ValidationError
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.translation import gettext as _
 
-from apps.events.models import Event
+from apps.events.models import Event, EventGroupFullness
 from apps.people.models import ArtaUser, EmergencyContact
+from arta.common.revisions import bulk_create_revision
 
-from .models import Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue
+from . import versions
+from .models import FinalizeRequest, Registration, RegistrationFieldOption, RegistrationFieldValue
+from .schema import EventSchema
+
+logger = logging.getLogger(__name__)
 
 
 class RegistrationStatusService:
+    # Status changes that can be applied to arbitrary (sets of) registrations by change_statuses, as (old, new) tuples
+    BULK_STATUS_CHANGES = (
+        (Registration.statuses.PENDING, Registration.statuses.REGISTERED),
+        (Registration.statuses.PENDING, Registration.statuses.CANCELLED),
+        (Registration.statuses.PENDING, Registration.statuses.WAITINGLIST),
+        (Registration.statuses.WAITINGLIST, Registration.statuses.CANCELLED),
+    )
+
     @staticmethod
     def preparation_completed(registration):
         """
@@ -41,67 +58,65 @@ class RegistrationStatusService:
         if not user.first_name or not user.last_name:
             raise ValidationError(_("Name (partially) empty"))
 
-        # Check that all fields have a value (taking dependencies into account)
-        # TODO: Should this code live somewhere else?
+        RegistrationStatusService._check_options(registration)
+
+        registration.status = Registration.statuses.PREPARATION_COMPLETE
+        registration.save()
+
+    @staticmethod
+    def _check_options(registration):
+        """
+        Checks that the registration has a valid value for all fields (taking dependencies into account).
+
+        This loads the active values and the user's groups once, takes the fields and options from the event schema
+        and does all checks in memory, so the number of queries does not depend on the number of fields. Raises
+        ValidationError on the first problem found.
+        """
         # TODO: How about fields where all options do not have their dependencies fulfilled? Should those be omitted?
-        selected_options = RegistrationFieldOption.objects.filter(
-            registrationfieldvalue__registration=registration,
-            registrationfieldvalue__active=True,
-        )
-        all_fields = RegistrationField.objects.filter(
-            event=registration.event_id,
-        ).exclude(
-            field_type=RegistrationField.types.SECTION,
-        )
-        available_fields = all_fields.filter(
-            Q(depends=None) | Q(depends__in=selected_options),
-            Q(invite_only=None) | Q(invite_only__user=user),
-        )
-        required_fields = available_fields.filter(required=True)
-        supplied_values = RegistrationFieldValue.objects.filter(
+        schema = EventSchema.for_event(registration.event_id)
+        supplied_values = list(RegistrationFieldValue.objects.filter(
             active=True,
             registration=registration,
-        )
+        ).select_related('field').order_by('pk'))
+        all_fields = schema.value_fields
+        group_ids = set(registration.user.groups.values_list('pk', flat=True))
+        selected_option_ids = {v.option_id for v in supplied_values if v.option_id is not None}
+
+        def is_available(obj):
+            return (
+                (obj.depends_id is None or obj.depends_id in selected_option_ids)
+                and schema.invited(obj, group_ids)
+            )
+
+        available_field_ids = {f.pk for f in all_fields if is_available(f)}
 
         # These values are completely invalid, or required and empty
-        invalid_values = supplied_values.with_satisfies_required().filter(satisfies_required=False)
-        invalid_names = [name for (name, ) in invalid_values.values_list('field__name')]
+        invalid_names = [v.field.name for v in supplied_values if not v.check_satisfies_required()]
         if invalid_names:
             raise ValidationError(_("Invalid registration options: {}".format(", ".join(invalid_names))))
 
         # These values use an option that is not available
-        available_options = RegistrationFieldOption.objects.filter(
-            Q(field__event=registration.event_id),
-            Q(depends=None) | Q(depends__in=selected_options),
-            Q(invite_only=None) | Q(invite_only__user=user),
-        )
-        unavailable_values = (
-            supplied_values
-            .exclude(option=None)
-            .exclude(option__in=available_options)
-        )
-        unavailable_names = [name for (name, ) in unavailable_values.values_list('field__name')]
+        unavailable_names = [
+            v.field.name for v in supplied_values
+            if v.option_id is not None
+            # Options from other events are not in the schema
+            and (v.option_id not in schema.options or not is_available(schema.options[v.option_id]))
+        ]
         if unavailable_names:
             raise ValidationError(_("Unavailable registration options: {}".format(", ".join(unavailable_names))))
 
-        # TODO: In Django 3.0, the annotation can be removed and you can pass Exists directly to exclude
-        missing_fields = required_fields.annotate(
-            value_exists=Exists(supplied_values.with_satisfies_required().filter(
-                field=OuterRef('pk'),
-            )),
-        ).exclude(value_exists=True)
-        missing_names = [name for (name, ) in missing_fields.values_list('name')]
+        satisfied_field_ids = {v.field_id for v in supplied_values if v.check_satisfies_required()}
+        missing_names = [
+            f.name for f in all_fields
+            if f.required and f.pk in available_field_ids and f.pk not in satisfied_field_ids
+        ]
         if missing_names:
             raise ValidationError(_("Missing registration options: {}".format(", ".join(missing_names))))
 
-        extra_values = supplied_values.exclude(field__in=available_fields)
-        extra_names = [name for (name, ) in extra_values.values_list('field__name')]
+        extra_names = [v.field.name for v in supplied_values if v.field_id not in available_field_ids]
         if extra_names:
             raise ValidationError(_("Extra registration options: {}".format(", ".join(extra_names))))
 
-        registration.status = Registration.statuses.PREPARATION_COMPLETE
-        registration.save()
-
     @staticmethod
     def finalize_registration(registration):
         """
@@ -114,12 +129,20 @@ class RegistrationStatusService:
         by this registration, the status is set to REGISTERED. If there insufficient slots, the status is changed to
         WAITINGLIST.
         """
+        # Only rows that have slots are locked, to allow registrations that select different options to be finalized
+        # in parallel. Locks are always taken in the same order (event, users, options by pk) to prevent deadlocks.
+        # Whether the event has slots is checked outside of the transaction, slots are not expected to change while
+        # registration is open.
+        event_has_slots = RegistrationStatusService._event_has_slots(registration.event_id)
+
         with transaction.atomic():
-            # Lock the event, to prevent multiple registrations from taking up the same slots.
-            # This locks the event separately first and uses used_slots_for() rather than with_used_slots() in a single
-            # query, to prevent locking any other rows than the event itself.
+            # Lock the event when it has slots, to prevent multiple registrations from taking up the same slots.
+            # This locks the event separately first, to prevent locking any other rows than the event itself.
             # Not strictly needed for pending registrations, but does not hurt (much) either
-            event = Event.objects.select_for_update().for_user(registration.user_id).get(pk=registration.event_id)
+            events = Event.objects.for_user(registration.user_id)
+            if event_has_slots:
+                events = events.select_for_update()
+            event = events.get(pk=registration.event_id)
 
             # Lock the user, to prevent mutually exclusive registrations for the same user.
             # We do not actually need the values, so just evaluate the query and check it returns one user for good
@@ -144,15 +167,15 @@ class RegistrationStatusService:
                 # Pending registrations are super-easy, just set the status, no need to look at the slots
                 registration.status = Registration.statuses.PENDING
             else:
-                # This selects all options that are associated with the current registration and that have non-null
-                # slots. annotated with the number of slots used.
-                options = RegistrationFieldOption.objects.with_used_slots().filter(
+                # This selects all options that are associated with the current registration (and locks the ones
+                # with slots). Their used_slots (and that of the event) are maintained counters, so no registrations
+                # need to be counted while holding the lock.
+                options = RegistrationStatusService._lock_slotted_options(RegistrationFieldOption.objects.filter(
                     Q(registrationfieldvalue__registration=registration)
                     & Q(registrationfieldvalue__active=True),
-                )
+                ))
 
                 # We can check the event slots and full flag just like options
-                event.used_slots = Event.objects.used_slots_for(event)
                 options = [*options, event]
 
                 if any(o.full or (o.slots is not None and o.used_slots >= o.slots) for o in options):
@@ -164,25 +187,698 @@ class RegistrationStatusService:
                     for o in options:
                         if o.slots is not None and o.slots - o.used_slots == 1:
                             o.full = True
-                            o.save()
+                            # Do not write used_slots, that is updated below
+                            o.save(update_fields=['full', 'updated_at'])
 
             registration.registered_at = datetime.now(timezone.utc)
             registration.save()
 
+            if registration.status.REGISTERED:
+                # This also implicitly locks rows that were not locked above, so do this last to keep the locks short
+                # and prevent deadlocks.
+                UsedSlotsService.adjust(event.pk, [o.pk for o in options if o is not event], 1)
+
+    @staticmethod
+    def _event_has_slots(event_id):
+        return Event.objects.filter(pk=event_id).exclude(slots=None).exists()
+
+    @staticmethod
+    def _lock_slotted_options(options):
+        """
+        Returns the given options (queryset), locking the ones that have slots.
+
+        This first queries the options without locking and then locks only the ones with slots by pk, in pk order to
+        prevent deadlocks. Doing this in a single query could also lock rows that are examined but not returned (e.g.
+        for joins and when filtering on slots).
+        """
+        options = list(options)
+        slotted_ids = sorted(o.pk for o in options if o.slots is not None)
+        if not slotted_ids:
+            return options
+
+        locked = {
+            o.pk: o
+            for o in RegistrationFieldOption.objects.select_for_update().filter(pk__in=slotted_ids).order_by('pk')
+        }
+        return [locked.get(o.pk, o) for o in options]
+
+    @staticmethod
+    def finalize_registrations(event, registrations):
+        """
+        Finalizes multiple registrations for the same event, like finalize_registration but in a single transaction.
+
+        This locks the event (and users) only once and decides the status of all registrations in memory, in the order
+        given (which also becomes the order of their registered_at timestamps). Changes are written using bulk
+        updates, so the number of queries does not depend on the number of registrations.
+
+        Registrations that cannot be finalized are left unchanged. Returns a dict mapping the pk of these registrations
+        to a ValidationError describing the problem.
+        """
+        errors = {}
+        if not registrations:
+            return errors
+
+        # This uses the same locking strategy as finalize_registration (so these can safely run concurrently)
+        event_has_slots = RegistrationStatusService._event_has_slots(event.pk)
+
+        with transaction.atomic():
+            # Lock the event when it has slots, to prevent other (batches of) registrations from taking up the same
+            # slots
+            events = Event.objects.all()
+            if event_has_slots:
+                events = events.select_for_update()
+            event = events.get(pk=event.pk)
+
+            # Lock the users, in a fixed order to prevent deadlocks between batches
+            user_ids = sorted({r.user_id for r in registrations})
+            if len(ArtaUser.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values('id')) \
+                    != len(user_ids):
+                raise RuntimeError("User does not exist?")
+
+            # Whether registration is open depends only on whether a user is an invitee, so check that only once for
+            # invitees and once for others.
+            invitee_ids = set(
+                ArtaUser.objects.filter(pk__in=user_ids, groups__invited_events=event).values_list('pk', flat=True),
+            )
+            is_open = {}
+            for user_id in user_ids:
+                is_invitee = user_id in invitee_ids
+                if is_invitee not in is_open:
+                    is_open[is_invitee] = Event.objects.for_user(user_id).get(pk=event.pk).registration_is_open
+
+            # Refresh after taking the lock
+            current = Registration.objects.filter(pk__in=[r.pk for r in registrations]).in_bulk()
+
+            # Load all selected options at once, keeping a single instance per option so the used_slots and full
+            # changes below accumulate in memory.
+            values = RegistrationFieldValue.objects.filter(
+                registration__in=[r.pk for r in registrations],
+                active=True,
+            ).exclude(option=None).select_related('option')
+            values = list(values)
+            options_by_id = {
+                o.pk: o for o in RegistrationStatusService._lock_slotted_options({v.option for v in values})
+            }
+            options_by_registration = collections.defaultdict(list)
+            for value in values:
+                options_by_registration[value.registration_id].append(options_by_id[value.option_id])
+
+            # Load all conflicts at once, keeping the first for each user
+            conflicts_by_user = {}
+            conflicts = Registration.objects.conflicting_registrations_for_many(registrations).select_related('event')
+            for conflict in conflicts.order_by('pk'):
+                conflicts_by_user.setdefault(conflict.user_id, conflict)
+
+            now = datetime.now(timezone.utc)
+            finalized = []
+            used_slots = collections.Counter()
+            for registration in registrations:
+                fresh = current.get(registration.pk)
+                if fresh is None or fresh.event_id != event.pk:
+                    errors[registration.pk] = ValidationError(_("Registration is not for this event"))
+                    continue
+                registration.status = fresh.status
+
+                if not is_open[registration.user_id in invitee_ids]:
+                    errors[registration.pk] = ValidationError(_("Registration is not open"))
+                    continue
+
+                if not registration.status.PREPARATION_COMPLETE:
+                    errors[registration.pk] = ValidationError(_("Registration not ready for finalization"))
+                    continue
+
+                conflict = conflicts_by_user.get(registration.user_id)
+                if conflict is not None:
+                    errors[registration.pk] = ValidationError(_("Already registered for {}".format(conflict.event)))
+                    continue
+
+                # Equivalent to registration.admit_immediately, without a query per registration
+                options = options_by_registration[registration.pk]
+                if not (event.admit_immediately or any(o.admit_immediately for o in options)):
+                    registration.status = Registration.statuses.PENDING
+                else:
+                    # We can check the event slots and full flag just like options
+                    options = [*options, event]
+
+                    if any(o.full or (o.slots is not None and o.used_slots >= o.slots) for o in options):
+                        registration.status = Registration.statuses.WAITINGLIST
+                    else:
+                        registration.status = Registration.statuses.REGISTERED
+                        for o in options:
+                            o.used_slots += 1
+                            used_slots[o] += 1
+                            # Set full for any options (or the event as a whole) where we used the last slot
+                            if o.slots is not None and o.used_slots == o.slots:
+                                o.full = True
+
+                # Keep the registered_at timestamps in the order of processing (microseconds is the resolution of
+                # the database field)
+                registration.registered_at = now + timedelta(microseconds=len(finalized))
+                registration.updated_at = now
+                finalized.append(registration)
+
+            for o in used_slots:
+                if o.full:
+                    # Do not write used_slots, that is updated below
+                    o.save(update_fields=['full', 'updated_at'])
+
+            Registration.objects.bulk_update(finalized, ['status', 'registered_at', 'updated_at'])
+            versions.registrations_changed(finalized)
+
+            # Like in finalize_registration, do this last since it also locks rows (event first, then options)
+            if used_slots[event]:
+                UsedSlotsService.adjust(event.pk, [], used_slots[event])
+            UsedSlotsService.adjust_options({o.pk: delta for o, delta in used_slots.items() if o is not event})
+
+        return errors
+
+    @staticmethod
+    def request_finalize(registration, base_url):
+        """
+        Queues a registration to be finalized later by process_finalize_queue.
+
+        Current status must be PREPARATION_COMPLETE, otherwise a ValidationError is raised. When the registration is
+        already queued, it keeps its original place in the queue. base_url is used to build urls in the confirmation
+        e-mail.
+        """
+        if not registration.status.PREPARATION_COMPLETE:
+            raise ValidationError(_("Registration has incorrect status"))
+
+        # This only records the request without locking anything, so lots of these can be handled concurrently
+        finalize_request, created = FinalizeRequest.objects.get_or_create(
+            registration=registration,
+            defaults={'requested_at': datetime.now(timezone.utc), 'base_url': base_url},
+        )
+        if not created and finalize_request.processed_at is not None:
+            # A previous request was processed but failed, so queue again
+            finalize_request.requested_at = datetime.now(timezone.utc)
+            finalize_request.processed_at = None
+            finalize_request.error = ''
+            finalize_request.base_url = base_url
+            finalize_request.save()
+        return finalize_request
+
+    @staticmethod
+    def process_finalize_queue(event, batch_size=None):
+        """
+        Processes queued finalize requests for the given event in order of arrival, returns the number processed.
+
+        Up to batch_size requests (or all of them, when None) are finalized together using finalize_registrations,
+        after which confirmation e-mails are sent and the requests are deleted. When finalization fails, the error is
+        stored in the request (to be shown to the user) instead. Failing to send an e-mail is logged, but does not
+        prevent sending the others.
+
+        Only one process should handle the queue for a given event at the same time, to guarantee ordering.
+        """
+        queue = FinalizeRequest.objects.queued_for(event).select_related('registration__user')
+        if batch_size is not None:
+            queue = queue[:batch_size]
+        queue = list(queue)
+
+        errors = RegistrationStatusService.finalize_registrations(event, [fr.registration for fr in queue])
+
+        # Keep failed requests to show their errors to the user (until requested again), the result of successful ones
+        # is the status of their registration
+        now = datetime.now(timezone.utc)
+        failed = [fr for fr in queue if fr.registration_id in errors]
+        for finalize_request in failed:
+            finalize_request.error = "\n".join(errors[finalize_request.registration_id].messages)
+            finalize_request.processed_at = now
+            finalize_request.updated_at = now
+        FinalizeRequest.objects.bulk_update(failed, ['error', 'processed_at', 'updated_at'])
+        FinalizeRequest.objects.filter(pk__in=[fr.pk for fr in queue if fr.registration_id not in errors]).delete()
+
+        for finalize_request in queue:
+            if finalize_request.registration_id not in errors:
+                try:
+                    RegistrationNotifyService.send_confirmation_email(
+                        None, finalize_request.registration, base_url=finalize_request.base_url,
+                    )
+                except Exception:
+                    # The registration is finalized already, so just report this and keep going
+                    logger.exception("Failed to send confirmation e-mail for registration %s",
+                                     finalize_request.registration_id)
+        return len(queue)
+
+    @staticmethod
+    def change_statuses(registrations, old_status, new_status, user=None, comment=''):
+        """
+        Changes the status of multiple registrations (possibly for different events) from old_status to new_status.
+
+        The registrations can be given as a list or as a queryset, which is then only used to select the pks.
+
+        The change must be listed in BULK_STATUS_CHANGES and all registrations must currently have old_status,
+        otherwise a ValidationError is raised and nothing is changed. Changes are written using bulk queries, so the
+        number of queries does not depend on the number of registrations. This also updates the used_slots counters
+        and sets the full flag on events and options whose last slot was taken. Full flags are never cleared
+        automatically, since freed slots are normally handed out from the waiting list.
+
+        All changes are saved in a single revision (including the registration options, like a regular save would),
+        attributed to the given user. Returns the number of changed registrations.
+        """
+        if (old_status, new_status) not in RegistrationStatusService.BULK_STATUS_CHANGES:
+            raise ValidationError(_("Cannot change registration status from {} to {}").format(
+                old_status.id, new_status.id))
+
+        # Whether the counters (and thus full flags) are affected
+        delta = int(bool(new_status.REGISTERED)) - int(bool(old_status.REGISTERED))
+
+        if isinstance(registrations, QuerySet):
+            # Only the pks are needed, so do not evaluate the queryset (with any annotations or prefetches it has, e.g.
+            # from the admin changelist), but use it as a subquery
+            pks = registrations.values('pk')
+        else:
+            pks = [r.pk for r in registrations]
+
+        with transaction.atomic():
+            # The related objects are used for the object_repr of the versions
+            registrations = list(Registration.objects.filter(
+                pk__in=pks).select_related('user', 'event').order_by('pk'))
+            if any(r.status != old_status for r in registrations):
+                raise ValidationError(_("Not all selected registrations in {} state").format(old_status.id))
+            if not registrations:
+                return 0
+
+            values = list(RegistrationFieldValue.objects.filter(
+                registration__in=registrations).select_related('field', 'option').order_by('pk'))
+            option_ids = [v.option_id for v in values if v.active and v.option_id is not None]
+
+            if delta:
+                # Use the same locking order as finalize_registration: events with slots, then options with slots
+                # (both in pk order)
+                event_ids = sorted({r.event_id for r in registrations})
+                list(Event.objects.select_for_update().filter(pk__in=event_ids).exclude(slots=None).order_by('pk')
+                     .values('pk'))
+                RegistrationStatusService._lock_slotted_options(
+                    RegistrationFieldOption.objects.filter(pk__in=set(option_ids)))
+
+            now = datetime.now(timezone.utc)
+            updated = Registration.objects.filter(
+                pk__in=[r.pk for r in registrations], status=old_status,
+            ).update(status=new_status, updated_at=now)
+            if updated != len(registrations):
+                # Status was changed by someone else in the meanwhile, abort (rolls back the transaction)
+                raise ValidationError(_("Not all selected registrations in {} state").format(old_status.id))
+            for registration in registrations:
+                registration.status = new_status
+                registration.updated_at = now
+            versions.registrations_changed(registrations)
+
+            if delta:
+                # Do this last since it also locks rows (events first, then options)
+                event_counts = collections.Counter(r.event_id for r in registrations)
+                for event_id in sorted(event_counts):
+                    UsedSlotsService.adjust(event_id, [], delta * event_counts[event_id])
+                UsedSlotsService.adjust_options({
+                    option_id: delta * count for option_id, count in collections.Counter(option_ids).items()
+                })
+
+                # Set full for any options (or events) where the last slot was taken
+                if delta > 0:
+                    Event.objects.filter(pk__in=event_counts, full=False, used_slots__gte=F('slots')).update(
+                        full=True, updated_at=now,
+                    )
+                    RegistrationFieldOption.objects.filter(
+                        pk__in=set(option_ids), full=False, used_slots__gte=F('slots'),
+                    ).update(full=True, updated_at=now)
+                    versions.events_changed(event_counts)
+                    OptionsFullService.update(event_counts)
+
+            bulk_create_revision(registrations + values, user=user, comment=comment)
+
+        return len(registrations)
+
+
+class UsedSlotsService:
+    """
+    Maintains the used_slots counters of events and options.
+
+    These count the REGISTERED registrations for an event (and their active options), so the number of available
+    slots can be checked without counting registrations. The counters must be updated whenever a registration becomes
+    or stops being REGISTERED, or when the options of a REGISTERED registration change. This should happen in the same
+    transaction as the change itself.
+    """
+
+    @staticmethod
+    def adjust(event_id, option_ids, delta):
+        """
+        Adds delta to the used_slots of the given event (if not None) and options.
+
+        This updates the event before the options, each in a single query, so rows are always locked in the same order.
+        """
+        if event_id is not None:
+            Event.objects.filter(pk=event_id).update_counters(used_slots=F('used_slots') + delta)
+        if option_ids:
+            RegistrationFieldOption.objects.filter(pk__in=option_ids).update_counters(
+                used_slots=F('used_slots') + delta,
+            )
+
+    @staticmethod
+    def adjust_options(option_deltas):
+        """ Adds a delta to the used_slots of multiple options, option_deltas maps option pk to delta. """
+        option_deltas = {pk: delta for pk, delta in option_deltas.items() if delta}
+        if not option_deltas:
+            return
+        # Use a single query, so rows are locked in a consistent order (unlike with a query per delta)
+        RegistrationFieldOption.objects.filter(pk__in=option_deltas).update_counters(
+            used_slots=F('used_slots') + Case(
+                *(When(pk=pk, then=Value(delta)) for pk, delta in option_deltas.items()),
+                output_field=IntegerField(),
+            ),
+        )
+
+    @staticmethod
+    def registration_status_changed(registration, old_status):
+        """ Updates counters for a registration whose status was changed from old_status to its current status. """
+        was_registered = (old_status == Registration.statuses.REGISTERED)
+        if was_registered == bool(registration.status.REGISTERED):
+            return
+
+        option_ids = RegistrationFieldValue.objects.filter(
+            registration=registration, active=True,
+        ).exclude(option=None).values_list('option_id', flat=True)
+        UsedSlotsService.adjust(registration.event_id, list(option_ids), -1 if was_registered else 1)
+
+    @staticmethod
+    def registration_options_changed(registration, removed_option_ids, added_option_ids):
+        """ Updates counters for a registration that stopped using removed_option_ids and started using added ones. """
+        if not registration.status.REGISTERED:
+            return
+
+        deltas = collections.Counter(added_option_ids)
+        deltas.subtract(removed_option_ids)
+        UsedSlotsService.adjust_options(deltas)
+
+    @staticmethod
+    def recount(event, fix=True):
+        """
+        Recounts the used_slots counters of the given event and its options.
+
+        Returns a list of (obj, used_slots, counted) tuples for all counters that did not match the counted value. When
+        fix is True, these are also corrected.
+        """
+        with transaction.atomic():
+            # Lock the event to prevent registrations from being finalized while counting
+            event = Event.objects.select_for_update().get(pk=event.pk)
+            event.used_slots_count = Event.objects.used_slots_for(event)
+            options = RegistrationFieldOption.objects.filter(field__event=event).with_used_slots_count()
+
+            wrong = [
+                (obj, obj.used_slots, obj.used_slots_count)
+                for obj in [event, *options]
+                if obj.used_slots != obj.used_slots_count
+            ]
+
+            if fix:
+                for (obj, _used_slots, counted) in wrong:
+                    type(obj).objects.filter(pk=obj.pk).update_counters(used_slots=counted)
+        return wrong
+
+
+LotteryResult = collections.namedtuple('LotteryResult', ['seed', 'registered', 'waitinglist'])
+
+
+class OptionsFullService:
+    """
+    Maintains the options_full flags of events, and their per invite-only group variants (EventGroupFullness).
+
+    These predict whether a registration would end up on the waiting list due to its options (see
+    EventSchema.any_option_full), so Event.for_user does not have to compute that for every event. They must be
+    updated whenever options or fields of an event change. Saving or deleting these does so automatically (see
+    signals.py), code using QuerySet.update() should call update() itself.
+    """
+
+    @staticmethod
+    def update(event_ids):
+        """ Recomputes the flags for the given events (by pk). """
+        for event_id in sorted(set(event_ids)):
+            # Load the schema directly rather than through the per-process cache, since this runs right after changes
+            # to fields or options (typically inside their transaction), so a cached schema would be outdated anyway,
+            # and a schema loaded from uncommitted data should not be shared with other threads.
+            schema = EventSchema.load(event_id, version=None)
+            if not Event.objects.filter(pk=event_id).update_counters(options_full=schema.any_option_full(set())):
+                # Event was deleted
+                continue
+
+            group_fullness = {group_id: schema.any_option_full({group_id}) for group_id in schema.invite_only_groups}
+            EventGroupFullness.objects.filter(event=event_id).exclude(group__in=group_fullness).delete()
+            existing = dict(
+                EventGroupFullness.objects.filter(event=event_id).values_list('group_id', 'options_full'),
+            )
+            for group_id, options_full in group_fullness.items():
+                if group_id not in existing:
+                    EventGroupFullness.objects.create(event_id=event_id, group_id=group_id, options_full=options_full)
+                elif existing[group_id] != options_full:
+                    EventGroupFullness.objects.filter(event=event_id, group=group_id).update(options_full=options_full)
+
+
+class LotteryService:
+    @staticmethod
+    def draw(event, seed=None, user=None):
+        """
+        Admits the PENDING registrations for an event in a random order, honouring event and option slots.
+
+        Registrations are admitted (REGISTERED) in a random order while slots are available, the rest end up on the
+        WAITINGLIST (in the same random order). The order only depends on the seed and the set of pending
+        registrations, so passing the same seed reproduces the result. When no seed is given, a random one is
+        generated.
+
+        All changes are saved in a single revision, attributed to the given user. Returns a LotteryResult with the
+        seed used and the number of registered and waitinglisted registrations.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 32)
+
+        # Uses the same locking strategy as RegistrationStatusService.finalize_registration, so finalizations can
+        # safely happen concurrently.
+        event_has_slots = RegistrationStatusService._event_has_slots(event.pk)
+
+        with transaction.atomic():
+            events = Event.objects.all()
+            if event_has_slots:
+                events = events.select_for_update()
+            event = events.get(pk=event.pk)
+
+            # Only options with slots (or that are full) can limit admission
+            limiting_options = RegistrationStatusService._lock_slotted_options(
+                RegistrationFieldOption.objects.filter(field__event=event).filter(~Q(slots=None) | Q(full=True)),
+            )
+
+            # Build compact in-memory representations: remaining slots per option index (None for unlimited), and per
+            # registration the option indices it uses.
+            option_index = {o.pk: i for i, o in enumerate(limiting_options)}
+            remaining = [
+                0 if o.full else (None if o.slots is None else max(o.slots - o.used_slots, 0))
+                for o in limiting_options
+            ]
+            event_remaining = 0 if event.full else (
+                None if event.slots is None else max(event.slots - event.used_slots, 0))
+
+            registrations = list(
+                Registration.objects.filter(event=event, status=Registration.statuses.PENDING)
+                .select_related('user', 'event').order_by('pk'))
+            registration_index = {r.pk: i for i, r in enumerate(registrations)}
+            option_ids = [[] for _r in registrations]
+            values = RegistrationFieldValue.objects.filter(
+                registration__event=event,
+                registration__status=Registration.statuses.PENDING,
+                active=True,
+            ).exclude(option=None).order_by('pk').values_list('registration_id', 'option_id')
+            for registration_id, option_id in values:
+                option_ids[registration_index[registration_id]].append(option_id)
+            limits = [
+                tuple(option_index[o] for o in options if o in option_index)
+                for options in option_ids
+            ]
+
+            order = list(range(len(registrations)))
+            random.Random(seed).shuffle(order)
+
+            admitted = []
+            waiting = []
+            for i in order:
+                if event_remaining == 0 or any(remaining[j] == 0 for j in limits[i]):
+                    waiting.append(i)
+                    continue
+                admitted.append(i)
+                if event_remaining is not None:
+                    event_remaining -= 1
+                for j in limits[i]:
+                    if remaining[j] is not None:
+                        remaining[j] -= 1
+
+            now = datetime.now(timezone.utc)
+            for i in admitted:
+                registrations[i].status = Registration.statuses.REGISTERED
+                registrations[i].updated_at = now
+            # The waitinglist is ordered by registered_at, so use that to keep the random order (microseconds is the
+            # resolution of the database field)
+            for n, i in enumerate(waiting):
+                registrations[i].status = Registration.statuses.WAITINGLIST
+                registrations[i].registered_at = now + timedelta(microseconds=n)
+                registrations[i].updated_at = now
+            Registration.objects.bulk_update(registrations, ['status', 'registered_at', 'updated_at'], batch_size=500)
+            versions.registrations_changed(registrations)
+
+            # Set full for any options (or the event as a whole) where we used the last slot
+            for o, left in zip(limiting_options, remaining):
+                if not o.full and left == 0:
+                    o.full = True
+                    o.save(update_fields=['full', 'updated_at'])
+            if not event.full and event_remaining == 0:
+                event.full = True
+                event.save(update_fields=['full', 'updated_at'])
+
+            # Do this last since it also locks rows (event first, then options)
+            if admitted:
+                UsedSlotsService.adjust(event.pk, [], len(admitted))
+            UsedSlotsService.adjust_options(collections.Counter(o for i in admitted for o in option_ids[i]))
+
+            values = RegistrationFieldValue.objects.filter(
+                registration__in=registrations).select_related('field', 'option').order_by('pk')
+            bulk_create_revision(
+                registrations + list(values), user=user,
+                comment=_("Lottery with seed {}: {} registered, {} on waiting list").format(
+                    seed, len(admitted), len(waiting)),
+            )
+
+        return LotteryResult(seed=seed, registered=len(admitted), waitinglist=len(waiting))
+
+
+class WaitinglistService:
+    @staticmethod
+    def promote(event, user=None, batch_size=100):
+        """
+        Admits WAITINGLIST registrations for the given event while slots are available, in waiting list order.
+
+        Registrations that cannot be admitted because an option they selected has no slots left are skipped (keeping
+        their place on the waiting list). The waiting list is read in batches and reading stops as soon as the event
+        has no slots left, so the work done is proportional to the number of promoted (and skipped) registrations,
+        not the length of the waiting list.
+
+        Afterwards, full flags are updated to match the slots that are left: set where no slots are left, cleared
+        where slots remain (these could not be used by anyone on the waiting list). Full flags on events and options
+        without slots are left alone, these were set manually to close registration and block any promotion.
+
+        All changes are saved in a single revision, attributed to the given user. Returns the promoted registrations.
+        """
+        # Uses the same locking strategy as RegistrationStatusService.finalize_registration, so finalizations can
+        # safely happen concurrently.
+        event_has_slots = RegistrationStatusService._event_has_slots(event.pk)
+
+        with transaction.atomic():
+            events = Event.objects.all()
+            if event_has_slots:
+                events = events.select_for_update()
+            event = events.get(pk=event.pk)
+
+            limiting_options = RegistrationStatusService._lock_slotted_options(
+                RegistrationFieldOption.objects.filter(field__event=event).filter(~Q(slots=None) | Q(full=True)),
+            )
+            # Remaining slots per option (None for unlimited). Unlike when finalizing, full flags on options with
+            # slots are ignored, since these are typically set when the last slot was taken and not cleared when
+            # slots free up again.
+            remaining = {
+                o.pk: None if o.slots is None and not o.full else max((o.slots or 0) - o.used_slots, 0)
+                for o in limiting_options
+            }
+            event_remaining = None if event.slots is None and not event.full else \
+                max((event.slots or 0) - event.used_slots, 0)
+
+            promoted = []
+            promoted_option_ids = []
+            waiting = Registration.objects.filter(
+                event=event, status=Registration.statuses.WAITINGLIST,
+            ).select_related('user', 'event').order_by('registered_at', 'pk')
+            last = None
+            while event_remaining != 0:
+                batch = waiting
+                if last is not None:
+                    batch = batch.filter(
+                        Q(registered_at__gt=last.registered_at) | Q(registered_at=last.registered_at, pk__gt=last.pk),
+                    )
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                last = batch[-1]
+
+                option_ids = collections.defaultdict(list)
+                values = RegistrationFieldValue.objects.filter(
+                    registration__in=batch, active=True,
+                ).exclude(option=None).values_list('registration_id', 'option_id')
+                for registration_id, option_id in values:
+                    option_ids[registration_id].append(option_id)
+
+                for registration in batch:
+                    if event_remaining == 0:
+                        break
+                    limits = [o for o in option_ids[registration.pk] if remaining.get(o) is not None]
+                    if any(remaining[o] == 0 for o in limits):
+                        continue
+                    if event_remaining is not None:
+                        event_remaining -= 1
+                    for o in limits:
+                        remaining[o] -= 1
+                    promoted.append(registration)
+                    promoted_option_ids.extend(option_ids[registration.pk])
+
+            # Update full flags (only for those with slots, see above)
+            for obj, left in [*((o, remaining[o.pk]) for o in limiting_options), (event, event_remaining)]:
+                if obj.slots is not None and obj.full != (left == 0):
+                    obj.full = (left == 0)
+                    obj.save(update_fields=['full', 'updated_at'])
+
+            if not promoted:
+                return []
+
+            now = datetime.now(timezone.utc)
+            Registration.objects.filter(pk__in=[r.pk for r in promoted]).update(
+                status=Registration.statuses.REGISTERED, updated_at=now)
+            for registration in promoted:
+                registration.status = Registration.statuses.REGISTERED
+                registration.updated_at = now
+            versions.registrations_changed(promoted)
+
+            # Do this last since it also locks rows (event first, then options)
+            UsedSlotsService.adjust(event.pk, [], len(promoted))
+            UsedSlotsService.adjust_options(collections.Counter(promoted_option_ids))
+
+            values = RegistrationFieldValue.objects.filter(
+                registration__in=promoted).select_related('field', 'option').order_by('pk')
+            bulk_create_revision(
+                promoted + list(values), user=user,
+                comment=_("Promoted {} registrations from the waiting list").format(len(promoted)),
+            )
+
+        return promoted
+
+    @staticmethod
+    def slots_freed(event, user=None):
+        """ Promotes from the waiting list after slots might have been freed, when enabled for the event. """
+        if event.promote_waitinglist:
+            return WaitinglistService.promote(event, user=user)
+        return []
+
 
 class RegistrationNotifyService:
     @staticmethod
-    def send_confirmation_email(request, registration):
+    def send_confirmation_email(request, registration, base_url=None):
+        """ Sends the confirmation e-mail. When there is no request (i.e. request is None), pass base_url instead. """
+        def absolute_uri(url):
+            if request is None:
+                return urljoin(base_url, url)
+            return request.build_absolute_uri(url)
+
         # Use request.user when possible, since that will already have been loaded.
-        user = request.user
+        user = request.user if request is not None else registration.user
         if user.pk != registration.user_id:
             user = registration.user
         context = {
             'user': user,
             'registration': registration,
             'options_by_section': registration.active_options_by_section,
-            'house_rules_url': request.build_absolute_uri(reverse('core:house_rules')),
-            'edit_url': request.build_absolute_uri(reverse('registrations:edit_start', args=(registration.pk,))),
+            'house_rules_url': absolute_uri(reverse('core:house_rules')),
+            'edit_url': absolute_uri(reverse('registrations:edit_start', args=(registration.pk,))),
         }
         body = render_to_string('registrations/email/registration_confirmation.txt', context)
         subject = render_to_string('registrations/email/registration_confirmation_subject.txt', context).strip()
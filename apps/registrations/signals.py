@@ -0,0 +1,126 @@
+"""
+Signal handlers that bump the version counters in versions.py when relevant objects are saved or deleted.
+
+Note that these signals are not sent by QuerySet.update() and bulk operations, so code using those should call
+versions.registrations_changed() or versions.events_changed() itself.
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from apps.events.models import Event, Series
+from apps.people.models import Address, ArtaUser, EmergencyContact, MedicalDetails
+from arta.common.versions import bump_versions
+
+from . import versions
+from .models import (Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue,
+                     RegistrationPriceCorrection)
+from .services import OptionsFullService
+
+
+@receiver(post_save, sender=ArtaUser)
+@receiver(post_delete, sender=ArtaUser)
+def user_changed(sender, instance, **kwargs):
+    """ Bumps the version of a changed user. """
+    bump_versions([versions.user_version(instance.pk)])
+
+
+@receiver(m2m_changed, sender=ArtaUser.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Bumps the versions of users added to or removed from groups (which affects invitations). """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set is not None:
+        user_ids = pk_set
+    else:
+        # Clearing all users from a group
+        user_ids = instance.user_set.values_list('pk', flat=True)
+    bump_versions([versions.user_version(pk) for pk in user_ids])
+
+
+@receiver(post_save, sender=Address)
+@receiver(post_delete, sender=Address)
+@receiver(post_save, sender=MedicalDetails)
+@receiver(post_delete, sender=MedicalDetails)
+@receiver(post_save, sender=EmergencyContact)
+@receiver(post_delete, sender=EmergencyContact)
+def user_details_changed(sender, instance, **kwargs):
+    """ Bumps the version of the user whose (personal, medical or emergency contact) details changed. """
+    bump_versions([versions.user_version(instance.user_id)])
+
+
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+def registration_changed(sender, instance, signal, **kwargs):
+    """ Bumps the versions of a changed registration and its user. """
+    if signal is post_save:
+        versions.registration_saved(instance)
+    versions.registrations_changed([instance])
+
+
+@receiver(post_save, sender=RegistrationFieldValue)
+@receiver(post_delete, sender=RegistrationFieldValue)
+def registration_value_changed(sender, instance, **kwargs):
+    """ Bumps the version of the registration of a changed value. """
+    bump_versions([versions.registration_version(instance.registration_id)])
+
+
+@receiver(post_save, sender=RegistrationPriceCorrection)
+@receiver(post_delete, sender=RegistrationPriceCorrection)
+def registration_price_correction_changed(sender, instance, **kwargs):
+    """ Bumps the version of the registration of a changed price correction. """
+    bump_versions([versions.registration_version(instance.registration_id)])
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, instance, **kwargs):
+    """ Bumps the version of a changed event. """
+    versions.event_saved(instance)
+    versions.events_changed([instance.pk])
+
+
+@receiver(post_save, sender=Series)
+@receiver(post_delete, sender=Series)
+def series_changed(sender, instance, **kwargs):
+    """ Bumps the versions of the events of a changed series (which show its name, url and email). """
+    versions.events_changed(Event.objects.filter(series=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=RegistrationField)
+@receiver(post_delete, sender=RegistrationField)
+def registration_field_changed(sender, instance, signal, **kwargs):
+    """ Bumps the version of the event of a changed field, and updates its full flags. """
+    versions.events_changed([instance.event_id])
+    update_options_full(instance.event_id, signal)
+
+
+# This uses pre_delete, since the field might no longer exist after deleting (when the whole field or event is deleted)
+@receiver(post_save, sender=RegistrationFieldOption)
+@receiver(pre_delete, sender=RegistrationFieldOption)
+def registration_option_changed(sender, instance, **kwargs):
+    """ Bumps the version of the event of a changed option. """
+    versions.events_changed([instance.field.event_id])
+
+
+# The field was already loaded by the pre_delete handler above
+@receiver(post_save, sender=RegistrationFieldOption)
+@receiver(post_delete, sender=RegistrationFieldOption)
+def registration_option_full_changed(sender, instance, signal, **kwargs):
+    """ Updates the full flags of the event of a changed option (e.g. its full or invite_only flags). """
+    update_options_full(instance.field.event_id, signal)
+
+
+def update_options_full(event_id, signal):
+    """
+    Updates the full flags of the given event after a field or option was saved or deleted.
+
+    After deleting, this is postponed until commit, since this might be part of deleting the entire event, and the
+    flags for invite-only groups (which are deleted along with the event) should not be recreated halfway.
+    """
+    if signal is post_delete:
+        transaction.on_commit(lambda: OptionsFullService.update([event_id]))
+    else:
+        OptionsFullService.update([event_id])
@@ -7,6 +7,7 @@ from apps.people.tests.factories import ArtaUserFactory
 
 from ..models import (Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue,
                       RegistrationPriceCorrection)
+from ..services import UsedSlotsService
 
 
 class RegistrationFactory(factory.django.DjangoModelFactory):
@@ -42,6 +43,13 @@ class RegistrationFactory(factory.django.DjangoModelFactory):
     def inactive_options(obj, create, options, **kwargs):
         RegistrationFactory.options_helper(obj, create, options, active=None)
 
+    @factory.post_generation
+    def used_slots(obj, create, extracted, **kwargs):
+        # Registrations are created with their final status directly, so update the used_slots counters like
+        # finalization would (this must come after the options declarations above).
+        if create and obj.status.REGISTERED:
+            UsedSlotsService.registration_status_changed(obj, old_status=None)
+
     @staticmethod
     def options_helper(obj, create, options, active=True):
         if options:
@@ -0,0 +1,154 @@
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from reversion.models import Revision, Version
+
+from apps.events.models import Event
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+
+from ..models import Registration, RegistrationFieldOption, RegistrationFieldValue
+from ..services import RegistrationStatusService, UsedSlotsService
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class TestChangeStatuses(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True, slots=10)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", slots=2)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew")
+
+        cls.admin = ArtaUserFactory(is_superuser=True, is_staff=True)
+
+    def pending_helper(self, n, option=None, event=None):
+        return [
+            RegistrationFactory(event=event or self.event, pending=True, options=[option or self.crew])
+            for _i in range(n)
+        ]
+
+    def test_change_statuses(self):
+        """ Check that statuses, counters and full flags are updated. """
+        regs = self.pending_helper(2, option=self.player) + self.pending_helper(2)
+        changed = RegistrationStatusService.change_statuses(
+            Registration.objects.all(), Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+        self.assertEqual(changed, 4)
+
+        for reg in regs:
+            reg.refresh_from_db()
+            self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+        self.assertEqual(Event.objects.get(pk=self.event.pk).used_slots, 4)
+        self.assertFalse(Event.objects.get(pk=self.event.pk).full)
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.player.pk).full)
+        self.assertFalse(RegistrationFieldOption.objects.get(pk=self.crew.pk).full)
+
+    def test_multiple_events(self):
+        """ Check that registrations for different events can be changed together. """
+        other_event = EventFactory(registration_opens_in_days=-1, public=True, slots=1)
+        other_type = RegistrationFieldFactory(event=other_event, name="type")
+        other_option = RegistrationFieldOptionFactory(field=other_type, title="Other")
+        self.pending_helper(2)
+        self.pending_helper(1, option=other_option, event=other_event)
+
+        RegistrationStatusService.change_statuses(
+            Registration.objects.all(), Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+        self.assertEqual(UsedSlotsService.recount(other_event, fix=False), [])
+        self.assertFalse(Event.objects.get(pk=self.event.pk).full)
+        self.assertTrue(Event.objects.get(pk=other_event.pk).full)
+
+    def test_cancel_keeps_full(self):
+        """ Check that cancelling does not change counters or full flags (they are only used for REGISTERED). """
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(full=True)
+        self.pending_helper(2, option=self.player)
+        RegistrationStatusService.change_statuses(
+            Registration.objects.all(), Registration.statuses.PENDING, Registration.statuses.CANCELLED)
+        self.assertEqual(Registration.objects.filter(status=Registration.statuses.CANCELLED).count(), 2)
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.player.pk).full)
+
+    def test_invalid_status(self):
+        """ Check that nothing is changed when not all registrations have the old status. """
+        self.pending_helper(2)
+        RegistrationFactory(event=self.event, waiting_list=True, options=[self.crew])
+
+        with self.assertRaises(ValidationError):
+            RegistrationStatusService.change_statuses(
+                Registration.objects.all(), Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+        self.assertEqual(Registration.objects.filter(status=Registration.statuses.PENDING).count(), 2)
+        self.assertEqual(Event.objects.get(pk=self.event.pk).used_slots, 0)
+        self.assertFalse(Revision.objects.exists())
+
+    def test_invalid_change(self):
+        """ Check that only the allowed status changes can be made. """
+        reg = RegistrationFactory(event=self.event, registered=True, options=[self.crew])
+        with self.assertRaises(ValidationError):
+            RegistrationStatusService.change_statuses(
+                [reg], Registration.statuses.REGISTERED, Registration.statuses.PENDING)
+        reg.refresh_from_db()
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+
+    def test_single_revision(self):
+        """ Check that all changes (including options) end up in a single revision. """
+        regs = self.pending_helper(3)
+        RegistrationStatusService.change_statuses(
+            Registration.objects.all(), Registration.statuses.PENDING, Registration.statuses.WAITINGLIST,
+            user=self.admin, comment="Testing")
+
+        revision = Revision.objects.get()
+        self.assertEqual(revision.user, self.admin)
+        self.assertEqual(revision.comment, "Testing")
+        self.assertEqual(Version.objects.get_for_model(Registration).filter(revision=revision).count(), 3)
+        self.assertEqual(Version.objects.get_for_model(RegistrationFieldValue).filter(revision=revision).count(), 3)
+
+        # The version should contain the new status
+        version = Version.objects.get_for_object(regs[0]).get()
+        self.assertEqual(version.field_dict['status'], Registration.statuses.WAITINGLIST)
+
+    def test_num_queries(self):
+        """ Check that the number of queries does not depend on the number of registrations. """
+        def count_queries(regs):
+            with CaptureQueriesContext(connection) as queries:
+                RegistrationStatusService.change_statuses(
+                    Registration.objects.filter(pk__in=[r.pk for r in regs]),
+                    Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+            return len(queries)
+
+        self.assertEqual(count_queries(self.pending_helper(2)), count_queries(self.pending_helper(10)))
+
+    def test_queryset(self):
+        """ Check that a given queryset is only used to select pks, without evaluating its annotations. """
+        regs = self.pending_helper(2)
+        queryset = Registration.objects.with_payment_status().prefetch_active_options().order_by('-payment_status')
+        with CaptureQueriesContext(connection) as queries:
+            changed = RegistrationStatusService.change_statuses(
+                queryset, Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+        self.assertEqual(changed, 2)
+        self.assertFalse(any('payments_payment' in q['sql'] for q in queries))
+        for reg in regs:
+            reg.refresh_from_db()
+            self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+
+    def test_admin_action(self):
+        """ Check that the admin actions use the service, and report errors. """
+        regs = self.pending_helper(2)
+        self.client.force_login(self.admin)
+        url = reverse('admin:registrations_registration_changelist')
+        response = self.client.post(url, {
+            'action': 'PENDING_to_REGISTERED',
+            '_selected_action': [r.pk for r in regs],
+        })
+        self.assertRedirects(response, url)
+        self.assertEqual(Registration.objects.filter(status=Registration.statuses.REGISTERED).count(), 2)
+        self.assertEqual(Revision.objects.get().user, self.admin)
+
+        response = self.client.post(url, {
+            'action': 'PENDING_to_CANCELLED',
+            '_selected_action': [r.pk for r in regs],
+        }, follow=True)
+        self.assertContains(response, 'Not all selected registrations in PENDING state')
+        self.assertEqual(Registration.objects.filter(status=Registration.statuses.REGISTERED).count(), 2)
@@ -0,0 +1,81 @@
+from django.test import TestCase
+
+from apps.events.tests.factories import EventFactory
+from apps.payments.tests.factories import PaymentFactory
+
+from ..report import EventReport
+from ..schema import EventSchema
+from .factories import (RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory,
+                        RegistrationPriceCorrectionFactory)
+
+
+class TestEventReport(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", price=10)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew")
+        cls.extra = RegistrationFieldFactory(event=cls.event, name="extra")
+        cls.meal = RegistrationFieldOptionFactory(field=cls.extra, title="Meal", price=5)
+
+    def make_registrations(self):
+        """ Makes registrations in various states, returns those with a correction that is listed. """
+        event = self.event
+        paid = RegistrationFactory(event=event, registered=True, options=[self.player, self.meal])
+        PaymentFactory(registration=paid, amount=15, completed=True)
+
+        refundable = RegistrationFactory(event=event, registered=True, options=[self.player])
+        discount = RegistrationPriceCorrectionFactory(registration=refundable, price=-3)
+        RegistrationPriceCorrectionFactory(registration=refundable, price=2, when_cancelled=True)
+        PaymentFactory(registration=refundable, amount=10, completed=True)
+
+        RegistrationFactory(event=event, registered=True, options=[self.crew])
+
+        cancelled = RegistrationFactory(event=event, cancelled=True, options=[self.player])
+        fee = RegistrationPriceCorrectionFactory(registration=cancelled, price=5, when_cancelled=True)
+
+        RegistrationFactory(event=event, waiting_list=True, options=[self.player])
+        other_event = EventFactory()
+        other_option = RegistrationFieldOptionFactory(field=RegistrationFieldFactory(event=other_event), price=10)
+        RegistrationFactory(event=other_event, registered=True, options=[other_option])
+
+        partial = RegistrationFactory(event=event, registered=True, options=[self.player])
+        PaymentFactory(registration=partial, amount=4, completed=True)
+        PaymentFactory(registration=partial, amount=6, pending=True)
+
+        return [(refundable, discount), (cancelled, fee)]
+
+    def test_totals(self):
+        """ Check the totals for registered and cancelled registrations (ignoring other statuses and events). """
+        corrections = self.make_registrations()
+        report = EventReport.for_event(self.event)
+
+        self.assertEqual(report.option_counts, {self.player: 3, self.crew: 1, self.meal: 1})
+        self.assertEqual(report.options_sum, 35)
+        self.assertEqual(report.corrections, corrections)
+        self.assertEqual(report.corrections_sum, 2)
+        self.assertEqual(report.price_check, 37)
+        self.assertEqual(report.price_sum, 37)
+        self.assertEqual(report.paid_sum, 29)
+        self.assertEqual(report.payable, 11)
+        self.assertEqual(report.refundable, 3)
+
+    def test_empty(self):
+        """ Check the totals without registrations. """
+        report = EventReport.for_event(self.event)
+        self.assertEqual(report.option_counts, {self.player: 0, self.crew: 0, self.meal: 0})
+        totals = (report.price_sum, report.paid_sum, report.payable, report.refundable, report.price_check)
+        self.assertEqual(totals, (0, 0, 0, 0, 0))
+
+    def test_queries(self):
+        """ Check that the number of queries does not depend on the number of registrations. """
+        self.make_registrations()
+        EventSchema.for_event(self.event)
+        with self.assertNumQueries(4):
+            EventReport.for_event(self.event)
+
+        self.make_registrations()
+        EventSchema.for_event(self.event)
+        with self.assertNumQueries(4):
+            EventReport.for_event(self.event)
@@ -0,0 +1,161 @@
+import io
+import smtplib
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+
+from ..models import FinalizeRequest, Registration
+from ..services import RegistrationNotifyService, RegistrationStatusService
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+@override_settings(REGISTRATION_FINALIZE_QUEUE=True)
+class TestFinalizeQueue(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", slots=1)
+
+    def setUp(self):
+        self.user = ArtaUserFactory()
+        self.client.force_login(self.user)
+
+    def finalize_helper(self, user=None):
+        """ Creates a registration and submits the final check for it, returns the registration. """
+        if user is None:
+            user = self.user
+        self.client.force_login(user)
+        reg = RegistrationFactory(event=self.event, user=user, preparation_complete=True, options=[self.player])
+
+        response = self.client.post(reverse('registrations:step_final_check', args=(reg.pk,)), {'agree': 1})
+        self.assertRedirects(response, reverse('registrations:finalize_processing', args=(reg.pk,)))
+        return reg
+
+    def test_final_check_queues(self):
+        """ Check that the final check only queues the registration, and that processing redirects afterwards. """
+        reg = self.finalize_helper()
+
+        reg.refresh_from_db()
+        self.assertEqual(reg.status, Registration.statuses.PREPARATION_COMPLETE)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(reg.finalize_request.base_url, 'http://testserver/')
+
+        processing_url = reverse('registrations:finalize_processing', args=(reg.pk,))
+        response = self.client.get(processing_url)
+        self.assertTemplateUsed(response, 'registrations/finalize_processing.html')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        self.assertEqual(RegistrationStatusService.process_finalize_queue(self.event), 1)
+        reg.refresh_from_db()
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertFalse(FinalizeRequest.objects.filter(registration=reg).exists())
+
+        response = self.client.get(processing_url)
+        self.assertRedirects(response, reverse('registrations:registration_confirmation', args=(reg.pk,)))
+
+    def test_queue_order(self):
+        """ Check that the queue is processed in order of arrival, so the first registration gets the last slot. """
+        first = self.finalize_helper()
+        second = self.finalize_helper(user=ArtaUserFactory())
+
+        # Submitting again should not lose the original place in the queue
+        self.client.force_login(self.user)
+        self.client.post(reverse('registrations:step_final_check', args=(first.pk,)), {'agree': 1})
+        self.assertEqual(list(FinalizeRequest.objects.queued_for(self.event)),
+                         [first.finalize_request, second.finalize_request])
+
+        call_command('process_finalize_queue', self.event.pk, '--once', stdout=io.StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, Registration.statuses.REGISTERED)
+        self.assertEqual(second.status, Registration.statuses.WAITINGLIST)
+        self.assertFalse(FinalizeRequest.objects.queued_for(self.event).exists())
+
+    def test_failed_finalize(self):
+        """ Check that a failed finalization is reported to the user and can be retried. """
+        reg = self.finalize_helper()
+
+        # Let processing fail by changing the status behind its back
+        reg.status = Registration.statuses.PREPARATION_IN_PROGRESS
+        reg.save()
+        RegistrationStatusService.process_finalize_queue(self.event)
+        reg.finalize_request.refresh_from_db()
+        self.assertNotEqual(reg.finalize_request.error, '')
+        reg.status = Registration.statuses.PREPARATION_COMPLETE
+        reg.save()
+
+        # Loading the processing page (again) must not lose the result
+        final_check_url = reverse('registrations:step_final_check', args=(reg.pk,))
+        for _i in range(2):
+            response = self.client.get(reverse('registrations:finalize_processing', args=(reg.pk,)), follow=True)
+            self.assertRedirects(response, final_check_url)
+            self.assertContains(response, 'Could not complete registration')
+        self.assertTrue(FinalizeRequest.objects.filter(registration=reg).exclude(processed_at=None).exists())
+
+        # And retry
+        response = self.client.post(final_check_url, {'agree': 1})
+        self.assertRedirects(response, reverse('registrations:finalize_processing', args=(reg.pk,)))
+        RegistrationStatusService.process_finalize_queue(self.event)
+        reg.refresh_from_db()
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+
+    def test_email_failure(self):
+        """ Check that failing to send a confirmation e-mail is logged, and does not prevent sending the others. """
+        first = self.finalize_helper()
+        second = self.finalize_helper(user=ArtaUserFactory())
+
+        with mock.patch.object(
+            RegistrationNotifyService, 'send_confirmation_email', side_effect=[smtplib.SMTPException("down"), None],
+        ) as send_confirmation_email:
+            with self.assertLogs('apps.registrations.services', 'ERROR') as logs:
+                self.assertEqual(RegistrationStatusService.process_finalize_queue(self.event), 2)
+        self.assertEqual(send_confirmation_email.call_count, 2)
+        self.assertIn(str(first.pk), logs.output[0])
+        self.assertFalse(FinalizeRequest.objects.queued_for(self.event).exists())
+        second.refresh_from_db()
+        self.assertEqual(second.status, Registration.statuses.WAITINGLIST)
+
+    @mock.patch('time.sleep')
+    def test_command_error(self, sleep):
+        """ Check that the command logs unexpected errors and keeps processing the queue. """
+        reg = self.finalize_helper()
+        process_finalize_queue = RegistrationStatusService.process_finalize_queue
+        calls = []
+
+        def fail_once(event, batch_size):
+            # Fail once, then process normally, then stop the (otherwise endless) loop
+            calls.append(event)
+            if len(calls) == 1:
+                raise DatabaseError("gone")
+            if len(calls) == 2:
+                return process_finalize_queue(event, batch_size)
+            raise KeyboardInterrupt
+
+        with mock.patch.object(RegistrationStatusService, 'process_finalize_queue', side_effect=fail_once):
+            with self.assertLogs('apps.registrations', 'ERROR'), self.assertRaises(KeyboardInterrupt):
+                call_command('process_finalize_queue', self.event.pk, stdout=io.StringIO())
+        reg.refresh_from_db()
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+
+    def test_processing_without_request(self):
+        """ Check that the processing page redirects to the final check when nothing was queued. """
+        reg = RegistrationFactory(event=self.event, user=self.user, preparation_complete=True, options=[self.player])
+        response = self.client.get(reverse('registrations:finalize_processing', args=(reg.pk,)))
+        self.assertRedirects(response, reverse('registrations:step_final_check', args=(reg.pk,)))
+
+    def test_processing_other_user(self):
+        """ Check that the processing page of other users cannot be accessed. """
+        reg = RegistrationFactory(event=self.event, preparation_complete=True, options=[self.player])
+        response = self.client.get(reverse('registrations:finalize_processing', args=(reg.pk,)))
+        self.assertEqual(response.status_code, 404)
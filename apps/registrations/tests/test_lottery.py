@@ -0,0 +1,135 @@
+import io
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from reversion.models import Revision, Version
+
+from apps.events.models import Event
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+
+from ..models import Registration, RegistrationFieldOption, RegistrationFieldValue
+from ..services import LotteryService, UsedSlotsService
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class Rollback(Exception):
+    pass
+
+
+class TestLotteryService(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True, admit_immediately=False, slots=8)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", slots=3)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew")
+
+        cls.players = [
+            RegistrationFactory(event=cls.event, pending=True, options=[cls.player]) for _i in range(5)
+        ]
+        cls.crews = [
+            RegistrationFactory(event=cls.event, pending=True, options=[cls.crew]) for _i in range(5)
+        ]
+        cls.admin = ArtaUserFactory(is_superuser=True)
+
+    def draw_helper(self, seed):
+        """ Draws with the given seed and returns the resulting statuses by registration pk, then rolls back. """
+        try:
+            with transaction.atomic():
+                result = LotteryService.draw(self.event, seed=seed)
+                self.assertEqual(result.seed, seed)
+                statuses = dict(Registration.objects.filter(event=self.event).values_list('pk', 'status'))
+                raise Rollback()
+        except Rollback:
+            return statuses
+
+    def test_slots(self):
+        """ Check that event and option slots are honoured. """
+        # Only 3 players can be admitted, so all crew fit in the event slots
+        result = LotteryService.draw(self.event, seed=1)
+        self.assertEqual((result.registered, result.waitinglist), (8, 2))
+
+        registered = Registration.objects.filter(status=Registration.statuses.REGISTERED)
+        self.assertEqual(registered.count(), 8)
+        self.assertEqual(registered.filter(options__option=self.player).count(), 3)
+        self.assertEqual(Registration.objects.filter(status=Registration.statuses.WAITINGLIST).count(), 2)
+        self.assertFalse(Registration.objects.filter(status=Registration.statuses.PENDING).exists())
+
+        # Used slots and full flags should be updated
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+        self.assertTrue(Event.objects.get(pk=self.event.pk).full)
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.player.pk).full)
+        self.assertFalse(RegistrationFieldOption.objects.get(pk=self.crew.pk).full)
+
+    def test_existing_registrations(self):
+        """ Check that slots already used by registered registrations, and full flags are taken into account. """
+        RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        self.crew.full = True
+        self.crew.save()
+
+        result = LotteryService.draw(self.event, seed=1)
+        self.assertEqual((result.registered, result.waitinglist), (1, 9))
+        self.assertEqual(Event.objects.get(pk=self.event.pk).used_slots, 3)
+
+    def test_reproducible(self):
+        """ Check that the same seed produces the same result, and a different seed (probably) a different one. """
+        first = self.draw_helper(seed=1234)
+        self.assertEqual(self.draw_helper(seed=1234), first)
+        self.assertNotEqual([self.draw_helper(seed=seed) for seed in range(5)], [first] * 5)
+
+    def test_waitinglist_order(self):
+        """ Check that the waiting list has a well-defined order. """
+        LotteryService.draw(self.event, seed=1)
+        waiting = list(Registration.objects.filter(status=Registration.statuses.WAITINGLIST).order_by('registered_at'))
+        self.assertEqual([r.waitinglist_above for r in waiting], list(range(len(waiting))))
+
+    def test_single_revision(self):
+        """ Check that all changes end up in a single revision. """
+        LotteryService.draw(self.event, seed=1, user=self.admin)
+        revision = Revision.objects.get()
+        self.assertEqual(revision.user, self.admin)
+        self.assertIn('seed 1', revision.comment)
+        self.assertEqual(
+            Version.objects.get_for_model(Registration).filter(revision=revision).count(),
+            len(self.players) + len(self.crews),
+        )
+        self.assertEqual(
+            Version.objects.get_for_model(RegistrationFieldValue).filter(revision=revision).count(),
+            len(self.players) + len(self.crews),
+        )
+
+    def test_query_count(self):
+        """ Check that the number of queries does not depend on the number of registrations. """
+        # Without slots, nothing becomes full (which needs a few more queries)
+        Event.objects.filter(pk=self.event.pk).update(slots=None)
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(slots=None)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                try:
+                    with transaction.atomic():
+                        LotteryService.draw(self.event, seed=1, user=self.admin)
+                        raise Rollback()
+                except Rollback:
+                    pass
+            return len(queries)
+
+        num_queries = count_queries()
+        for _i in range(10):
+            RegistrationFactory(event=self.event, pending=True, options=[self.crew])
+        self.assertEqual(count_queries(), num_queries)
+
+    def test_random_seed(self):
+        """ Check that a seed is generated when none is given. """
+        result = LotteryService.draw(self.event)
+        self.assertIsNotNone(result.seed)
+
+    def test_command(self):
+        """ Check the run_lottery management command. """
+        out = io.StringIO()
+        call_command('run_lottery', self.event.pk, '--seed', '42', stdout=out)
+        self.assertIn('seed 42: 8 registered, 2 on waiting list', out.getvalue())
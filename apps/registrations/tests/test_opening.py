@@ -0,0 +1,169 @@
+import asyncio
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.core.tests.test_asgi import run_async
+from apps.events.models import Event
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+
+from .. import versions
+from ..opening import OpeningBroadcaster, OpeningStreamApp, opening_status
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class TestOpeningStatus(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(
+            registration_opens_in_days=1, invitee_registration_opens_in_days=-1, starts_in_days=7, public=True,
+        )
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player")
+
+    def setUp(self):
+        # Cached data could be left by (rolled back) changes in other tests
+        cache.clear()
+
+    def test_status(self):
+        """ Check the opening status before and after opening, and when options change. """
+        now = timezone.now()
+        opens_at = self.event.public_registration_opens_at
+        status = opening_status(self.event.pk, now=now)
+        self.assertEqual(status.opened, (False, True))
+        self.assertAlmostEqual(status.changes_in, (opens_at - now).total_seconds())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(opening_status(self.event.pk, now=now).key, status.key)
+            opened = opening_status(self.event.pk, now=opens_at)
+        self.assertEqual(opened.opened, (True, True))
+        self.assertEqual(opened.changes_in, (self.event.phases.closes_at - opens_at).total_seconds())
+        self.assertNotEqual(opened.key, status.key)
+
+        closed = opening_status(self.event.pk, now=self.event.phases.closes_at)
+        self.assertEqual(closed.phase, (True, True, True))
+        self.assertIsNone(closed.changes_in)
+        self.assertNotEqual(closed.key, opened.key)
+
+        self.player.full = True
+        self.player.save()
+        self.assertNotEqual(opening_status(self.event.pk, now=now).key, status.key)
+
+    def test_event_changed(self):
+        """ Check that changing the opening timestamps is noticed. """
+        status = opening_status(self.event.pk)
+        event = Event.objects.get(pk=self.event.pk)
+        event.public_registration_opens_at = timezone.now() - timedelta(minutes=1)
+        event.save()
+        self.assertEqual(opening_status(self.event.pk).opened, (True, True))
+        self.assertNotEqual(opening_status(self.event.pk).key, status.key)
+
+    def test_views(self):
+        """ Check the WSGI status and stream views. """
+        response = self.client.get(reverse('registrations:opening_status', args=(self.event.pk,)))
+        self.assertEqual(response.json()['key'], opening_status(self.event.pk).key)
+
+        response = self.client.get(reverse('registrations:opening_stream', args=(self.event.pk,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        lines = response.content.decode().splitlines()
+        # Reconnect after the poll interval (since opening is later)
+        self.assertEqual(lines[0], 'retry: 5000')
+        self.assertEqual(json.loads(lines[1][len('data: '):])['key'], opening_status(self.event.pk).key)
+
+    def test_final_check(self):
+        """ Check that the final check page subscribes to the stream before opening. """
+        user = ArtaUserFactory()
+        reg = RegistrationFactory(event=self.event, user=user, preparation_complete=True, options=[self.player])
+        self.client.force_login(user)
+        response = self.client.get(reverse('registrations:step_final_check', args=(reg.pk,)))
+        self.assertContains(response, 'data-opening-key="{}"'.format(opening_status(self.event.pk).key))
+
+
+class TestOpeningStreamApp(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=1, public=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def run_app(self, path, messages, broadcaster=None):
+        """
+        Runs a request for the given path and returns the messages sent.
+
+        For each of the given functions, this waits for a response message and then calls it, before returning an
+        empty request message to the app. After that, a http.disconnect message is returned.
+        """
+        # Make sure the status is cached, the event does not exist for other threads (outside the test transaction)
+        opening_status(self.event.pk)
+
+        app = OpeningStreamApp(broadcaster=broadcaster or OpeningBroadcaster(poll_interval=0.01))
+        sent = []
+        pending = list(messages)
+
+        async def run():
+            received = asyncio.Event()
+
+            async def receive():
+                await received.wait()
+                received.clear()
+                if pending:
+                    pending.pop(0)()
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                received.set()
+
+            await asyncio.wait_for(app({'type': 'http', 'method': 'GET', 'path': path}, receive, send), timeout=5)
+            return app
+
+        run_async(run())
+        return sent
+
+    def test_stream(self):
+        """ Check that the current status and changes are pushed to the client. """
+        url = reverse('registrations:opening_stream', args=(self.event.pk,))
+        broadcaster = OpeningBroadcaster(poll_interval=0.01)
+        sent = self.run_app(url, [
+            lambda: None,
+            lambda: versions.events_changed([self.event.pk]),
+        ], broadcaster=broadcaster)
+
+        self.assertEqual(sent[0]['status'], 200)
+        bodies = [m['body'].decode() for m in sent[1:]]
+        keys = [json.loads(b[len('data: '):])['key'] for b in bodies]
+        self.assertEqual(len(keys), 2)
+        self.assertNotEqual(keys[0], keys[1])
+        self.assertEqual(keys[1], opening_status(self.event.pk).key)
+        # Everything should be cleaned up after the client disconnects
+        self.assertEqual(broadcaster.tasks, {})
+        self.assertEqual(broadcaster.subscribers, {})
+
+    def test_status_error(self):
+        """ Check that the broadcaster keeps checking the status after an error. """
+        url = reverse('registrations:opening_stream', args=(self.event.pk,))
+        failures = [RuntimeError("Cache unavailable")]
+
+        def status_func(event_id):
+            if failures:
+                raise failures.pop()
+            return opening_status(event_id)
+
+        with self.assertLogs('apps.registrations.opening', 'ERROR'):
+            broadcaster = OpeningBroadcaster(poll_interval=0.01, status_func=status_func)
+            sent = self.run_app(url, [lambda: None], broadcaster=broadcaster)
+        self.assertEqual(sent[0]['status'], 200)
+        data = json.loads(sent[1]['body'].decode()[len('data: '):])
+        self.assertEqual(data['key'], opening_status(self.event.pk).key)
+
+    def test_not_found(self):
+        """ Check that other URLs are not served. """
+        sent = self.run_app(reverse('registrations:opening_status', args=(self.event.pk,)), [])
+        self.assertEqual(sent[0]['status'], 404)
@@ -0,0 +1,110 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from apps.events.models import Event, EventGroupFullness
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory, GroupFactory
+
+from ..models import Registration, RegistrationFieldOption
+from ..services import OptionsFullService, RegistrationStatusService
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class TestOptionsFull(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True)
+        cls.group = GroupFactory()
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", slots=1)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew", invite_only=cls.group)
+
+    def assertFlags(self, options_full, group_full):
+        """ Checks the maintained flags (and that they match recomputing them). """
+        for _i in range(2):
+            self.assertEqual(Event.objects.get(pk=self.event.pk).options_full, options_full)
+            self.assertEqual(dict(self.event.group_fullness.values_list('group', 'options_full')), group_full)
+            OptionsFullService.update([self.event.pk])
+
+    def test_option_changes(self):
+        """ Check that the flags follow changes to options. """
+        self.assertFlags(False, {self.group.pk: False})
+
+        player = RegistrationFieldOption.objects.get(pk=self.player.pk)
+        player.full = True
+        player.save()
+        self.assertFlags(True, {self.group.pk: False})
+
+        crew = RegistrationFieldOption.objects.get(pk=self.crew.pk)
+        crew.invite_only = None
+        crew.save()
+        self.assertFlags(False, {})
+
+    def test_dependencies(self):
+        """ Check that options and fields depending on unavailable options are taken into account. """
+        RegistrationFieldOption.objects.filter(pk=self.crew.pk).update(invite_only=None)
+        gender = RegistrationFieldFactory(event=self.event, name="gender", depends=self.player)
+        RegistrationFieldOptionFactory(field=gender, title="M", full=True)
+        self.assertFlags(True, {})
+
+        RegistrationFieldOptionFactory(field=gender, title="F", depends=self.crew)
+        self.assertFlags(False, {})
+
+        # Depends on a full option, so not available either
+        crew = RegistrationFieldOption.objects.get(pk=self.crew.pk)
+        crew.full = True
+        crew.save()
+        self.assertFlags(True, {})
+
+        # Field depends on a full option, so it is ignored
+        gender.depends = crew
+        gender.save()
+        self.assertFlags(False, {})
+
+    def test_finalize(self):
+        """ Check that taking the last slot on finalizing updates the flags. """
+        reg = RegistrationFactory(event=self.event, preparation_complete=True, options=[self.player])
+        RegistrationStatusService.finalize_registration(reg)
+        self.assertFlags(True, {self.group.pk: False})
+
+    def test_change_statuses(self):
+        """ Check that taking the last slot through bulk status changes updates the flags. """
+        RegistrationFactory(event=self.event, pending=True, options=[self.player])
+        RegistrationStatusService.change_statuses(
+            Registration.objects.all(), Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+        self.assertFlags(True, {self.group.pk: False})
+
+    def test_for_user(self):
+        """ Check that for_user uses the flags, without looking at fields or options. """
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(full=True)
+        OptionsFullService.update([self.event.pk])
+        member = ArtaUserFactory()
+        self.group.user_set.add(member)
+
+        for (user, is_full) in ((ArtaUserFactory(), True), (member, False)):
+            with self.subTest(user=user), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(Event.objects.for_user(user).get(pk=self.event.pk).is_full, is_full)
+            self.assertNotIn('registrations_registrationfield', queries[-1]['sql'])
+
+    def test_for_user_combined_groups(self):
+        """ Check that for_user handles options that are only available to users in multiple groups. """
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(full=True)
+        other_group = GroupFactory()
+        role = RegistrationFieldFactory(event=self.event, name="role", depends=self.crew)
+        RegistrationFieldOptionFactory(field=role, title="Medic", invite_only=other_group)
+        OptionsFullService.update([self.event.pk])
+        self.assertFlags(True, {self.group.pk: True, other_group.pk: True})
+
+        (member, other_member, both_member) = ArtaUserFactory.create_batch(3)
+        self.group.user_set.add(member, both_member)
+        other_group.user_set.add(other_member, both_member)
+        for (user, is_full) in ((member, True), (other_member, True), (both_member, False)):
+            with self.subTest(user=user):
+                self.assertEqual(Event.objects.for_user(user).get(pk=self.event.pk).is_full, is_full)
+
+    def test_delete_event(self):
+        """ Check that deleting an event (and its fields and options) works. """
+        self.assertTrue(EventGroupFullness.objects.exists())
+        Event.objects.get(pk=self.event.pk).delete()
+        self.assertFalse(EventGroupFullness.objects.exists())
@@ -96,6 +96,8 @@ class TestSatisfiesRequiredAnnotation(TestCase):
                 value_obj = RegistrationFieldValueFactory(field=field, registration=reg, value=value)
                 with_satisfies = RegistrationFieldValue.objects.with_satisfies_required().get(pk=value_obj.pk)
                 self.assertEqual(with_satisfies.satisfies_required, satisfies)
+                # The in-memory version should agree
+                self.assertEqual(with_satisfies.check_satisfies_required(), satisfies)
             field.delete()
 
 
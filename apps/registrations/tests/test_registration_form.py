@@ -9,11 +9,14 @@ from unittest import mock, skip
 
 from django.conf import settings
 from django.core import mail
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import ugettext as _
 from parameterized import parameterized
+from reversion.models import Revision, Version
 from with_asserts.mixin import AssertHTMLMixin
 
 from apps.events.models import Event
@@ -22,7 +25,7 @@ from apps.people.models import Address, EmergencyContact, MedicalDetails
 from apps.people.tests.factories import ArtaUserFactory, GroupFactory
 
 from ..models import Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue
-from ..services import RegistrationStatusService
+from ..services import RegistrationStatusService, UsedSlotsService
 from ..views import FinalCheck
 from .factories import (RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory,
                         RegistrationFieldValueFactory)
@@ -666,6 +669,9 @@ class TestRegistrationForm(TestCase, AssertHTMLMixin):
         if history is not None:
             self.inactive_options_helper(reg, history, values)
 
+        # Changing options of a registered registration should update the used slots
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+
         form_response = self.client.get(form_url)
         for value in values:
             self.check_field_rendered_helper(form_response, value, readonly=(value.field in readonly_fields))
@@ -860,6 +866,7 @@ class TestRegistrationForm(TestCase, AssertHTMLMixin):
         type_value.active = None
         type_value.save()
         RegistrationFieldValueFactory(registration=reg, option=self.crew)
+        UsedSlotsService.registration_options_changed(reg, [self.player.pk], [self.crew.pk])
 
         # Then try to set all depends values
         data.update({
@@ -1373,3 +1380,68 @@ class TestRegistrationForm(TestCase, AssertHTMLMixin):
         with self.subTest(msg="Should set status"):
             reg.refresh_from_db()
             self.assertTrue(reg.status.REGISTERED)
+
+
+class TestRegistrationOptionsSave(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True, allow_change_days=1)
+        cls.fields = [
+            RegistrationFieldFactory(event=cls.event, name="field{}".format(i), allow_change_days=1) for i in range(10)
+        ]
+        cls.options = [
+            [RegistrationFieldOptionFactory(field=field, title=title) for title in ("A", "B")]
+            for field in cls.fields
+        ]
+
+    def setUp(self):
+        self.user = ArtaUserFactory()
+        self.client.force_login(self.user)
+
+    def post_options(self, reg, choice, num_fields):
+        url = reverse('registrations:step_registration_options', args=(reg.pk,))
+        data = {
+            field.name: options[choice if i < num_fields else 0].pk
+            for i, (field, options) in enumerate(zip(self.fields, self.options))
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_num_queries(self):
+        """ Check that the number of queries does not depend on the number of changed fields. """
+        reg = RegistrationFactory(event=self.event, user=self.user, registered=True,
+                                  options=[options[0] for options in self.options])
+        one_changed = self.post_options(reg, 1, 1)
+        reg_all = RegistrationFactory(event=self.event, user=ArtaUserFactory(), registered=True,
+                                      options=[options[0] for options in self.options])
+        self.client.force_login(reg_all.user)
+        self.assertEqual(self.post_options(reg_all, 1, 10), one_changed)
+
+    def test_changes(self):
+        """ Check that values are replaced (keeping history) and end up in a single revision. """
+        reg = RegistrationFactory(event=self.event, user=self.user, registered=True,
+                                  options=[options[0] for options in self.options])
+        self.post_options(reg, 1, 3)
+
+        values = RegistrationFieldValue.objects.filter(registration=reg)
+        self.assertEqual(values.filter(active=True).count(), 10)
+        self.assertEqual(values.filter(active=None).count(), 3)
+        self.assertEqual(
+            [v.option for v in values.filter(active=True).order_by('field__order', 'field__pk')[:4]],
+            [self.options[0][1], self.options[1][1], self.options[2][1], self.options[3][0]],
+        )
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+
+        revision = Revision.objects.get()
+        self.assertEqual(Version.objects.get_for_model(RegistrationFieldValue).filter(revision=revision).count(), 13)
+
+    def test_draft(self):
+        """ Check that values of draft registrations are just replaced. """
+        reg = RegistrationFactory(event=self.event, user=self.user, preparation_in_progress=True,
+                                  options=[options[0] for options in self.options])
+        self.post_options(reg, 1, 3)
+        values = RegistrationFieldValue.objects.filter(registration=reg)
+        self.assertEqual(values.count(), 10)
+        self.assertEqual(values.filter(option__title="B").count(), 3)
@@ -436,9 +436,39 @@ class TestWaitinglistAboveProperty(TestCase):
 
     def check_order_helper(self, regs):
         """ Check that the waiting list order, as implied by waiting_list_above, matches the given iterable """
+        regs = list(regs)
         aboves = [reg.waitinglist_above for reg in regs]
         self.assertListEqual(aboves, list(range(len(aboves))))
 
+        # The annotation should produce the same, also for a single registration (without window function)
+        for window in (True, False):
+            with self.subTest(window=window):
+                positions = dict(
+                    Registration.objects.filter(event=self.event).with_waitinglist_position(window=window)
+                    .values_list('pk', 'waitinglist_position'),
+                )
+                self.assertListEqual([positions.pop(reg.pk) for reg in regs], aboves)
+                # Other registrations are not on the waiting list
+                self.assertEqual(set(positions.values()), set() if not positions else {None})
+        self.assertListEqual([
+            Registration.objects.filter(pk=reg.pk).with_waitinglist_position().get().waitinglist_position
+            for reg in regs
+        ], aboves)
+
+    def test_with_other_event(self):
+        """ Test that waitinglist registrations for other events are not counted """
+        other_event = EventFactory(registration_opens_in_days=-1, public=True, slots=0)
+        regs = []
+        for _i in range(3):
+            RegistrationFactory(event=other_event, status=Registration.statuses.WAITINGLIST)
+            regs.append(RegistrationFactory(event=self.event, status=Registration.statuses.WAITINGLIST))
+        self.check_order_helper(regs)
+
+        positions = Registration.objects.with_waitinglist_position(window=True).values_list(
+            'event', 'waitinglist_position')
+        self.assertEqual(sorted(positions), sorted([(self.event.pk, i) for i in range(3)]
+                                                   + [(other_event.pk, i) for i in range(3)]))
+
     def test_in_order(self):
         """ Test waitinglist registrations only, made in order """
         regs = [RegistrationFactory(event=self.event, status=Registration.statuses.WAITINGLIST) for i in range(5)]
@@ -13,6 +13,7 @@ from apps.people.models import ArtaUser
 from apps.people.tests.factories import AddressFactory, EmergencyContactFactory, GroupFactory
 
 from ..models import Registration, RegistrationField, RegistrationFieldOption, RegistrationFieldValue
+from ..schema import EventSchema
 from ..services import RegistrationStatusService
 from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
 
@@ -54,7 +55,7 @@ class TestRegistrationStatusService(TestCase):
 
     def incomplete_registration_helper(
         self, empty_field=None, with_emergency_contact=True, with_address=True, options=True,
-        exception=ValidationError, inactive_options=(), group=None,
+        exception=ValidationError, inactive_options=(), group=None, message=None,
     ):
         if options is True:
             options = self.default_options
@@ -76,7 +77,10 @@ class TestRegistrationStatusService(TestCase):
             setattr(reg.user, empty_field, '')
             reg.user.save()
 
-        if exception:
+        if exception and message:
+            with self.assertRaisesMessage(exception, message):
+                RegistrationStatusService.preparation_completed(reg)
+        elif exception:
             with self.assertRaises(exception):
                 RegistrationStatusService.preparation_completed(reg)
         else:
@@ -160,6 +164,36 @@ class TestRegistrationStatusService(TestCase):
         """ Check that a complete registration can be completed """
         self.incomplete_registration_helper(exception=None)
 
+    def test_error_messages(self):
+        """ Check that the errors list the offending fields """
+        self.incomplete_registration_helper(
+            options=[self.player], message="Missing registration options: gender, nights")
+        self.incomplete_registration_helper(
+            options=[self.player, self.option_f, self.option_nl, self.two_nights],
+            message="Unavailable registration options: nights")
+        self.incomplete_registration_helper(
+            options=[self.crew, self.option_m, self.one_night], message="Extra registration options: gender")
+
+    def test_preparation_completed_queries(self):
+        """ Check that the number of queries does not depend on the number of fields """
+        def count_queries():
+            reg = RegistrationFactory(event=self.event, preparation_in_progress=True, options=self.default_options)
+            EmergencyContactFactory(user=reg.user)
+            AddressFactory(user=reg.user)
+            reg = Registration.objects.get(pk=reg.pk)
+            # Make sure the event schema is cached
+            EventSchema.for_event(self.event)
+            with CaptureQueriesContext(connection) as queries:
+                RegistrationStatusService.preparation_completed(reg)
+            self.assertEqual(reg.status, Registration.statuses.PREPARATION_COMPLETE)
+            return len(queries)
+
+        num_queries = count_queries()
+        for i in range(5):
+            field = RegistrationFieldFactory(event=self.event, name="extra{}".format(i), required=False)
+            RegistrationFieldOptionFactory(field=field, title="Extra", depends=self.player)
+        self.assertEqual(count_queries(), num_queries)
+
     def test_required_value(self):
         """ Check accepted values for a required field. """
 
@@ -484,13 +518,10 @@ class TestRegistrationStatusService(TestCase):
         e = self.event
 
         for _i in range(2):
-            reg = RegistrationFactory(
+            RegistrationFactory(
                 event=e, registered=True,
-                options=[self.player, self.option_m, self.option_nl],
+                inactive_options=[self.player, self.option_m, self.option_nl],
             )
-            for o in reg.options.all():
-                o.active = None
-                o.save()
 
         reg = RegistrationFactory(
             event=e, preparation_complete=True,
@@ -523,6 +554,10 @@ class TestRegistrationStatusService(TestCase):
 
     @skipUnlessDBFeature('has_select_for_update')
     def test_finalize_locks(self):
+        e = Event.objects.get(pk=self.event.pk)
+        e.slots = 10
+        e.save()
+
         reg = RegistrationFactory(
             event=self.event, preparation_complete=True,
             options=[self.player, self.option_m, self.option_nl],
@@ -530,8 +565,8 @@ class TestRegistrationStatusService(TestCase):
         with CaptureQueriesContext(connection) as queries:
             RegistrationStatusService.finalize_registration(reg)
         with self.subTest("Must use SAVEPOINT"):
-            # This ensures a transaction is started
-            self.assertRegex(queries[0]["sql"], "^SAVEPOINT ")
+            # This ensures a transaction is started (after checking whether the event has slots)
+            self.assertRegex(queries[1]["sql"], "^SAVEPOINT ")
         with self.subTest("Must lock event"):
             # This ensures that FOR UPDATE is used and that *only* the event is locked (i.e. no joins)
             match = ' FROM {table} WHERE {table}.{id_field} = {id} FOR UPDATE$'.format(
@@ -539,7 +574,7 @@ class TestRegistrationStatusService(TestCase):
                 id_field=re.escape(connection.ops.quote_name(Event._meta.pk.column)),
                 id=self.event.id,
             )
-            self.assertRegex(queries[1]["sql"], match)
+            self.assertRegex(queries[2]["sql"], match)
         with self.subTest("Must lock user"):
             # This ensures that FOR UPDATE is used and that *only* the event is locked (i.e. no joins)
             match = ' FROM {table} WHERE {table}.{id_field} = {id} ORDER BY .* FOR UPDATE$'.format(
@@ -547,4 +582,136 @@ class TestRegistrationStatusService(TestCase):
                 id_field=re.escape(connection.ops.quote_name(ArtaUser._meta.pk.column)),
                 id=reg.user.id,
             )
-            self.assertRegex(queries[2]["sql"], match)
+            self.assertRegex(queries[3]["sql"], match)
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_finalize_locks_options(self):
+        """ Check that for an event without slots, only the user and selected options with slots are locked. """
+        reg = RegistrationFactory(
+            event=self.event, preparation_complete=True,
+            options=[self.player, self.option_nl, self.option_m],
+        )
+        with CaptureQueriesContext(connection) as queries:
+            RegistrationStatusService.finalize_registration(reg)
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+
+        locks = [q["sql"] for q in queries if q["sql"].endswith(" FOR UPDATE")]
+        with self.subTest("Must not lock event"):
+            event_table = re.escape(connection.ops.quote_name(Event._meta.db_table))
+            self.assertFalse([sql for sql in locks if re.search(' FROM {} WHERE'.format(event_table), sql)])
+        with self.subTest("Must lock user, then slotted options in pk order"):
+            self.assertEqual(len(locks), 2)
+            self.assertIn(connection.ops.quote_name(ArtaUser._meta.db_table), locks[0])
+            match = ' FROM {table} WHERE {table}.{id_field} IN \\({ids}\\) ORDER BY {table}.{id_field} ASC FOR UPDATE$'
+            match = match.format(
+                table=re.escape(connection.ops.quote_name(RegistrationFieldOption._meta.db_table)),
+                id_field=re.escape(connection.ops.quote_name(RegistrationFieldOption._meta.pk.column)),
+                ids=", ".join(str(pk) for pk in sorted([self.option_m.pk, self.option_nl.pk])),
+            )
+            self.assertRegex(locks[1], match)
+
+    def test_finalize_batch(self):
+        """ Check that a batch fills up slots in order, like finalizing one by one would. """
+        regs = [
+            RegistrationFactory(event=self.event, preparation_complete=True, options=self.default_options)
+            for _i in range(3)
+        ]
+        errors = RegistrationStatusService.finalize_registrations(self.event, regs)
+        self.assertEqual(errors, {})
+
+        for reg in regs:
+            reg.refresh_from_db()
+        self.assertEqual(
+            [reg.status for reg in regs],
+            [Registration.statuses.REGISTERED, Registration.statuses.REGISTERED, Registration.statuses.WAITINGLIST],
+        )
+        self.assertLess(regs[0].registered_at, regs[1].registered_at)
+        self.assertLess(regs[1].registered_at, regs[2].registered_at)
+        self.assertEqual(regs[2].waitinglist_above, 0)
+
+        self.option_m.refresh_from_db()
+        self.assertTrue(self.option_m.full)
+        self.assertEqual(self.option_m.used_slots, 2)
+        self.one_night.refresh_from_db()
+        self.assertFalse(self.one_night.full)
+        self.assertEqual(self.one_night.used_slots, 2)
+        self.assertEqual(Event.objects.get(pk=self.event.pk).used_slots, 2)
+
+    def test_finalize_batch_errors(self):
+        """ Check that registrations that cannot be finalized are reported and skipped, without affecting others. """
+        e = Event.objects.get(pk=self.event.pk)
+        e.admit_immediately = False
+        e.save()
+
+        incomplete = RegistrationFactory(event=e, preparation_in_progress=True, options=self.default_options)
+        other_event = RegistrationFactory(preparation_complete=True)
+        reg = RegistrationFactory(event=e, preparation_complete=True, options=self.default_options)
+
+        errors = RegistrationStatusService.finalize_registrations(e, [incomplete, other_event, reg])
+        self.assertEqual(set(errors), {incomplete.pk, other_event.pk})
+        self.assertIsInstance(errors[incomplete.pk], ValidationError)
+
+        for r in (incomplete, other_event, reg):
+            r.refresh_from_db()
+        self.assertEqual(incomplete.status, Registration.statuses.PREPARATION_IN_PROGRESS)
+        self.assertEqual(other_event.status, Registration.statuses.PREPARATION_COMPLETE)
+        self.assertEqual(reg.status, Registration.statuses.PENDING)
+
+    def test_finalize_batch_invitees(self):
+        """ Check that a batch checks registration is open separately for invitees. """
+        group = GroupFactory()
+        e = EventFactory(
+            registration_opens_in_days=1, invitee_registration_opens_in_days=-1, public=True, invitee_group=group,
+        )
+        invitee = RegistrationFactory(event=e, preparation_complete=True)
+        invitee.user.groups.add(group)
+        public = RegistrationFactory(event=e, preparation_complete=True)
+
+        errors = RegistrationStatusService.finalize_registrations(e, [public, invitee])
+        self.assertEqual(set(errors), {public.pk})
+        invitee.refresh_from_db()
+        self.assertEqual(invitee.status, Registration.statuses.REGISTERED)
+
+    def test_finalize_batch_conflicts(self):
+        """ Check that conflicts are looked up in a single query for a whole batch, and reported per registration. """
+        def conflicting_registrations_for_many(queryset, registrations):
+            return queryset.filter(
+                user__in=[r.user_id for r in registrations], status=Registration.statuses.REGISTERED,
+            ).exclude(pk__in=[r.pk for r in registrations])
+
+        def finalize(count, conflicting=False):
+            regs = [
+                RegistrationFactory(event=self.event, preparation_complete=True, options=[self.crew, self.one_night])
+                for _i in range(count)
+            ]
+            if conflicting:
+                RegistrationFactory(user=regs[0].user, registered=True)
+            with CaptureQueriesContext(connection) as queries:
+                errors = RegistrationStatusService.finalize_registrations(self.event, regs)
+            return regs, errors, len(queries)
+
+        with mock.patch(
+            'apps.registrations.models.registration.RegistrationQuerySet.conflicting_registrations_for_many',
+            conflicting_registrations_for_many,
+        ):
+            (_regs, errors, num_queries) = finalize(1)
+            self.assertEqual(errors, {})
+            (regs, errors, num_queries_batch) = finalize(5, conflicting=True)
+            self.assertEqual(num_queries_batch, num_queries)
+            self.assertEqual(set(errors), {regs[0].pk})
+            regs[1].refresh_from_db()
+            self.assertEqual(regs[1].status, Registration.statuses.REGISTERED)
+
+    def test_finalize_batch_queries(self):
+        """ Check that the number of queries for a batch does not depend on its size. """
+        def num_queries(count):
+            # Use options without slots, so the number of options that become full does not differ
+            regs = [
+                RegistrationFactory(event=self.event, preparation_complete=True, options=[self.crew, self.one_night])
+                for _i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                RegistrationStatusService.finalize_registrations(self.event, regs)
+            return len(queries)
+
+        self.assertEqual(num_queries(2), num_queries(5))
@@ -0,0 +1,193 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.events.models.event import UserContext
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory, GroupFactory
+
+from ..models import RegistrationField, RegistrationFieldOption
+from ..schema import EventSchema
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class TestEventSchema(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True)
+        cls.group = GroupFactory()
+
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type", order=1)
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player")
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew", invite_only=cls.group)
+
+        cls.section = RegistrationFieldFactory(
+            event=cls.event, name="section", order=2, field_type=RegistrationField.types.SECTION)
+        cls.gender = RegistrationFieldFactory(event=cls.event, name="gender", order=3, depends=cls.player)
+        cls.option_m = RegistrationFieldOptionFactory(field=cls.gender, title="M")
+        cls.option_f = RegistrationFieldOptionFactory(field=cls.gender, title="F", depends=cls.player)
+
+        cls.invite = RegistrationFieldFactory(event=cls.event, name="invite", order=4, invite_only=cls.group)
+
+    def test_contents(self):
+        """ Check the fields and options in a schema, and that relations can be followed without queries. """
+        schema = EventSchema.for_event(self.event)
+        self.assertEqual(schema.fields, (self.type, self.section, self.gender, self.invite))
+        self.assertEqual(schema.value_fields, (self.type, self.gender, self.invite))
+        self.assertEqual(list(schema.options), [p.pk for p in (self.player, self.crew, self.option_m, self.option_f)])
+        self.assertEqual(schema.invite_only_groups, {self.group.pk})
+
+        self.assertEqual(schema.fields_for(set()), (self.type, self.section, self.gender))
+        self.assertEqual(schema.fields_for({self.group.pk}), schema.fields)
+        self.assertEqual(schema.options_for(self.type, set()), [self.player])
+        self.assertEqual(schema.options_for(self.type, {self.group.pk}), [self.player, self.crew])
+
+        with self.assertNumQueries(0):
+            option = schema.options[self.option_f.pk]
+            self.assertEqual(option.depends.field.name, "type")
+            self.assertEqual(option.field.depends.field.name, "type")
+            self.assertIsNone(option.depends.field.depends)
+
+    def test_cached(self):
+        """ Check that a schema is reused while fields and options are unchanged. """
+        schema = EventSchema.for_event(self.event)
+        with self.assertNumQueries(1):
+            self.assertIs(EventSchema.for_event(self.event.pk), schema)
+
+    def test_invalidate(self):
+        """ Check that changing, adding and deleting fields and options produces a new schema. """
+        def changes():
+            field = RegistrationFieldFactory(event=self.event, name="new")
+            yield
+            option = RegistrationFieldOptionFactory(field=field, title="New")
+            yield
+            option.full = True
+            option.save()
+            yield
+            field.title = "Changed"
+            field.save()
+            yield
+            option.delete()
+            yield
+            field.delete()
+            yield
+
+        schema = EventSchema.for_event(self.event)
+        for _change in changes():
+            new_schema = EventSchema.for_event(self.event)
+            self.assertIsNot(new_schema, schema)
+            schema = new_schema
+
+        self.assertEqual(schema.fields, (self.type, self.section, self.gender, self.invite))
+        self.assertFalse(RegistrationFieldOption.objects.filter(title="New").exists())
+
+    def test_options_step_queries(self):
+        """ Check that the number of queries for the options step does not depend on the number of fields. """
+        user = ArtaUserFactory()
+        reg = RegistrationFactory(event=self.event, user=user, preparation_in_progress=True)
+        self.client.force_login(user)
+        url = reverse('registrations:step_registration_options', args=(reg.pk,))
+
+        def count_queries():
+            # Make sure the schema and user context are cached
+            EventSchema.for_event(self.event)
+            UserContext.for_user(user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        num_queries = count_queries()
+        for i in range(5):
+            field = RegistrationFieldFactory(event=self.event, name="extra{}".format(i), depends=self.player)
+            RegistrationFieldOptionFactory(field=field, title="Extra", depends=self.option_m)
+        self.assertEqual(count_queries(), num_queries)
+
+
+class TestSchemaDependencies(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True)
+        cls.admin = ArtaUserFactory(is_superuser=True, is_staff=True)
+        cls.group = GroupFactory()
+
+        # Deliberately ordered so that fields depend on later fields
+        cls.extra = RegistrationFieldFactory(event=cls.event, name="extra", order=1)
+        cls.gender = RegistrationFieldFactory(event=cls.event, name="gender", order=2)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type", order=3)
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player")
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew", invite_only=cls.group)
+
+        cls.option_m = RegistrationFieldOptionFactory(field=cls.gender, title="M", depends=cls.player)
+        cls.option_f = RegistrationFieldOptionFactory(field=cls.gender, title="F")
+        cls.extra.depends = cls.option_m
+        cls.extra.save()
+        cls.option_extra = RegistrationFieldOptionFactory(field=cls.extra, title="Extra")
+
+    def test_order(self):
+        """ Check that fields are ordered after the fields they (or their options) depend on. """
+        schema = EventSchema.for_event(self.event)
+        self.assertEqual(schema.dependency_order, (self.type, self.gender, self.extra))
+        self.assertEqual(schema.dependency_cycle_fields, ())
+
+    def test_satisfied(self):
+        """ Check evaluating dependencies for selected options (including indirect dependencies). """
+        schema = EventSchema.for_event(self.event)
+        with self.assertNumQueries(0):
+            deps = schema.dependencies({self.type.pk: self.player.pk, self.gender.pk: self.option_m.pk})
+            self.assertTrue(deps.satisfied(schema.fields_by_name['extra']))
+            self.assertTrue(deps.satisfied(schema.options[self.option_m.pk]))
+
+            deps = schema.dependencies({self.type.pk: self.crew.pk, self.gender.pk: self.option_m.pk})
+            self.assertFalse(deps.satisfied(schema.options[self.option_m.pk]))
+            self.assertTrue(deps.satisfied(schema.options[self.option_f.pk]))
+
+            deps = schema.dependencies({})
+            self.assertFalse(deps.satisfied(schema.fields_by_name['extra']))
+            self.assertTrue(deps.satisfied(schema.fields_by_name['gender']))
+
+    def test_cycle(self):
+        """ Check that cycles are detected, and fields in them are never satisfied. """
+        self.player.depends = self.option_extra
+        self.player.save()
+
+        schema = EventSchema.for_event(self.event)
+        self.assertEqual(schema.dependency_order, ())
+        self.assertEqual(schema.dependency_cycle_fields, (self.extra, self.gender, self.type))
+
+        deps = schema.dependencies({
+            self.type.pk: self.player.pk, self.gender.pk: self.option_m.pk, self.extra.pk: self.option_extra.pk,
+        })
+        self.assertFalse(deps.satisfied(schema.fields_by_name['extra']))
+        self.assertFalse(deps.satisfied(schema.options[self.player.pk]))
+
+    def test_cycle_admin(self):
+        """ Check that cycles are reported in the admin. """
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:events_event_change', args=(self.event.pk,)))
+        self.assertNotContains(response, 'circular dependencies')
+
+        self.player.depends = self.option_extra
+        self.player.save()
+        response = self.client.get(reverse('admin:events_event_change', args=(self.event.pk,)))
+        self.assertContains(response, 'circular dependencies and will never be shown: extra, gender, type')
+
+    def test_any_option_full(self):
+        """ Check predicting fullness, considering invitations and dependencies. """
+        schema = EventSchema.for_event(self.event)
+        self.assertFalse(schema.any_option_full(set()))
+
+        # Only player is available, so gender M is still available
+        RegistrationFieldOption.objects.filter(pk=self.option_f.pk).update(full=True)
+        self.assertFalse(EventSchema.for_event(self.event).any_option_full(set()))
+
+        # Without player, gender M is not available (and extra is never shown, so does not count)
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(full=True)
+        self.assertTrue(EventSchema.for_event(self.event).any_option_full(set()))
+        self.assertTrue(EventSchema.for_event(self.event).any_option_full({self.group.pk}))
+
+        # Crew can still register if gender F is available
+        RegistrationFieldOption.objects.filter(pk=self.option_f.pk).update(full=False)
+        self.assertTrue(EventSchema.for_event(self.event).any_option_full(set()))
+        self.assertFalse(EventSchema.for_event(self.event).any_option_full({self.group.pk}))
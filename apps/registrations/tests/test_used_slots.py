@@ -0,0 +1,137 @@
+import io
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.events.models import Event
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+
+from ..models import Registration, RegistrationFieldOption
+from ..services import RegistrationStatusService, UsedSlotsService
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class TestUsedSlots(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True, slots=10)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", slots=5)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew")
+
+        cls.admin = ArtaUserFactory(is_superuser=True, is_staff=True)
+
+    def assertUsedSlots(self, event, player, crew):
+        self.assertEqual(Event.objects.get(pk=self.event.pk).used_slots, event)
+        self.assertEqual(RegistrationFieldOption.objects.get(pk=self.player.pk).used_slots, player)
+        self.assertEqual(RegistrationFieldOption.objects.get(pk=self.crew.pk).used_slots, crew)
+
+    def corrupt_counters(self):
+        """ Set all counters to a wrong value, bypassing the services. """
+        Event.objects.filter(pk=self.event.pk).update_counters(used_slots=7)
+        RegistrationFieldOption.objects.filter(field__event=self.event).update_counters(used_slots=7)
+
+    def test_finalize(self):
+        """ Check that finalizing a registration updates the counters, but only when registered. """
+        reg = RegistrationFactory(event=self.event, preparation_complete=True, options=[self.player])
+        RegistrationStatusService.finalize_registration(reg)
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+        self.assertUsedSlots(1, 1, 0)
+
+        self.event.admit_immediately = False
+        self.event.save()
+        reg = RegistrationFactory(event=self.event, preparation_complete=True, options=[self.crew])
+        RegistrationStatusService.finalize_registration(reg)
+        self.assertEqual(reg.status, Registration.statuses.PENDING)
+        self.assertUsedSlots(1, 1, 0)
+
+    def test_finalize_does_not_touch_updated_at(self):
+        """ Check that updating counters does not change updated_at (so caches stay valid). """
+        updated_at = RegistrationFieldOption.objects.get(pk=self.player.pk).updated_at
+        UsedSlotsService.adjust(self.event.pk, [self.player.pk], 1)
+        self.assertEqual(RegistrationFieldOption.objects.get(pk=self.player.pk).updated_at, updated_at)
+
+    def test_status_changed(self):
+        """ Check that status changes update the counters only when changing from/to registered. """
+        reg = RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        self.assertUsedSlots(1, 1, 0)
+
+        for old, new, expected in (
+            (Registration.statuses.REGISTERED, Registration.statuses.CANCELLED, 0),
+            (Registration.statuses.CANCELLED, Registration.statuses.WAITINGLIST, 0),
+            (Registration.statuses.WAITINGLIST, Registration.statuses.REGISTERED, 1),
+        ):
+            reg.status = new
+            reg.save()
+            UsedSlotsService.registration_status_changed(reg, old)
+            self.assertUsedSlots(expected, expected, 0)
+
+    def test_options_changed(self):
+        """ Check that option changes update the counters only for registered registrations. """
+        reg = RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        UsedSlotsService.registration_options_changed(reg, [self.player.pk], [self.crew.pk])
+        self.assertUsedSlots(1, 0, 1)
+
+        # Unchanged options should cancel out
+        UsedSlotsService.registration_options_changed(reg, [self.crew.pk], [self.crew.pk])
+        self.assertUsedSlots(1, 0, 1)
+
+        reg = RegistrationFactory(event=self.event, waiting_list=True, options=[self.player])
+        UsedSlotsService.registration_options_changed(reg, [self.player.pk], [self.crew.pk])
+        self.assertUsedSlots(1, 0, 1)
+
+    def test_recount(self):
+        """ Check that recount detects and fixes wrong counters. """
+        RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        RegistrationFactory(event=self.event, registered=True, options=[self.crew])
+        RegistrationFactory(event=self.event, cancelled=True, options=[self.crew])
+        RegistrationFactory(event=self.event, registered=True, inactive_options=[self.crew])
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+        self.assertUsedSlots(3, 1, 1)
+
+        self.corrupt_counters()
+        wrong = UsedSlotsService.recount(self.event, fix=False)
+        self.assertEqual(
+            {(obj.pk, type(obj), used, counted) for (obj, used, counted) in wrong},
+            {
+                (self.event.pk, Event, 7, 3),
+                (self.player.pk, RegistrationFieldOption, 7, 1),
+                (self.crew.pk, RegistrationFieldOption, 7, 1),
+            },
+        )
+        self.assertUsedSlots(7, 7, 7)
+
+        self.assertEqual(len(UsedSlotsService.recount(self.event)), 3)
+        self.assertUsedSlots(3, 1, 1)
+        self.assertEqual(UsedSlotsService.recount(self.event), [])
+
+    def test_command(self):
+        """ Check the update_used_slots management command. """
+        RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        self.corrupt_counters()
+
+        with self.assertRaises(CommandError):
+            call_command('update_used_slots', '--check', stdout=io.StringIO())
+        self.assertUsedSlots(7, 7, 7)
+
+        out = io.StringIO()
+        call_command('update_used_slots', self.event.pk, stdout=out)
+        self.assertIn('fixed', out.getvalue())
+        self.assertUsedSlots(1, 1, 0)
+
+        call_command('update_used_slots', '--check', stdout=io.StringIO())
+
+    def test_admin_status_action(self):
+        """ Check that the status change admin actions update the counters. """
+        reg = RegistrationFactory(event=self.event, pending=True, options=[self.player])
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:registrations_registration_changelist'), {
+            'action': 'PENDING_to_REGISTERED',
+            '_selected_action': [reg.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        reg.refresh_from_db()
+        self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+        self.assertUsedSlots(1, 1, 0)
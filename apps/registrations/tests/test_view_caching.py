@@ -2,15 +2,20 @@ import time
 from datetime import datetime
 from datetime import time as dt_time
 from datetime import timedelta
-from unittest import mock, skip
+from unittest import mock
 
-from django.test import TestCase
+from django.core import checks
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from apps.events.tests.factories import EventFactory
 from apps.people.tests.factories import AddressFactory, ArtaUserFactory, EmergencyContactFactory, MedicalDetailsFactory
 
+from ..models import Registration, RegistrationFieldOption
+from ..services import RegistrationStatusService
 from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
 
 
@@ -87,9 +92,8 @@ class TestCaching(TestCase):
         with mock.patch('django.utils.timezone.now', return_value=opens_at):
             self.assertCache(response, changed=True)
 
-    @skip("Not implemented, see TODO in FinalCheck view")
     def test_finalcheck_registration_closes(self):
-        """ Check that finalcheck regenerates a response after registration opens. """
+        """ Check that finalcheck regenerates a response after registration closes (on the start date). """
         start_date_midnight = timezone.make_aware(datetime.combine(self.event.start_date, dt_time.min))
         before_start_date = start_date_midnight - timedelta(seconds=1)
 
@@ -101,6 +105,19 @@ class TestCaching(TestCase):
         with mock.patch('django.utils.timezone.now', return_value=start_date_midnight):
             self.assertCache(response, changed=True)
 
+    def test_finalcheck_registration_closes_at(self):
+        """ Check that finalcheck regenerates a response after registration closes (at registration_closes_at). """
+        self.event.registration_closes_at = timezone.now() + timedelta(hours=1)
+        self.event.save()
+
+        closes_at = self.event.registration_closes_at
+        response = self.client.get(self.final_check_url)
+        with mock.patch('django.utils.timezone.now', return_value=closes_at - timedelta(seconds=1)):
+            self.assertCache(response, changed=False)
+
+        with mock.patch('django.utils.timezone.now', return_value=closes_at):
+            self.assertCache(response, changed=True)
+
     def test_finalcheck_data_changed(self):
         """ Check that finalcheck regenerates a resonse when models are changed. """
 
@@ -172,3 +189,39 @@ class TestCaching(TestCase):
         response = self.client.get(self.final_check_url)
         RegistrationFactory(user=self.user)
         self.assertCache(response, changed=True)
+
+    def test_finalcheck_no_queries(self):
+        """ Check that finalcheck returns not-modified without querying anything but the session and user. """
+        response = self.client.get(self.final_check_url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.final_check_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(len(queries), 2, [q['sql'] for q in queries])
+
+    def test_finalcheck_bulk_changes(self):
+        """ Check that finalcheck regenerates a response after changes that bypass signals. """
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(slots=1)
+        other = RegistrationFactory(event=self.event, pending=True, options=[self.player])
+
+        response = self.client.get(self.final_check_url)
+        RegistrationStatusService.change_statuses(
+            [other], Registration.statuses.PENDING, Registration.statuses.REGISTERED)
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.player.pk).full)
+        self.assertCache(response, changed=True)
+
+
+class TestSharedCacheCheck(SimpleTestCase):
+    def run_deploy_checks(self):
+        return [e for e in checks.run_checks(include_deployment_checks=True) if e.id == 'arta.E001']
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_cache(self):
+        """ Check that deploying with a per-process cache is rejected, since versions would not be shared. """
+        self.assertEqual(len(self.run_deploy_checks()), 1)
+        self.assertEqual([e for e in checks.run_checks() if e.id == 'arta.E001'], [])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache', 'LOCATION': '127.0.0.1:11211',
+    }})
+    def test_shared_cache(self):
+        self.assertEqual(self.run_deploy_checks(), [])
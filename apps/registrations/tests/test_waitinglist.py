@@ -0,0 +1,126 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from reversion.models import Revision
+
+from apps.events.models import Event
+from apps.events.tests.factories import EventFactory
+from apps.people.tests.factories import ArtaUserFactory
+
+from ..models import Registration, RegistrationFieldOption
+from ..services import UsedSlotsService, WaitinglistService
+from .factories import RegistrationFactory, RegistrationFieldFactory, RegistrationFieldOptionFactory
+
+
+class TestWaitinglistService(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory(registration_opens_in_days=-1, public=True, slots=4)
+        cls.type = RegistrationFieldFactory(event=cls.event, name="type")
+        cls.player = RegistrationFieldOptionFactory(field=cls.type, title="Player", slots=2)
+        cls.crew = RegistrationFieldOptionFactory(field=cls.type, title="Crew")
+
+        cls.admin = ArtaUserFactory(is_superuser=True, is_staff=True)
+
+    def waiting_helper(self, *options):
+        """ Creates a waiting list registration for each given option, in order """
+        return [RegistrationFactory(event=self.event, waiting_list=True, options=[option]) for option in options]
+
+    def assertPromoted(self, promoted, expected):
+        self.assertEqual([r.pk for r in promoted], [r.pk for r in expected])
+        for reg in expected:
+            reg.refresh_from_db()
+            self.assertEqual(reg.status, Registration.statuses.REGISTERED)
+        self.assertEqual(UsedSlotsService.recount(self.event, fix=False), [])
+
+    def test_promote_in_order(self):
+        """ Check that registrations are promoted in waiting list order, until the event is full. """
+        regs = self.waiting_helper(*[self.crew] * 6)
+        promoted = WaitinglistService.promote(self.event, user=self.admin)
+        self.assertPromoted(promoted, regs[:4])
+        self.assertEqual(Registration.objects.filter(status=Registration.statuses.WAITINGLIST).count(), 2)
+        self.assertTrue(Event.objects.get(pk=self.event.pk).full)
+        self.assertEqual(Revision.objects.get().user, self.admin)
+
+    def test_skip_full_option(self):
+        """ Check that registrations for an option without slots left are skipped, keeping their place. """
+        regs = self.waiting_helper(self.player, self.player, self.player, self.crew)
+        promoted = WaitinglistService.promote(self.event)
+        self.assertPromoted(promoted, [regs[0], regs[1], regs[3]])
+        self.assertEqual(Registration.objects.get(pk=regs[2].pk).waitinglist_above, 0)
+
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.player.pk).full)
+        self.assertFalse(Event.objects.get(pk=self.event.pk).full)
+
+    def test_existing_registrations(self):
+        """ Check that already used slots are respected and full flags are cleared when slots remain. """
+        RegistrationFactory(event=self.event, registered=True, options=[self.player])
+        Event.objects.filter(pk=self.event.pk).update(full=True)
+        RegistrationFieldOption.objects.filter(pk=self.player.pk).update(full=True)
+
+        regs = self.waiting_helper(self.player, self.player)
+        promoted = WaitinglistService.promote(self.event)
+        self.assertPromoted(promoted, regs[:1])
+        self.assertFalse(Event.objects.get(pk=self.event.pk).full)
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.player.pk).full)
+
+    def test_manually_full(self):
+        """ Check that options (or events) without slots marked full block promotion. """
+        RegistrationFieldOption.objects.filter(pk=self.crew.pk).update(full=True)
+        self.waiting_helper(self.crew)
+        self.assertEqual(WaitinglistService.promote(self.event), [])
+        self.assertTrue(RegistrationFieldOption.objects.get(pk=self.crew.pk).full)
+        self.assertFalse(Revision.objects.exists())
+
+    def test_num_queries(self):
+        """ Check that the work done depends on the number of promoted registrations, not the waiting list length. """
+        self.waiting_helper(*[self.crew] * 20)
+
+        with CaptureQueriesContext(connection) as queries:
+            promoted = WaitinglistService.promote(self.event, batch_size=4)
+        self.assertEqual(len(promoted), 4)
+        # Only a single batch of the waiting list should be read
+        self.assertEqual(len([q for q in queries if 'LIMIT 4' in q['sql']]), 1)
+
+    def test_slots_freed(self):
+        """ Check that promotion after freeing slots only happens when enabled for the event. """
+        regs = self.waiting_helper(self.crew)
+        self.assertEqual(WaitinglistService.slots_freed(self.event), [])
+
+        self.event.promote_waitinglist = True
+        self.assertPromoted(WaitinglistService.slots_freed(self.event), regs)
+
+    def test_admin_cancel(self):
+        """ Check that cancelling a registration through the admin promotes from the waiting list when enabled. """
+        Event.objects.filter(pk=self.event.pk).update(promote_waitinglist=True, slots=1)
+        registered = RegistrationFactory(event=self.event, registered=True, options=[self.crew])
+        regs = self.waiting_helper(self.crew)
+
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:registrations_registration_change', args=(registered.pk,)), {
+            'user': registered.user.pk,
+            'event': self.event.pk,
+            'status': Registration.statuses.CANCELLED.v,
+            'registered_at_0': '2020-01-01',
+            'registered_at_1': '12:00:00',
+            # Empty inline management forms
+            **{
+                '{}-{}'.format(prefix, suffix): value
+                for prefix in ('payments', 'payments-2', 'options', 'options-2', 'price_corrections')
+                for suffix, value in (('TOTAL_FORMS', 0), ('INITIAL_FORMS', 0), ('MAX_NUM_FORMS', 1000))
+            },
+        })
+        self.assertEqual(response.status_code, 302, getattr(response, 'context_data', {}).get('errors'))
+        self.assertPromoted(Registration.objects.filter(status=Registration.statuses.REGISTERED), regs)
+
+    def test_admin_action(self):
+        """ Check the event admin action to promote from the waiting list. """
+        regs = self.waiting_helper(self.crew)
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('admin:events_event_changelist'), {
+            'action': 'promote_waitinglist',
+            '_selected_action': [self.event.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertPromoted(Registration.objects.filter(status=Registration.statuses.REGISTERED), regs)
@@ -11,11 +11,14 @@ urlpatterns = [
     path('ec/<int:pk>/', views.EmergencyContactsStep.as_view(), name="step_emergency_contacts"),
     path('op/<int:pk>/', views.RegistrationOptionsStep.as_view(), name="step_registration_options"),
     path('fc/<int:pk>/', views.FinalCheck.as_view(), name="step_final_check"),
+    path('fp/<int:pk>/', views.FinalizeProcessing.as_view(), name="finalize_processing"),
     path('rc/<int:pk>/', views.RegistrationConfirmation.as_view(), name="registration_confirmation"),
     path('cr/<int:pk>/', views.ConflictingRegistrations.as_view(), name="conflicting_registrations"),
     path('ps/<int:pk>/', views.PaymentStatus.as_view(), name="payment_status"),
     path('pc/<int:pk>/', views.PaymentDone.as_view(), name="payment_done"),
     path('ed/<int:pk>/', views.EditDone.as_view(), name="edit_done"),
+    path('os/<int:eventid>/', views.OpeningStatusView.as_view(), name="opening_status"),
+    path('os/<int:eventid>/stream/', views.OpeningStreamView.as_view(), name="opening_stream"),
     path('registration/<int:pk>/payment_details', views.RegistrationPaymentDetails.as_view(),
          name="registration_payment_details"),
 ]
@@ -0,0 +1,94 @@
+"""
+Version counters for registration data, used to generate ETags without database queries (see FinalCheck).
+
+Versions are bumped by the signal handlers in signals.py whenever a relevant object is saved or deleted, and
+explicitly (using the *_changed functions below) by code that bypasses these signals, e.g. using QuerySet.update().
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.events.models import Event
+from apps.events.models.event import EventPhases
+from arta.common.versions import bump_versions
+
+from .models import Registration
+
+
+def user_version(pk):
+    """ Version of a user, their personal details and all of their registrations. """
+    return ('user', pk)
+
+
+def registration_version(pk):
+    """ Version of a registration and its values. """
+    return ('registration', pk)
+
+
+def event_version(pk):
+    """ Version of an event, its fields and its options. """
+    return ('event', pk)
+
+
+def registrations_changed(registrations):
+    """ Bumps the versions for the given registrations (and their users). """
+    bump_versions([
+        *{user_version(r.user_id) for r in registrations},
+        *(registration_version(r.pk) for r in registrations),
+    ])
+
+
+def events_changed(event_ids):
+    """ Bumps the versions for the given events (by pk). """
+    bump_versions([event_version(pk) for pk in event_ids])
+
+
+def _registration_event_key(pk):
+    return 'registration-event:{}'.format(pk)
+
+
+def _event_phases_key(pk):
+    return 'event-phases:{}'.format(pk)
+
+
+def registration_event_id(pk):
+    """ Returns the event pk for the given registration pk (or None if it does not exist), cached. """
+    key = _registration_event_key(pk)
+    event_id = cache.get(key)
+    if event_id is None:
+        event_id = Registration.objects.filter(pk=pk).values_list('event_id', flat=True).first()
+        if event_id is not None:
+            cache.set(key, event_id, timeout=None)
+    return event_id
+
+
+def event_phases(pk):
+    """
+    Returns the EventPhases (registration opening and closing moments) of the given event pk, cached.
+
+    These are not covered by the event version, since passing them changes what is shown without changing the event.
+    For a missing event, all moments are None.
+    """
+    key = _event_phases_key(pk)
+    phases = cache.get(key)
+    if phases is None:
+        values = (
+            Event.objects.filter(pk=pk)
+            .values_list('public_registration_opens_at', 'invitee_registration_opens_at', 'registration_closes_at',
+                         'start_date')
+            .first()
+        )
+        phases = EventPhases.from_values(*values) if values else EventPhases(None, None, None)
+        cache.set(key, phases, timeout=None)
+    return phases
+
+
+def registration_saved(registration):
+    """ Called after a registration is saved, updates the cached event (which can be changed in the admin). """
+    cache.set(_registration_event_key(registration.pk), registration.event_id, timeout=None)
+
+
+def event_saved(event):
+    """ Called after an event is saved or deleted, clears the cached phases (again on commit). """
+    key = _event_phases_key(event.pk)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
@@ -1,16 +1,17 @@
 # from django.shortcuts import render
+import math
+
 import reversion
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Case, F, Q, When
 from django.forms import ValidationError
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
-from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
-from django.views.generic import DetailView
+from django.views.generic import DetailView, View
 from django.views.generic.base import ContextMixin, TemplateView
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.edit import FormView
@@ -18,12 +19,15 @@ from django.views.generic.edit import FormView
 from apps.events.models import Event
 from apps.payments.models import Payment
 from apps.payments.services import PaymentService, PaymentStatusService
-from apps.people.models import Address, ArtaUser, EmergencyContact, MedicalDetails
-from arta.common.views import CacheUsingTimestampsMixin
+from apps.people.models import Address, ArtaUser, MedicalDetails
+from arta.common.views import CacheUsingVersionsMixin
 
+from . import versions
 from .forms import (EmergencyContactFormSet, FinalCheckForm, MedicalDetailForm, PaymentForm, PersonalDetailForm,
                     RegistrationOptionsForm)
-from .models import Registration, RegistrationFieldOption, RegistrationFieldValue
+from .models import FinalizeRequest, Registration, RegistrationFieldValue
+from .opening import opening_status
+from .schema import EventSchema
 from .services import RegistrationNotifyService, RegistrationStatusService
 
 REGISTRATION_STEPS = [
@@ -133,7 +137,7 @@ class RegistrationStepMixinBase(ContextMixin):
 
         Should return None for normal processing, or a response to bypass normal processing.
 
-        These checks are not run when CacheUsingTimestampsMixin decides the cache is still valid, but in general
+        These checks are not run when CacheUsingVersionsMixin decides the cache is still valid, but in general
         anything that changes these checks should also cause the cache to become invalid.
         """
         if self.registration and self.registration.has_conflicting_registrations:
@@ -215,7 +219,7 @@ class RegistrationStepMixinBase(ContextMixin):
         return super().get_context_data(**kwargs)
 
 
-class RegistrationStepMixin(LoginRequiredMixin, CacheUsingTimestampsMixin, RegistrationStepMixinBase):
+class RegistrationStepMixin(LoginRequiredMixin, CacheUsingVersionsMixin, RegistrationStepMixinBase):
     """ This class ensures that LoginRequiredMixin runs its checks in dispatch before RegistrationStepMixinBase. """
 
     pass
@@ -269,17 +273,18 @@ class RegistrationOptionsStep(RegistrationStepMixin, FormView):
 
     def form_valid(self, form):
         if form.has_changed():
-            with reversion.create_revision():
-                form.save(self.registration)
-                reversion.set_user(self.request.user)
-                reversion.set_comment(_("Options updated via frontend. The following "
-                                      "fields changed: %(fields)s" % {'fields': ", ".join(form.changed_data)}))
+            form.save(
+                self.registration,
+                user=self.request.user,
+                comment=_("Options updated via frontend. The following "
+                          "fields changed: %(fields)s" % {'fields': ", ".join(form.changed_data)}),
+            )
 
         return super().form_valid(form)
 
     def check_request(self):
         # No fields? Just skip this step
-        if not self.event.registration_fields.all():
+        if not EventSchema.for_event(self.event).fields:
             return redirect(self.get_success_url())
         return super().check_request()
 
@@ -424,6 +429,16 @@ class FinalCheck(RegistrationStepMixin, FormView):
         return reverse('registrations:registration_confirmation', args=(self.registration.pk,))
 
     def form_valid(self, form):
+        if settings.REGISTRATION_FINALIZE_QUEUE:
+            # Leave the actual finalization to the queue worker, so this request does not have to wait for the event
+            # lock.
+            try:
+                RegistrationStatusService.request_finalize(self.registration, self.request.build_absolute_uri('/'))
+            except ValidationError as ex:
+                [messages.error(self.request, _("Could not complete registration: {}").format(m)) for m in ex.messages]
+                return redirect('registrations:step_final_check', self.registration.id)
+            return redirect('registrations:finalize_processing', self.registration.id)
+
         try:
             # This intentionally does *not* create a revision for performance reasons (to make the registration request
             # as a whole, but also the transaction that has the event locked, shorter).
@@ -440,57 +455,29 @@ class FinalCheck(RegistrationStepMixin, FormView):
 
         return super().form_valid(form)
 
-    def instances_used(self):
-        """ Returns all model instances used by this view, their updated_at fields are used for caching. """
-        user = self.request.user
-        # We need to return querysets, so can't just return request.user
-        yield ArtaUser.objects.filter(pk=user.pk)
-        # Include all a users registrations (technically only the current one and other REGISTERED ones, though
-        # CANCELLED ones could previously have been included wheh they were still REGISTERED, so basically all of
-        # them).
-        yield Registration.objects.filter(user=user.pk)
-
-        yield RegistrationFieldValue.objects.filter(registration=self.registration_id)
-        # This returns RegistrationFieldOptions, which are used for their "full" status.
-        yield RegistrationFieldOption.objects.filter(registrationfieldvalue__registration=self.registration_id)
-
-        # These are reverse OneToOne on user, but accessing them through there returns objects rather than querysets
-        yield Address.objects.filter(user=user.pk)
-        yield MedicalDetails.objects.filter(user=user.pk)
-        yield EmergencyContact.objects.filter(user=user.pk)
-
-        # The event has a virtual updated timestamp at the moment registration opens (e.g. when registration is open
-        # and the event was not updated *after* the registration opened, use
-        # public_registration_opens_at/invitee_registrations_opens_at (whichever is later) instead of updated_at).
-        # Calling values() without arguments clears field list and allows redefining updated_at with a different value.
-        event_qs = Event.objects.filter(registrations=self.registration_id)
-        yield event_qs.values().values(updated_at=Case(
-            # TODO: This should check against the start date to invalidate the cache when registration closes.
-            # However, casting date to datetime produces a naive timestamp at midnight, which is interpreted by Django
-            # (django.db.backends.mysql.DatabaseOperations.convert_datetimefield_value) in the db connection timezone
-            # (UTC by default). However, for Event.registration_is_open timezone.now is converted to a date to compare
-            # against start_date, and that conversion happens in the django TIMEZONE, so this check does not match.
-            # A solution could be to have a registration_closes_at timestamp instead of using the start_date.
-            # When(
-            #     start_date__lte=timezone.now(),
-            #     start_date__gt=F('updated_at'),
-            #     then=Cast(F('start_date'), output_field=DateTimeField()),
-            # ),
-            When(
-                condition=Q(public_registration_opens_at__lte=timezone.now())
-                & (
-                    Q(invitee_registration_opens_at=None)
-                    | Q(public_registration_opens_at__gt=F('invitee_registration_opens_at'))
-                ) & Q(public_registration_opens_at__gt=F('updated_at')),
-                then=F('public_registration_opens_at'),
-            ),
-            When(
-                condition=Q(invitee_registration_opens_at__lte=timezone.now())
-                & Q(invitee_registration_opens_at__gt=F('updated_at')),
-                then=F('invitee_registration_opens_at'),
-            ),
-            default=F('updated_at'),
-        ))
+    @cached_property
+    def cached_event_id(self):
+        # Like self.event.pk, but without querying the database
+        return versions.registration_event_id(self.registration_id)
+
+    def versions_used(self):
+        """ Returns version keys for all data used by this view, these are used for caching. """
+        if self.cached_event_id is None:
+            return None
+
+        return [
+            # This includes the user, their details and all registrations (other registrations can conflict)
+            versions.user_version(self.request.user.pk),
+            # This includes the values of the registration
+            versions.registration_version(self.registration_id),
+            # This includes the options, which are used for their "full" status
+            versions.event_version(self.cached_event_id),
+        ]
+
+    def state_used(self):
+        """ Returns whether registration has opened (publicly, for invitees) or closed, which affect the response. """
+        for passed in versions.event_phases(self.cached_event_id).passed():
+            yield int(passed)
 
     def get_context_data(self, **kwargs):
         personal_details = Address.objects.filter(user=self.request.user).first()
@@ -515,10 +502,47 @@ class FinalCheck(RegistrationStepMixin, FormView):
             'total_price': total_price,
             'modify_url': self.get_modify_url(),
             'confirm_url': self.get_confirm_url(),
+            'opening_status': opening_status(self.event.pk),
+            'opening_poll_interval': settings.REGISTRATION_OPENING_POLL_INTERVAL,
         })
         return super().get_context_data(**kwargs)
 
 
+class OpeningStatusView(View):
+    """
+    Returns the registration opening status of an event as JSON, for clients that do not support OpeningStreamView.
+
+    This does not require login or check that the event is visible, since it only exposes whether registration has
+    opened and an opaque version, and it should be cheap (cache reads only).
+    """
+
+    def get(self, request, eventid):
+        response = JsonResponse(opening_status(eventid).as_dict())
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class OpeningStreamView(View):
+    """
+    Returns the registration opening status of an event as a server-sent event (see apps.registrations.opening).
+
+    When served by WSGI, this just returns the current status and tells the browser when to reconnect. When the ASGI
+    application handles this URL instead, the connection is kept open and changes are pushed.
+    """
+
+    def get(self, request, eventid):
+        status = opening_status(eventid)
+        retry = settings.REGISTRATION_OPENING_POLL_INTERVAL
+        if status.changes_in is not None:
+            retry = min(retry, status.changes_in)
+        response = HttpResponse(
+            'retry: {}\n{}'.format(math.ceil(retry * 1000), status.as_event()),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
 class RegistrationConfirmation(RegistrationStepMixin, DetailView):
     """ View confirmation after registration. """
 
@@ -529,6 +553,50 @@ class RegistrationConfirmation(RegistrationStepMixin, DetailView):
         return super().get_queryset().with_price()
 
 
+class FinalizeProcessing(LoginRequiredMixin, DetailView):
+    """
+    Shown while a queued registration is waiting to be finalized.
+
+    This page refreshes itself until the registration is processed, and then redirects to the confirmation (or back to
+    the final check, when finalization failed).
+    """
+
+    context_object_name = 'registration'
+    template_name = 'registrations/finalize_processing.html'
+
+    def get_queryset(self):
+        return Registration.objects.filter(user=self.request.user).select_related('event')
+
+    def render_to_response(self, context):
+        # Check this in render_to_response, which is late enough to access self.object *and* can return a response.
+        if self.object.status.FINALIZED:
+            return redirect('registrations:registration_confirmation', self.object.id)
+
+        try:
+            finalize_request = self.object.finalize_request
+        except FinalizeRequest.DoesNotExist:
+            finalize_request = None
+
+        if finalize_request is None or finalize_request.processed_at is not None:
+            # Failed requests are not deleted here (this is a GET, which might be a prefetch or a reload), but kept
+            # until the final check is submitted again.
+            if finalize_request is not None:
+                for m in finalize_request.error.splitlines():
+                    messages.error(self.request, _("Could not complete registration: {}").format(m))
+            return redirect('registrations:step_final_check', self.object.id)
+
+        context.update({
+            'refresh_interval': settings.REGISTRATION_FINALIZE_POLL_INTERVAL,
+            'queue_position': FinalizeRequest.objects.queued_for(self.object.event_id).filter(
+                requested_at__lt=finalize_request.requested_at,
+            ).count(),
+        })
+        response = super().render_to_response(context)
+        # Never cache this page, it should be reloaded until processing is done
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
 class EditDone(RegistrationStepMixin, DetailView):
     """ View confirmation after editing registration. """
 
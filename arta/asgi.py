@@ -0,0 +1,26 @@
+"""
+ASGI config for Artaxerxes project.
+
+This is an alternative to the WSGI application (e.g. using ``uvicorn arta.asgi:application``), that handles many
+concurrent connections using a fixed amount of memory. Django 2.2 does not support ASGI or async views, so all normal
+views run in a bounded pool of ASGI_THREADS threads (see arta.common.asgi.ThreadedWSGIApp). Connections waiting for a
+thread, slow clients and the registration opening status streams (see apps.registrations.opening), which keep
+connections open for a long time, are all handled by the event loop instead of each occupying a worker.
+
+Static and media files are not served by this, leave those to the web server.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "arta.settings.production")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+
+from apps.registrations.opening import OpeningStreamApp  # noqa: E402
+from arta.common.asgi import ThreadedWSGIApp  # noqa: E402
+
+application = OpeningStreamApp(fallback=ThreadedWSGIApp(WSGIHandler(), max_workers=settings.ASGI_THREADS))
@@ -1,6 +1,7 @@
 import import_export
 
 from apps.core.templatetags.coretags import moneyformat
+from arta.common.pagination import LargeTablePaginator
 
 
 class LimitForeignKeyOptionsMixin:
@@ -65,3 +66,19 @@ class LimitForeignKeyOptionsMixin:
 class MonetaryResourceWidget(import_export.widgets.DecimalWidget):
     def render(self, value, obj=None):
         return moneyformat(value)
+
+
+class LargeTableAdminMixin:
+    """
+    Mixin for admins of large tables with expensive (e.g. annotated) querysets, to keep the changelist fast.
+
+    This paginates using LargeTablePaginator, so counting and skipping rows does not compute annotations, and the count
+    of the unfiltered changelist is estimated from table statistics on MySQL. The count of all rows shown next to
+    filtered results (another full count) is omitted. Since pages are lists rather than querysets, this cannot be
+    combined with list_editable.
+    """
+
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return LargeTablePaginator(queryset, per_page, orphans, allow_empty_first_page, approximate=True)
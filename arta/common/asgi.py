@@ -0,0 +1,102 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ThreadedWSGIApp:
+    """
+    ASGI application that runs a WSGI application (i.e. Django) in a bounded pool of threads.
+
+    Django 2.2 does not support ASGI or async views, so this is what allows serving normal views from an ASGI server.
+    Connections (including slow clients, and requests waiting for a free thread) are handled by the event loop, so
+    only requests that are actually being processed occupy a thread, rather than a whole worker process each.
+
+    The response is streamed back to the client as the WSGI application produces it.
+    """
+
+    def __init__(self, wsgi_app, max_workers=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, self.run, self.get_environ(scope, body), send, loop)
+
+    def get_environ(self, scope, body):
+        """ Returns a WSGI environ for the given ASGI scope (see PEP 3333 and the ASGI WSGI compatibility notes). """
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': str(client[0]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            value = value.decode('latin1')
+            if name in environ:
+                value = environ[name] + ',' + value
+            environ[name] = value
+        return environ
+
+    def run(self, environ, send, loop):
+        """ Runs the WSGI application (in a worker thread), sending the response through the event loop. """
+        def call_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start.update({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for (name, value) in headers],
+            })
+
+        response = self.wsgi_app(environ, start_response)
+        try:
+            # Send the start only after the first (non-empty) chunk, since start_response may be called again until
+            # then (with exc_info, on errors)
+            started = False
+            for chunk in response:
+                if not chunk:
+                    continue
+                if not started:
+                    call_send(start)
+                    started = True
+                call_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                call_send(start)
+            call_send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # This is where Django closes database connections, etc.
+            if hasattr(response, 'close'):
+                response.close()
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 def QExpr(*args, **kwargs):
@@ -24,9 +25,42 @@ class FromOuterRef:
 
 class UpdatedAtQuerySetMixin:
     def update(self, **kwargs):
-        # TODO: This should be implemented if we need QuerySet.update, but for now just raise
-        # See https://code.djangoproject.com/ticket/26239
-        raise NotImplementedError("Update does not set updated_at / auto_now fields")
+        """
+        Update like QuerySet.update, but also set updated_at (like auto_now does on save).
+
+        QuerySet.update does not handle auto_now fields, see https://code.djangoproject.com/ticket/26239
+        """
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+    def update_counters(self, **kwargs):
+        """
+        Update denormalized bookkeeping fields (e.g. counters), intentionally leaving updated_at untouched.
+
+        These fields are derived from other data and not shown directly, so changing them should not invalidate any
+        caches that are based on updated_at. Typically used with F() expressions to update atomically.
+        """
+        return super().update(**kwargs)
+
+
+class CounterFieldsModelMixin:
+    """
+    Model mixin that prevents save() from overwriting counter fields.
+
+    Counter fields (listed in counter_fields) are maintained using QuerySet.update_counters() and F() expressions, so
+    the in-memory value of a model instance can be outdated. To prevent saving an outdated value, a regular save() of
+    an existing object leaves these fields untouched (unless they are explicitly listed in update_fields).
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not self._state.adding and self.pk is not None:
+            update_fields = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.counter_fields
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
 
 
 # Based on https://stackoverflow.com/a/38017535/740048
@@ -0,0 +1,111 @@
+"""
+Exporting import_export resources to CSV and XLSX, with memory usage that does not depend on the number of rows.
+
+Resource.export() builds a complete tablib Dataset, which is then converted into a complete file in memory, so for
+large events the rows are kept in memory (several times). Here, rows are produced from the queryset in chunks (applying
+its prefetch_related lookups per chunk) and written out as soon as they are produced:
+ - CSV is streamed to the client directly.
+ - XLSX is written using a write-only openpyxl workbook (which keeps rows in temporary files) into a temporary file,
+   which is then streamed to the client.
+"""
+import csv
+import itertools
+import tempfile
+
+from django.db.models import QuerySet, prefetch_related_objects
+from django.http import FileResponse, StreamingHttpResponse
+from import_export.formats import base_formats
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+EXPORT_CHUNK_SIZE = 500
+
+
+def iter_chunked(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterates over the given queryset using iterator(), loading its prefetch_related lookups per chunk.
+
+    QuerySet.iterator() ignores prefetch_related in Django 2.2, so these are applied to each chunk instead.
+    """
+    if not isinstance(queryset, QuerySet):
+        yield from queryset
+        return
+
+    lookups = queryset._prefetch_related_lookups
+    iterator = queryset.prefetch_related(None).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        prefetch_related_objects(chunk, *lookups)
+        yield from chunk
+
+
+def export_rows(resource, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """ Generates the headers and then the rows of the given resource, like Resource.export() does. """
+    yield resource.get_export_headers()
+    for obj in iter_chunked(queryset, chunk_size):
+        yield resource.export_resource(obj)
+
+
+class _Echo:
+    """ File-like object that just returns what is written, to use csv.writer for single rows. """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    """ Generates CSV lines for the given rows. """
+    writer = csv.writer(_Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, file):
+    """ Writes the given rows to a XLSX file (with a bold and frozen header row, like tablib does). """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.freeze_panes = 'A2'
+
+    rows = iter(rows)
+    bold = Font(bold=True)
+    headers = [_xlsx_cell(sheet, header) for header in next(rows)]
+    for cell in headers:
+        cell.font = bold
+    sheet.append(headers)
+
+    for row in rows:
+        sheet.append([_xlsx_cell(sheet, value) for value in row])
+    workbook.save(file)
+
+
+def _xlsx_cell(sheet, value):
+    try:
+        return WriteOnlyCell(sheet, value=value)
+    except ValueError:
+        # Like tablib, fall back to a string for values that openpyxl does not support
+        return WriteOnlyCell(sheet, value=str(value))
+
+
+def export_response(resource, queryset, file_format, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Returns a response that downloads the given resource (for the given queryset) in the given format.
+
+    Only CSV and XLSX (import_export formats) are supported.
+    """
+    rows = export_rows(resource, queryset, chunk_size)
+    if isinstance(file_format, base_formats.CSV):
+        response = StreamingHttpResponse(stream_csv(rows), content_type=file_format.get_content_type())
+    elif isinstance(file_format, base_formats.XLSX):
+        # The zip file can only be written as a whole, so write to a temporary file (closed by the response)
+        file = tempfile.TemporaryFile()
+        write_xlsx(rows, file)
+        file.seek(0)
+        response = FileResponse(file, content_type=file_format.get_content_type())
+    else:
+        raise ValueError("Unsupported export format: {}".format(file_format.get_title()))
+
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, file_format.get_extension())
+    return response
@@ -0,0 +1,214 @@
+"""
+Paginators for large tables, where OFFSET pagination and COUNT queries get slower as the table grows.
+
+KeysetPaginator continues each page after the last row of the previous page (also known as "seek" pagination), so
+every page is a simple (indexed) query. LargeTablePaginator keeps page numbers (as used by the admin), but avoids
+computing annotations for rows that are only counted or skipped, and can estimate the count of large unfiltered tables
+on MySQL from table statistics.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # Unlike DjangoJSONEncoder, keep microseconds, since cursors must be exact to not repeat or skip rows
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPage:
+    """ A page of a KeysetPaginator. Unlike Django's Page, this only knows about the next page, not page numbers. """
+
+    def __init__(self, object_list, paginator, cursor, next_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        # The cursor of this page (None for the first page) and of the next page (None for the last page)
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def __repr__(self):
+        return '<Page after {}>'.format(self.cursor)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by continuing after the last row of the previous page, rather than using an offset.
+
+    The queryset is ordered by the given ordering, a list of field names (prefixed by - for descending order) of the
+    queried model. These fields must not be NULL, and together must be unique (e.g. by ending with the pk), so each row
+    has a well-defined position. An index on these fields makes every page a simple index range scan.
+
+    Pages are identified by an opaque cursor string (containing the ordering values of the last row of the previous
+    page), which also works for rows of values() querysets, as long as these include the ordering fields.
+    """
+
+    def __init__(self, object_list, per_page, ordering):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+    def _fields(self):
+        opts = self.object_list.model._meta
+        return [opts.pk if name == 'pk' else opts.get_field(name) for (name, _descending) in self.ordering]
+
+    def _values(self, row):
+        if isinstance(row, dict):
+            return [row[name] for (name, _descending) in self.ordering]
+        return [getattr(row, field.attname) for field in self._fields()]
+
+    def encode_cursor(self, row):
+        """ Returns the cursor to continue after the given row. """
+        data = json.dumps(self._values(row), cls=CursorJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """ Returns the ordering values in the given cursor, or raises InvalidPage for invalid cursors. """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            fields = self._fields()
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for (field, value) in zip(fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidPage("Invalid cursor")
+
+    def page(self, cursor=None):
+        """ Returns the page after the given cursor (or the first page when None). """
+        queryset = self.object_list.order_by(*(
+            '-' + name if descending else name for (name, descending) in self.ordering
+        ))
+        if cursor is not None:
+            # Rows that come after the cursor: equal on the first few ordering fields, and after it on the next one
+            values = self.decode_cursor(cursor)
+            after = Q()
+            for (i, (name, descending)) in enumerate(self.ordering):
+                equal = {n: v for ((n, _d), v) in zip(self.ordering[:i], values)}
+                after |= Q(**equal, **{'{}__{}'.format(name, 'lt' if descending else 'gt'): values[i]})
+            queryset = queryset.filter(after)
+
+        # Fetch one more row to know whether there is a next page
+        object_list = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = self.encode_cursor(object_list[-1])
+        return KeysetPage(object_list, self, cursor, next_cursor)
+
+
+class LargeTablePaginator(Paginator):
+    """
+    Paginator for large querysets with expensive annotations, that only computes annotations for the rows shown.
+
+    The count only selects the pk (so annotations are only computed when used for filtering), and pages first select
+    the pks of their rows (skipping the rows before using OFFSET), and then load the complete rows for just these pks.
+
+    With approximate=True, the count of unfiltered querysets on MySQL is taken from the table statistics instead (only
+    when these report at least approximate_count_threshold rows, smaller tables are counted exactly), since InnoDB
+    needs a full index scan for an exact count. This estimate can be off by tens of percent, so it is only used for
+    the displayed count and number of pages: page numbers are validated against the actual rows, and when a page at
+    or past the estimated last page is followed by more rows, num_pages is raised to include the next page (so that
+    one is linked as well). When the estimate is too high, the last pages are empty.
+    """
+
+    approximate_count_threshold = 10000
+
+    def __init__(self, *args, approximate=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.approximate = approximate
+        # Whether count is an estimate, set when evaluating count
+        self.count_estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+
+        if self.approximate:
+            estimate = self.estimate_count(queryset)
+            if estimate is not None and estimate >= self.approximate_count_threshold:
+                self.count_estimated = True
+                return estimate
+
+        if queryset._fields is None:
+            # Only select the pk, so the count query does not include any annotations not referenced by filters
+            queryset = queryset.values('pk')
+        return queryset.order_by().count()
+
+    def _has_rows_from(self, offset):
+        # Without ordering (cleared by exists()), this still checks whether there are more than offset rows
+        return self.object_list[offset:].exists()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            number = int(number)
+            # The estimated count can be too low, so also allow later pages, as long as they contain rows
+            if self.count_estimated and number > 1 and self._has_rows_from((number - 1) * self.per_page):
+                return number
+            raise
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.count_estimated:
+            return super().page(number)
+
+        # Like Paginator.page, but without limiting the last page to the (estimated) count
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if number >= self.num_pages and self._has_rows_from(top):
+            # Make sure the next page is included in the page range as well
+            self.num_pages = number + 1
+            self.count = max(self.count, top + 1)
+        return self._get_page(self.object_list[bottom:top], number, self)
+
+    def _get_page(self, object_list, number, paginator):
+        if isinstance(object_list, QuerySet) and object_list._fields is None:
+            pks = list(object_list.values_list('pk', flat=True))
+            objects = self.object_list.order_by().in_bulk(pks)
+            object_list = [objects[pk] for pk in pks if pk in objects]
+        return super()._get_page(object_list, number, paginator)
+
+    @staticmethod
+    def estimate_count(queryset):
+        """ Returns the row count of the table of an unfiltered queryset from table statistics, or None. """
+        query = queryset.query
+        connection = connections[queryset.db]
+        if connection.vendor != 'mysql' or query.where or query.combinator or query.distinct:
+            return None
+        if query.low_mark or query.high_mark is not None:
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
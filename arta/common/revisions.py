@@ -0,0 +1,48 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.db import router
+from django.utils import timezone
+from django.utils.encoding import force_str
+from reversion.models import Revision, Version
+from reversion.revisions import _get_options
+from reversion.signals import post_revision_commit
+
+
+def bulk_create_revision(objects, user=None, comment='', batch_size=500):
+    """
+    Saves a single revision containing a version of each of the given objects, using bulk inserts.
+
+    This is an alternative to reversion.create_revision() and add_to_revision() for (many) objects at once, which
+    saves every version with a separate query and follows relations for every object separately (i.e. more queries).
+    Relations are *not* followed here, so any related objects that should be part of the revision must be passed
+    explicitly. Objects must be registered with reversion and should exist in the database already. Like
+    create_revision(), this sends the post_revision_commit signal afterwards.
+
+    Returns the revision, or None when no objects were given.
+    """
+    objects = list(objects)
+    if not objects:
+        return None
+
+    revision = Revision.objects.create(date_created=timezone.now(), user=user, comment=comment)
+    versions = []
+    for obj in objects:
+        # There is no public API to get the registration options, but this is what reversion itself uses as well
+        version_options = _get_options(obj.__class__)
+        versions.append(Version(
+            revision=revision,
+            content_type=ContentType.objects.get_for_model(obj.__class__),
+            object_id=force_str(obj.pk),
+            db=router.db_for_write(obj.__class__, instance=obj),
+            format=version_options.format,
+            serialized_data=serializers.serialize(
+                version_options.format,
+                (obj,),
+                fields=version_options.fields,
+                use_natural_foreign_keys=version_options.use_natural_foreign_keys,
+            ),
+            object_repr=force_str(obj),
+        ))
+    Version.objects.bulk_create(versions, batch_size=batch_size)
+    post_revision_commit.send(sender=bulk_create_revision, revision=revision, versions=versions)
+    return revision
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import cached_property
+
+
+class PrivateStorage(FileSystemStorage):
+    """
+    File storage for files that must only be served through views that check permissions.
+
+    Files are stored in PRIVATE_MEDIA_ROOT (rather than MEDIA_ROOT, which the web server serves publicly at MEDIA_URL)
+    and have no URL, so they cannot be linked to directly.
+    """
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'PRIVATE_MEDIA_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PRIVATE_MEDIA_ROOT)
+
+    @cached_property
+    def base_url(self):
+        # Makes url() raise an error
+        return None
+
+
+private_storage = PrivateStorage()
@@ -0,0 +1,79 @@
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db import transaction
+
+# Cache backends that do not share their contents between processes, so cannot store version counters in production
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def _cache_key(key):
+    return 'version:{}:{}'.format(*key)
+
+
+def _initial_version():
+    # When a counter is missing (never used, or evicted from the cache), start at the current time in microseconds
+    # rather than at zero, so a counter never returns to a value that was handed out before.
+    return int(time.time() * 1000000)
+
+
+def get_versions(keys):
+    """
+    Returns the current version of each of the given keys, as a list.
+
+    Keys are (name, pk) tuples, e.g. ('user', 1). Versions are opaque integers that change whenever bump_versions() is
+    called for the same key. This only reads from the cache (a single get_many, unless counters need to be created).
+    """
+    cache_keys = [_cache_key(key) for key in keys]
+    found = cache.get_many(cache_keys)
+    for cache_key in cache_keys:
+        if cache_key not in found:
+            cache.add(cache_key, _initial_version(), timeout=None)
+            # Another process might have added it just before us
+            found[cache_key] = cache.get(cache_key)
+    return [found[cache_key] for cache_key in cache_keys]
+
+
+def _bump(cache_keys):
+    for cache_key in cache_keys:
+        try:
+            cache.incr(cache_key)
+        except ValueError:
+            # Not in the cache (anymore), so nobody can have the old version either
+            cache.add(cache_key, _initial_version(), timeout=None)
+
+
+def bump_versions(keys):
+    """
+    Changes the versions of the given keys (see get_versions), to be called when the data they represent changes.
+
+    Versions are bumped immediately, and again when the current transaction commits. The first makes sure that
+    anything generated before the change is invalidated, the second that anything generated by others while the
+    transaction was still running (i.e. using the old data, but the new version) is invalidated as well.
+    """
+    cache_keys = [_cache_key(key) for key in keys]
+    _bump(cache_keys)
+    transaction.on_commit(lambda: _bump(cache_keys))
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """
+    System check that the default cache is shared between processes.
+
+    Otherwise, bumping a version is only seen by the process that made the change, and all other processes keep using
+    their own (outdated) versions, e.g. answering conditional requests with 304 Not Modified for changed data. This
+    is only a deployment check (manage.py check --deploy), since a single development server can use a local cache.
+    """
+    backend = settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            "The default cache ({}) is not shared between processes, but stores version counters".format(backend),
+            hint="Configure CACHES to use a shared cache, e.g. memcached.",
+            id='arta.E001',
+        )]
+    return []
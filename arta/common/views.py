@@ -1,6 +1,11 @@
+from django.core.paginator import InvalidPage
+from django.http import Http404
 from django.utils.functional import cached_property
 from django.views.decorators.http import condition
 
+from arta.common.pagination import KeysetPaginator
+from arta.common.versions import get_versions
+
 
 # TODO: Move these mixins to a more general place
 class ConditionalMixin:
@@ -27,49 +32,50 @@ class ConditionalMixin:
         return func(self.request)
 
 
-class CacheUsingTimestampsMixin(ConditionalMixin):
-    """ Generate and process ETag HTTP headers to help browsers validate their cached responses. """
+class CacheUsingVersionsMixin(ConditionalMixin):
+    """
+    Generate and process ETag HTTP headers using version counters (see arta.common.versions).
 
-    def instances_used(self):
-        """
-        Should return (or generate) querysets for all model instances used by this view.
+    This does not need any database queries to check whether a response is still valid, only (one or two) cache reads.
+    """
 
-        Each instance should have an updated_at field. These querysets are not actually evaluated directly, but union'd
-        together and only their updated_at fields are used without constructing full instances.
+    def versions_used(self):
+        """
+        Should return (or generate) version keys for all data used by this view.
 
-        If None or an empty list is returned, no caching is applied.
+        If None is returned, no caching is applied.
         """
         return None
 
-    # This uses last_modified to generate the ETag, but does not set the Last-Modified header, since that only has
-    # one-second granularity (so there is a chance of stale data persisting infinitely), and it does not allow adding
-    # more data.
+    def state_used(self):
+        """ Should return (or generate) any other values (e.g. based on the current time) used by this view. """
+        return ()
 
     @cached_property
     def etag(self):
-        query_sets = self.instances_used()
-        if query_sets is None:
+        keys = self.versions_used()
+        if keys is None:
             return None
 
-        query_sets = [
-            # Not all databases support order_by inside union, so clear that
-            qs.order_by().values_list('updated_at')
-            for qs in query_sets
-        ]
-        union = query_sets[0].union(*query_sets[1:])
-        # This would be more efficient as a MAX() in SQL, but this does not seem to work in Django 2.2.12.
-        # It does seem that that taking the aggregate of a union is supported (a lot of other stuff is explicitly
-        # forbidden, see https://github.com/django/django/pull/11591). However, because we use a flat values_list
-        # before the union, we also do not have any field name here...) TODO: Test in Django 3
-        # last_modified = union.aggregate(Max('updated_at')).values_list('updated_at__max', flat=True)
-        updated_ats = union.values_list('updated_at', flat=True)
-        last_modified = max(updated_ats)
-        count = len(updated_ats)
-
-        # TODO: Include server startup time (i.e. code identity)?
-        # TODO: Should this just create a hash of (model, id, timestamp) for each instance used? Together with other
-        # data such as registration_is_open and preregistration_is_open?
-
-        # Use the last_modified timestampas an etag, but add the user id to handle changing login and the object count
-        # to handle deletions.
-        return "{}-{}-{}".format(self.request.user.id, count, last_modified.isoformat())
+        # Include the user id to handle changing login
+        return "-".join(str(v) for v in [self.request.user.id, *get_versions(list(keys)), *self.state_used()])
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin that paginates using a KeysetPaginator, ordered by keyset_ordering.
+
+    The cursor of the current page is passed in the cursor_kwarg GET parameter. The page_obj passed to the template is
+    a KeysetPage, which only links to the next page (see core/snippets/pagination.html).
+    """
+
+    keyset_ordering = None
+    cursor_kwarg = 'after'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
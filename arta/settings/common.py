@@ -68,6 +68,10 @@ STATIC_ROOT = join(PROJECT_ROOT, 'run', 'static')
 # collect media files here
 MEDIA_ROOT = join(PROJECT_ROOT, 'run', 'media')
 
+# store files that must only be served through views that check permissions here (see arta.common.storage), this must
+# not be served by the web server
+PRIVATE_MEDIA_ROOT = join(PROJECT_ROOT, 'run', 'private')
+
 # look for static assets here
 STATICFILES_DIRS = [
     join(PROJECT_ROOT, 'static'),
@@ -266,6 +270,40 @@ CRISPY_FAIL_SILENTLY = False
 # ##### IMPORT EXPORT #####################################
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
+# ##### REGISTRATIONS #####################################
+# When enabled, the final check does not finalize registrations directly, but queues them to be processed in order by
+# the process_finalize_queue management command (one per event). This must be running when registration opens.
+REGISTRATION_FINALIZE_QUEUE = False
+# Number of seconds between refreshes of the page shown while a queued registration is being processed.
+REGISTRATION_FINALIZE_POLL_INTERVAL = 2
+# Maximum number of seconds between checks for changes of the registration opening status (see
+# apps.registrations.opening). Opening itself is announced at the exact moment, this is for other changes (e.g. options
+# becoming full).
+REGISTRATION_OPENING_POLL_INTERVAL = 5
+# Number of threads used to run the normal Django views when served using ASGI (see arta/asgi.py). Together with the
+# database connection per thread, this is what limits memory usage, waiting connections only cost a bit of memory.
+ASGI_THREADS = 10
+# Number of seconds the rendered events on the dashboard are cached (keyed on versions, so changes show up
+# immediately, see apps.core.views.Dashboard). Use the warm_dashboard_cache management command to fill the cache
+# (which only works with a shared cache, see below).
+DASHBOARD_FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+# Number of seconds the groups and superuser status of a user are cached (keyed on versions, so changes show up
+# immediately, see apps.events.models.event.UserContext). The timeout only limits the impact of changes that do not
+# bump the user version.
+USER_CONTEXT_CACHE_TIMEOUT = 60
+# Note that the ETags for the final check and the dashboard cache keys use version counters stored in the default
+# cache (see arta.common.versions), so when running multiple processes, CACHES must be configured to use a shared
+# cache (as done in production.py) rather than the default per-process local memory cache. This is verified by
+# `manage.py check --deploy`.
+
+# ##### EVENTS ##########################################
+# When enabled, spreadsheet downloads for organizers do not generate the export directly, but queue it to be processed
+# by the process_export_queue management command (the download page shows the status meanwhile). Either way, exports
+# are stored in PRIVATE_MEDIA_ROOT and served again as long as the exported data is unchanged.
+EVENT_EXPORT_QUEUE = False
+# Number of seconds between refreshes of the page shown while a queued export is being generated.
+EVENT_EXPORT_POLL_INTERVAL = 2
+
 # ##### UNIT TESTING ######################################
 TEST_RUNNER = 'arta.testrunner.CustomRunner'
 
@@ -57,6 +57,11 @@ LOGGING = {
             'handlers': ['console', 'mail_admins'],
             'level': 'INFO',
         },
+        # Errors logged by our own code (e.g. by the queue processing management commands)
+        'apps': {
+            'handlers': ['console', 'mail_admins'],
+            'level': 'INFO',
+        },
     },
 }
 
@@ -75,6 +80,17 @@ DATABASES = {
     },
 }
 
+# ##### CACHE CONFIGURATION ###############################
+# Version counters (used for ETags and cache keys, see arta.common.versions) must be shared by all uwsgi workers and
+# management commands, so use memcached rather than the default local memory cache (which is per process).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': 'arta',
+    },
+}
+
 # ##### SECURITY CONFIGURATION ############################
 
 # Note: Webserver guarantees only secure requests are processed and the
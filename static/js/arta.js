@@ -27,4 +27,42 @@ $(function() {
         update()
         select.change(update)
     })
+
+    // On the final check page before registration opens, reload the
+    // page when the opening status changes (i.e. when registration
+    // opens). This subscribes to a stream of server-sent events, or
+    // falls back to polling when the browser does not support that.
+    $("[data-opening-key]").each(function() {
+        var elem = $(this)
+        var key = elem.attr('data-opening-key')
+        var interval = parseFloat(elem.attr('data-opening-poll-interval'))
+        function changed(status) {
+            if (status.key == key)
+                return false;
+            window.location.reload()
+            return true;
+        }
+
+        if (window.EventSource) {
+            var source = new EventSource(elem.attr('data-opening-stream'))
+            source.onmessage = function(e) {
+                if (changed(JSON.parse(e.data)))
+                    source.close()
+            }
+        } else {
+            function poll() {
+                $.getJSON(elem.attr('data-opening-status')).done(function(status) {
+                    if (changed(status))
+                        return;
+                    var delay = interval
+                    if (status.changes_in !== null)
+                        delay = Math.min(delay, status.changes_in)
+                    setTimeout(poll, delay * 1000)
+                }).fail(function() {
+                    setTimeout(poll, interval * 1000)
+                })
+            }
+            poll()
+        }
+    })
 })